@@ -13,6 +13,8 @@ from database import Database
 from CASClient import CASClient
 from config import APP_SECRET_KEY
 from waitlist import Waitlist
+from identitymap import begin_request_scope, end_request_scope, get_identity_map
+from querystats import begin_query_scope, end_query_scope, get_query_scope
 from app_helper import (
     do_search,
     pull_course,
@@ -45,6 +47,55 @@ def handle_exception(e):
     return render_template("error.html")
 
 
+# each request gets its own identity map so that course, enrollment, user,
+# and waitlist documents are fetched at most once per request
+@app.before_request
+def begin_identity_map():
+    begin_request_scope()
+
+
+@app.after_request
+def report_identity_map(response):
+    imap = get_identity_map()
+    if imap is not None:
+        response.headers["X-TigerSnatch-Queries-Saved"] = str(imap.n_hits)
+        if app.debug:
+            print(
+                f"{request.path}: identity map saved {imap.n_hits} queries "
+                f"({imap.n_misses} issued)"
+            )
+    return response
+
+
+@app.teardown_request
+def end_identity_map(exc):
+    end_request_scope()
+
+
+# each request is a query scope so that its MongoDB commands are counted
+# under its route and checked against the route's entry in QUERY_BUDGETS
+@app.before_request
+def begin_query_stats():
+    begin_query_scope(request.url_rule.rule if request.url_rule else request.path)
+
+
+@app.after_request
+def report_query_stats(response):
+    scope = get_query_scope()
+    if scope is not None:
+        response.headers["X-TigerSnatch-Queries"] = str(scope.n_commands)
+    return response
+
+
+# ends the query scope even if the request raised (after_request is then
+# skipped), so the scope never leaks into the next request on the thread
+@app.teardown_request
+def end_query_stats(exc):
+    scope = end_query_scope()
+    if scope is not None and app.debug:
+        print(f"{request.path}: issued {scope.n_commands} MongoDB commands")
+
+
 # private method that redirects to landing page
 # if user is not logged in with CAS
 # or if user is logged in with CAS, but doesn't have entry in DB
@@ -12,7 +12,7 @@ from sys import path
 path.append("src")  # noqa
 
 from send_notifs import *
-from _exec_update_all_courses import do_update_async_SOFT, do_update_async_HARD
+from _exec_update_all_courses import do_update_async_SYNC, do_update_async_HARD
 from datetime import datetime
 from sys import stderr
 import pytz
@@ -21,6 +21,7 @@ from config import (
     NOTIFS_SHEET_POLL_MINS,
     GLOBAL_COURSE_UPDATE_INTERVAL_MINS,
     STATS_INTERVAL_MINS,
+    STATS_RECONCILE_INTERVAL_MINS,
 )
 from apscheduler.schedulers.blocking import BlockingScheduler
 from apscheduler.schedulers.background import BackgroundScheduler
@@ -35,17 +36,17 @@ def schedule_jobs(update_db=False):
         set_status_indicator_to_off(log=False)
         tz = pytz.timezone("US/Eastern")
 
-        print("[Scheduler] adding global soft course update job at 4am ET daily")
+        print("[Scheduler] adding global course sync job at 4am ET daily")
         sched.add_job(
-            do_update_async_SOFT,
+            do_update_async_SYNC,
             "cron",
             hour="4",
             timezone=tz,
         )
 
-        print("[Scheduler] adding global soft course update job at 5am ET daily")
+        print("[Scheduler] adding global course sync job at 5am ET daily")
         sched.add_job(
-            do_update_async_SOFT,
+            do_update_async_SYNC,
             "cron",
             hour="5",
             timezone=tz,
@@ -58,6 +59,18 @@ def schedule_jobs(update_db=False):
             minutes=STATS_INTERVAL_MINS,
         )
 
+        print(
+            "[Scheduler] adding stats counters reconciliation job every",
+            STATS_RECONCILE_INTERVAL_MINS,
+            "mins",
+        )
+        sched.add_job(
+            reconcile_stats,
+            "interval",
+            minutes=STATS_RECONCILE_INTERVAL_MINS,
+            next_run_time=datetime.now(tz),
+        )
+
         print(
             "[Scheduler] adding global hard course update job every",
             GLOBAL_COURSE_UPDATE_INTERVAL_MINS,
@@ -0,0 +1,100 @@
+# ----------------------------------------------------------------------
+# _exec_benchmark_course_parsing.py
+# Compares the peak memory (measured with tracemalloc) and time of
+# reading a recorded MobileApp courses/courses response by loading the
+# whole text and parsing it with json.loads, as MobileApp.get_courses()
+# does, against streaming it in chunks with iter_term_courses() (see
+# jsonstream.py), as MobileApp.iter_courses() does. Both walk every
+# course of the response.
+#
+# Specify --record to first save the response for all departments of the
+# current term to the file (requires MobileApp credentials).
+#
+# Example: python _exec_benchmark_course_parsing.py --record courses.json
+#          python _exec_benchmark_course_parsing.py courses.json
+# ----------------------------------------------------------------------
+
+import json
+import tracemalloc
+from os.path import getsize
+from sys import argv, exit
+from time import time
+from jsonstream import iter_term_courses
+from mobileapp import STREAM_CHUNK_BYTES
+
+
+# saves the raw courses/courses response for all departments of the
+# current term to path
+def record(path):
+    from database import Database
+    from mobileapp import MobileApp
+    from update_all_courses_utils import get_all_dept_codes
+
+    term = Database().get_current_term_code()[0]
+    api = MobileApp()
+    dept_codes = ",".join(get_all_dept_codes(term))
+    req, chunks = api._stream(
+        api.configs.COURSE_COURSES, term=term, subject=dept_codes, fmt="json"
+    )
+    with open(path, "wb") as f:
+        for chunk in chunks:
+            f.write(chunk)
+    req.close()
+
+
+def parse_whole(path):
+    with open(path, encoding="utf-8") as f:
+        data = json.loads(f.read())
+    n_courses = 0
+    if "subjects" in data["term"][0]:
+        for subject in data["term"][0]["subjects"]:
+            for course in subject["courses"]:
+                n_courses += 1
+    return n_courses
+
+
+def parse_streamed(path):
+    def chunks():
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(STREAM_CHUNK_BYTES)
+                if chunk == b"":
+                    return
+                yield chunk
+
+    n_courses = 0
+    for subject, course in iter_term_courses(chunks()):
+        n_courses += 1
+    return n_courses
+
+
+# runs fn(path) and returns (result, elapsed seconds, peak traced bytes)
+def measure(fn, path):
+    tracemalloc.start()
+    start = time()
+    res = fn(path)
+    elapsed = time() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return res, elapsed, peak
+
+
+if __name__ == "__main__":
+    args = [arg for arg in argv[1:] if not arg.startswith("--")]
+    if len(args) != 1:
+        print("specify the path of the recorded response")
+        exit(2)
+    path = args[0]
+
+    if "--record" in argv[1:]:
+        record(path)
+        print(f"recorded {path}")
+
+    size = getsize(path)
+    print(f"payload: {size / 2**20:.1f} MiB")
+    for label, fn in (("json.loads", parse_whole), ("streamed", parse_streamed)):
+        n_courses, elapsed, peak = measure(fn, path)
+        print(
+            f"{label:<12} {n_courses:>6} courses {elapsed:>8.2f} s "
+            f"peak {peak / 2**20:>8.1f} MiB ({peak / size:.1f}x payload)"
+        )
@@ -0,0 +1,230 @@
+# ----------------------------------------------------------------------
+# _exec_benchmarks.py
+# Read-only micro-benchmarks for batched Database methods. Each benchmark
+# compares a per-item loop against its batched counterpart on the
+# classids that already exist in the database, and reports wall time and
+# the number of MongoDB round-trips (counted with a command listener).
+#
+# Specify one or more of the following flags:
+#   --classinfo: classid_to_classinfo vs. classid_to_classinfo_many
+#   --dashboard: get_dashboard_data for a user with MAX_WAITLIST_SIZE
+#                subscriptions vs. the previous per-section implementation
+#   --course: course page assembly (pull_course) for the largest courses
+#             vs. the previous per-section implementation
+#
+# Example: python _exec_benchmarks.py --classinfo
+# ----------------------------------------------------------------------
+
+from sys import argv, exit
+from time import time
+from pymongo import monitoring
+
+SIZES = (10, 100, 1000)
+
+
+# counts commands sent to MongoDB; must be registered before the first
+# MongoClient is created
+class CommandCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.n_commands = 0
+
+    def started(self, event):
+        self.n_commands += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+counter = CommandCounter()
+monitoring.register(counter)
+
+from config import MAX_WAITLIST_SIZE
+from database import Database
+from schema import get_course_class, get_course_classes, get_course_details
+
+
+# runs fn() and returns (result, elapsed seconds, number of round-trips)
+def measure(fn):
+    n_before = counter.n_commands
+    start = time()
+    res = fn()
+    return res, time() - start, counter.n_commands - n_before
+
+
+def print_row(label, n, elapsed, n_trips):
+    print(f"{label:<28} n={n:<6} {elapsed * 1000:>10.1f} ms {n_trips:>6} round-trips")
+
+
+def bench_classinfo(db):
+    classids = [
+        e["classid"]
+        for e in db._db.enrollments.find({}, {"_id": 0, "classid": 1}).limit(max(SIZES))
+    ]
+
+    def loop(classids):
+        res = {}
+        for classid in classids:
+            try:
+                res[classid] = db.classid_to_classinfo(classid)
+            except:
+                continue
+        return res
+
+    for n in SIZES:
+        if n > len(classids):
+            break
+        sample = classids[:n]
+        expected, elapsed, n_trips = measure(lambda: loop(sample))
+        print_row("classid_to_classinfo", n, elapsed, n_trips)
+        res, elapsed, n_trips = measure(lambda: db.classid_to_classinfo_many(sample))
+        print_row("classid_to_classinfo_many", n, elapsed, n_trips)
+        if res != expected:
+            print("batched result differs from per-item result")
+            exit(1)
+
+
+# the per-section implementation of get_dashboard_data that
+# bench_dashboard compares against (3 round-trips per subscription)
+def get_dashboard_data_per_section(db, waitlists):
+    dashboard_data = {}
+    for classid in waitlists:
+        class_stats = db.get_class_enrollment(classid)
+        if class_stats is None:
+            continue
+        courseid = class_stats["courseid"]
+        course_data = db.get_course(courseid)
+        class_data = (
+            None if course_data is None else get_course_class(course_data, classid)
+        )
+        if class_data is None:
+            continue
+        time_of_last_notif = db.get_time_of_last_notif(classid)
+        dashboard_data[classid] = {
+            "courseid": courseid,
+            "displayname": course_data["displayname"],
+            "section": class_data["section"],
+            "start_time": class_data["start_time"],
+            "end_time": class_data["end_time"],
+            "days": class_data["days"],
+            "enrollment": class_stats["enrollment"],
+            "capacity": class_stats["capacity"],
+            "time_of_last_notif": (
+                time_of_last_notif if time_of_last_notif is not None else "-"
+            ),
+        }
+    return dashboard_data
+
+
+def bench_dashboard(db):
+    waitlists = [
+        e["classid"]
+        for e in db._db.enrollments.find({}, {"_id": 0, "classid": 1}).limit(
+            MAX_WAITLIST_SIZE
+        )
+    ]
+
+    # stand in for a user subscribed to waitlists without writing one
+    db._find_user = lambda netid: {"netid": netid}
+    db.get_user_waitlists = lambda netid: waitlists
+
+    expected, elapsed, n_trips = measure(
+        lambda: get_dashboard_data_per_section(db, waitlists)
+    )
+    print_row("get_dashboard_data (old)", len(waitlists), elapsed, n_trips)
+    res, elapsed, n_trips = measure(lambda: db.get_dashboard_data("benchmark"))
+    print_row("get_dashboard_data", len(waitlists), elapsed, n_trips)
+    del db._find_user
+    del db.get_user_waitlists
+    if res != expected:
+        print("get_dashboard_data result differs from per-section result")
+        exit(1)
+
+
+# the per-section course page assembly that bench_course compares against
+# (3 round-trips per section)
+def get_course_page_per_section(db, courseid):
+    course = db.get_course(courseid)
+    has_reserved_seats = course["has_reserved_seats"]
+    classes_list = []
+    for curr_class in get_course_classes(course):
+        class_data = db.get_class_enrollment(curr_class["classid"])
+        curr_class["enrollment"] = class_data["enrollment"]
+        curr_class["capacity"] = class_data["capacity"]
+        curr_class["isFull"] = (
+            (
+                curr_class["capacity"] > 0
+                and curr_class["enrollment"] >= curr_class["capacity"]
+            )
+            or (has_reserved_seats and curr_class["enrollment"] > 0)
+            or not curr_class["status_is_open"]
+        )
+        try:
+            curr_class["wl_size"] = db.get_class_waitlist_size(curr_class["classid"])
+        except Exception:
+            curr_class["wl_size"] = 0
+        time_of_last_notif = db.get_time_of_last_notif(curr_class["classid"])
+        curr_class["time_of_last_notif"] = (
+            time_of_last_notif if time_of_last_notif is not None else "-"
+        )
+        classes_list.append(curr_class)
+    return get_course_details(course), classes_list
+
+
+# the batched course page assembly done by pull_course (without the
+# Monitor refresh, which hits the Registrar's API)
+def get_course_page(db, courseid):
+    course = db.get_course_with_enrollment(courseid)
+    classes_list = get_course_classes(course)
+    waitlist_sizes = db.get_class_waitlist_sizes(
+        curr_class["classid"] for curr_class in classes_list
+    )
+    for curr_class in classes_list:
+        curr_class["wl_size"] = waitlist_sizes.get(curr_class["classid"], 0)
+    return get_course_details(course), classes_list
+
+
+def bench_course(db):
+    # courses with the most sections
+    courseids = [
+        e["_id"]
+        for e in db._db.enrollments.aggregate(
+            [
+                {"$group": {"_id": "$courseid", "n": {"$sum": 1}}},
+                {"$sort": {"n": -1}},
+                {"$limit": 3},
+            ]
+        )
+    ]
+
+    for courseid in courseids:
+        expected, elapsed, n_trips = measure(
+            lambda: get_course_page_per_section(db, courseid)
+        )
+        n = len(expected[1])
+        print_row(f"course {courseid} (old)", n, elapsed, n_trips)
+        res, elapsed, n_trips = measure(lambda: get_course_page(db, courseid))
+        print_row(f"course {courseid}", n, elapsed, n_trips)
+        if res != expected:
+            print(f"course page for {courseid} differs from per-section result")
+            exit(1)
+
+
+BENCHMARKS = {
+    "--classinfo": bench_classinfo,
+    "--dashboard": bench_dashboard,
+    "--course": bench_course,
+}
+
+if __name__ == "__main__":
+    flags = argv[1:]
+    if len(flags) == 0 or any(flag not in BENCHMARKS for flag in flags):
+        print("specify one or more of:", " ".join(BENCHMARKS))
+        exit(2)
+
+    db = Database()
+    for flag in flags:
+        print(f"--- {flag[2:]} ---")
+        BENCHMARKS[flag](db)
@@ -0,0 +1,116 @@
+# ----------------------------------------------------------------------
+# _exec_check_indexes.py
+# Regression check for the indexes declared in schema.py: builds them in
+# a scratch database, runs explain() on every hot query shape used by
+# database.py, and fails if any of them falls back to a collection scan.
+#
+# Point DB_CONNECTION_STR at a local mongod before running; the scratch
+# database (tigersnatch_index_check) is dropped afterwards.
+#
+# Example: python _exec_check_indexes.py
+# ----------------------------------------------------------------------
+
+from sys import exit, stderr
+from datetime import datetime
+from pymongo import MongoClient
+from config import DB_CONNECTION_STR
+from connection import ensure_indexes
+
+SCRATCH_DB_NAME = "tigersnatch_index_check"
+
+# (collection, filter) for every hot lookup in database.py
+QUERY_SHAPES = (
+    ("users", {"netid": "abc123"}),
+    ("enrollments", {"classid": "12345"}),
+    ("enrollments", {"courseid": "001234"}),
+    ("subscriptions", {"netid": "abc123"}),
+    ("subscriptions", {"classid": "12345"}),
+    ("subscriptions", {"courseid": "001234"}),
+    ("subscriptions", {"netid": "abc123", "classid": "12345"}),
+    ("subscriptions", {"classid": {"$in": ["12345"]}}),
+    ("mappings", {"courseid": "001234"}),
+    ("courses", {"courseid": "001234"}),
+    ("courses", {"classes.classid": "12345"}),
+    ("subscriptions", {"classid": "12345", "n_open_spots": {"$ne": 0}}),
+    ("subscriptions", {"classid": "12345", "netid": {"$in": ["abc123"]}}),
+    ("logs", {"netid": "abc123"}),
+    ("system", {"type": "cron"}),
+    ("system", {"type": "cron", "time": {"$gt": datetime(2022, 4, 11)}}),
+    ("system", {"time": {"$gt": datetime(2022, 4, 11)}}),
+)
+
+
+# returns the names of all stages in an explain() plan tree
+def get_plan_stages(plan):
+    stages = [plan.get("stage")]
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            stages.extend(get_plan_stages(plan[key]))
+    for child in plan.get("inputStages", []):
+        stages.extend(get_plan_stages(child))
+    return stages
+
+
+# inserts a handful of documents so that the query planner has real
+# (if tiny) collections to work with
+def seed(db):
+    for i in range(20):
+        netid = f"user{i}"
+        classid = str(10000 + i)
+        courseid = f"{i:06d}"
+        db.users.insert_one({"netid": netid, "num_subscriptions": 1})
+        db.enrollments.insert_one({"classid": classid, "courseid": courseid})
+        db.subscriptions.insert_one(
+            {
+                "netid": netid,
+                "classid": classid,
+                "courseid": courseid,
+                "time": datetime.now(),
+                "n_open_spots": 0,
+                "last_notif": datetime.now(),
+            }
+        )
+        db.mappings.insert_one({"courseid": courseid, "displayname": f"COS{i}"})
+        db.courses.insert_one(
+            {
+                "courseid": courseid,
+                "displayname": f"COS{i}",
+                "classes": [{"classid": classid, "section": "L01"}],
+            }
+        )
+        db.logs.insert_one({"netid": netid, "waitlist_log": [], "trade_log": []})
+        db.system.insert_one({"type": "cron", "time": datetime.now()})
+
+
+def check_query_shapes(db):
+    n_failed = 0
+    for coll, query in QUERY_SHAPES:
+        plan = db[coll].find(query).explain()["queryPlanner"]["winningPlan"]
+        stages = get_plan_stages(plan)
+        if "COLLSCAN" in stages:
+            print(f"FAIL {coll} {query}: {' <- '.join(stages)}", file=stderr)
+            n_failed += 1
+        else:
+            print(f"ok   {coll} {query}: {' <- '.join(stages)}")
+    return n_failed
+
+
+if __name__ == "__main__":
+    client = MongoClient(DB_CONNECTION_STR, serverSelectionTimeoutMS=5000)
+    client.drop_database(SCRATCH_DB_NAME)
+    db = client[SCRATCH_DB_NAME]
+
+    try:
+        status = ensure_indexes(db)
+        if len(status["failed"]) > 0:
+            print(f"failed to build indexes {status['failed']}", file=stderr)
+            exit(1)
+        seed(db)
+        n_failed = check_query_shapes(db)
+    finally:
+        client.drop_database(SCRATCH_DB_NAME)
+
+    if n_failed > 0:
+        print(f"{n_failed} query shape(s) fall back to a collection scan", file=stderr)
+        exit(1)
+    print("done")
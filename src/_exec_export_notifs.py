@@ -0,0 +1,170 @@
+# ----------------------------------------------------------------------
+# _exec_export_notifs.py
+# Exports the history of open-spot notifications to a compressed,
+# column-oriented NumPy file (.npz) with one row per section notified in
+# each run of the notifications script (see notifsdata.py for the
+# columns and the query API).
+#
+# Rows come from the "sent ... emails and texts" cron logs, streamed
+# with a cursor from the system collection and every system_archive_*
+# collection (see _exec_rollover_system_logs.py). Logs written since
+# per-section results were recorded (the "notifs" field) give exact
+# classids and n_sent; older logs only list section names, so their
+# classid is "" and their n_sent is -1 (unless a single section was
+# notified). Notification runs older than the oldest cron log are
+# recovered from the admin logs, which are parsed the same way.
+#
+# Optionally specify the output path (default: notifs.npz) and
+# --since YYYY-MM-DD to only export runs since that date (UTC).
+#
+# Example: python _exec_export_notifs.py notifs.npz --since 2022-09-01
+# ----------------------------------------------------------------------
+
+from sys import argv
+from time import time
+from datetime import datetime
+import re
+import pytz
+from database import Database, TZ
+from notifsdata import NotifsData
+
+BATCH_SIZE = 5000
+
+# matches "sent 12 emails and texts in 3 seconds (2 sections): COS 126 L01, ..."
+SENT_RE = re.compile(r"sent (\d+) emails and texts in \d+ seconds \((\d+) sections?\)")
+
+ADMIN_LOG_TIME_FMT = "%b %d, %Y @ %I:%M %p ET"
+
+
+class Columns:
+    def __init__(self):
+        self.time = []
+        self.classid = []
+        self.section = []
+        self.n_open_spots = []
+        self.n_sent = []
+
+    def append(self, time, classid, section, n_open_spots, n_sent):
+        self.time.append(time)
+        self.classid.append(classid)
+        self.section.append(section)
+        self.n_open_spots.append(n_open_spots)
+        self.n_sent.append(n_sent)
+
+    # appends one row per section listed in a legacy log message; returns
+    # False if message isn't a notification log
+
+    def append_message(self, time, message):
+        match = SENT_RE.search(message)
+        if match is None:
+            return False
+        parts = message.split(": ", 1)
+        if len(parts) < 2:
+            return True
+        sections = [s.strip() for s in parts[1].split(",") if s.strip() != ""]
+        n_sent = int(match.group(1)) if len(sections) == 1 else -1
+        for section in sections:
+            self.append(time, "", section, -1, n_sent)
+        return True
+
+    def extend(self, other):
+        self.time.extend(other.time)
+        self.classid.extend(other.classid)
+        self.section.extend(other.section)
+        self.n_open_spots.extend(other.n_open_spots)
+        self.n_sent.extend(other.n_sent)
+
+    def to_notifs_data(self):
+        return NotifsData(
+            self.time, self.classid, self.section, self.n_open_spots, self.n_sent
+        )
+
+
+def get_system_collections(db):
+    archives = sorted(
+        name
+        for name in db.list_collection_names()
+        if name.startswith("system_archive_")
+    )
+    return archives + ["system"]
+
+
+# streams notification logs from coll into cols; returns the time of the
+# oldest log read (or None)
+def export_system_logs(db, coll, cols, since):
+    query = {"type": "cron", "message": {"$regex": "sent [0-9]+ emails"}}
+    if since is not None:
+        query["time"] = {"$gte": since}
+    cursor = (
+        db[coll]
+        .find(query, {"_id": 0, "time": 1, "message": 1, "notifs": 1})
+        .sort("time", 1)
+        .batch_size(BATCH_SIZE)
+    )
+
+    oldest = None
+    for doc in cursor:
+        if oldest is None:
+            oldest = doc["time"]
+        if "notifs" not in doc:
+            cols.append_message(doc["time"], doc["message"])
+            continue
+        for notif in doc["notifs"]:
+            cols.append(
+                doc["time"],
+                notif["classid"],
+                notif["section"],
+                notif["n_open_spots"],
+                notif["n_sent"],
+            )
+    return oldest
+
+
+# adds notification runs from the admin logs that happened before until
+def export_admin_logs(db, cols, since, until):
+    logs = db.admin.find_one({}, {"_id": 0, "logs": 1}).get("logs", [])
+    # admin logs are stored newest first
+    for log in reversed(logs):
+        try:
+            log_time, message = log.split(" \u2192 ", 1)
+            log_time = TZ.localize(datetime.strptime(log_time, ADMIN_LOG_TIME_FMT))
+        except ValueError:
+            continue
+        log_time = log_time.astimezone(pytz.utc).replace(tzinfo=None)
+        if since is not None and log_time < since:
+            continue
+        if until is not None and log_time >= until:
+            continue
+        cols.append_message(log_time, message)
+
+
+if __name__ == "__main__":
+    args = argv[1:]
+    since = None
+    if "--since" in args:
+        i = args.index("--since")
+        since = datetime.strptime(args[i + 1], "%Y-%m-%d")
+        del args[i : i + 2]
+    path = args[0] if len(args) > 0 else "notifs.npz"
+
+    tic = time()
+    db = Database()._db
+    cols = Columns()
+
+    oldest = None
+    for coll in get_system_collections(db):
+        n_before = len(cols.time)
+        coll_oldest = export_system_logs(db, coll, cols, since)
+        if oldest is None or (coll_oldest is not None and coll_oldest < oldest):
+            oldest = coll_oldest
+        print(f"{coll}: {len(cols.time) - n_before} row(s)")
+
+    # admin logs before the first cron log are the only record of those runs
+    admin_cols = Columns()
+    export_admin_logs(db, admin_cols, since, oldest)
+    print(f"admin logs: {len(admin_cols.time)} row(s)")
+
+    admin_cols.extend(cols)
+    data = admin_cols.to_notifs_data()
+    data.save(path)
+    print(f"wrote {len(data)} row(s) to {path} in {time() - tic:.1f}s")
@@ -0,0 +1,93 @@
+# ----------------------------------------------------------------------
+# _exec_migrate_course_classes.py
+# One-time migration of course documents from the legacy section layout,
+# where each section is stored under a dynamic "class_<classid>" key:
+#   {"courseid": ..., "class_12345": {"classid": "12345", ...}, ...}
+# to the "classes" array layout, which keeps sections in display order
+# and is indexed on classes.classid:
+#   {"courseid": ..., "classes": [{"classid": "12345", ...}, ...]}
+#
+# The app reads both layouts (see get_course_classes() in schema.py) and
+# rewrites a course in the new layout whenever it refreshes it, so this
+# may run before or after deploying. It is safe to re-run.
+#
+# Specify --dry-run to only print what would be migrated.
+#
+# Example: python _exec_migrate_course_classes.py --dry-run
+# ----------------------------------------------------------------------
+
+from sys import argv, exit, stderr
+import certifi
+from pymongo import MongoClient, UpdateOne
+from config import DB_CONNECTION_STR
+from connection import ensure_indexes
+from schema import LEGACY_CLASS_PREFIX, get_course_classes
+
+BATCH_SIZE = 500
+
+
+# returns the update that converts a legacy course document in place
+def get_migration(course):
+    legacy_keys = [k for k in course if k.startswith(LEGACY_CLASS_PREFIX)]
+    return UpdateOne(
+        {"_id": course["_id"], "classes": {"$exists": False}},
+        {
+            "$set": {"classes": get_course_classes(course)},
+            "$unset": {k: "" for k in legacy_keys},
+        },
+    )
+
+
+# converts every course without a classes array; returns the number of
+# courses converted
+def migrate(db, dry_run=False):
+    n_migrated = 0
+    batch = []
+    for course in db.courses.find({"classes": {"$exists": False}}):
+        n_migrated += 1
+        if dry_run:
+            continue
+        batch.append(get_migration(course))
+        if len(batch) == BATCH_SIZE:
+            db.courses.bulk_write(batch, ordered=False)
+            batch = []
+    if len(batch) > 0:
+        db.courses.bulk_write(batch, ordered=False)
+    return n_migrated
+
+
+# returns the courseids of courses that still have legacy section keys or
+# no classes array
+def verify(db):
+    bad = []
+    for course in db.courses.find({}):
+        if "classes" not in course or any(
+            k.startswith(LEGACY_CLASS_PREFIX) for k in course
+        ):
+            bad.append(course.get("courseid"))
+    return bad
+
+
+if __name__ == "__main__":
+    dry_run = "--dry-run" in argv[1:]
+    client = MongoClient(
+        DB_CONNECTION_STR, serverSelectionTimeoutMS=5000, tlsCAFile=certifi.where()
+    )
+    db = client.tigersnatch
+
+    n_migrated = migrate(db, dry_run)
+    print(f"{'found' if dry_run else 'migrated'} {n_migrated} legacy course(s)")
+    if dry_run:
+        exit(0)
+
+    bad = verify(db)
+    if len(bad) > 0:
+        print(f"{len(bad)} course(s) failed to migrate:", file=stderr)
+        print(bad, file=stderr)
+        exit(1)
+
+    status = ensure_indexes(db)
+    if len(status["failed"]) > 0:
+        print(f"failed to build indexes {status['failed']}", file=stderr)
+        exit(1)
+    print("done")
@@ -0,0 +1,108 @@
+# ----------------------------------------------------------------------
+# _exec_migrate_notifs_history.py
+# One-time migration of notification history from the notifs collection
+# (one document per user, keyed by classid:
+#   {"netid": ..., "<classid>": {"n_open_spots": ..., "last_notif": ...}})
+# into the subscriptions collection, whose documents (one per (netid,
+# classid), see _exec_migrate_subscriptions.py) now carry n_open_spots
+# and last_notif themselves. History entries without a matching
+# subscription are stale and are dropped. Once every entry is verified
+# to be in subscriptions, the notifs collection is dropped.
+#
+# Run this once, after _exec_migrate_subscriptions.py and before
+# deploying the code that reads history from subscriptions. It is safe
+# to re-run.
+#
+# Specify --dry-run to only print what would be migrated.
+#
+# Example: python _exec_migrate_notifs_history.py --dry-run
+# ----------------------------------------------------------------------
+
+from sys import argv, exit, stderr
+import certifi
+from pymongo import MongoClient, UpdateOne
+from config import DB_CONNECTION_STR
+
+BATCH_SIZE = 1000
+
+
+# returns {(netid, classid): {"n_open_spots": ..., "last_notif": ...}}
+# for every history entry in the notifs collection
+def get_legacy_history(db):
+    history = {}
+    for doc in db.notifs.find({}, {"_id": 0}):
+        netid = doc.pop("netid", None)
+        if netid is None:
+            continue
+        for classid, entry in doc.items():
+            if not isinstance(entry, dict):
+                continue
+            history[(netid, classid)] = {
+                k: entry[k] for k in ("n_open_spots", "last_notif") if k in entry
+            }
+    return history
+
+
+# copies history onto the matching subscriptions; returns the number of
+# subscriptions matched
+def migrate(db, history):
+    n_matched = 0
+    batch = []
+    for (netid, classid), entry in history.items():
+        if len(entry) == 0:
+            continue
+        batch.append(UpdateOne({"netid": netid, "classid": classid}, {"$set": entry}))
+        if len(batch) == BATCH_SIZE:
+            n_matched += db.subscriptions.bulk_write(batch, ordered=False).matched_count
+            batch = []
+    if len(batch) > 0:
+        n_matched += db.subscriptions.bulk_write(batch, ordered=False).matched_count
+    return n_matched
+
+
+# returns the history entries of existing subscriptions that are missing
+# from the subscriptions collection
+def verify(db, history):
+    missing = []
+    for sub in db.subscriptions.find(
+        {}, {"_id": 0, "netid": 1, "classid": 1, "n_open_spots": 1, "last_notif": 1}
+    ):
+        entry = history.get((sub["netid"], sub["classid"]))
+        if entry is not None and any(sub.get(k) != v for k, v in entry.items()):
+            missing.append((sub["netid"], sub["classid"]))
+    return missing
+
+
+if __name__ == "__main__":
+    dry_run = "--dry-run" in argv[1:]
+    client = MongoClient(
+        DB_CONNECTION_STR, serverSelectionTimeoutMS=5000, tlsCAFile=certifi.where()
+    )
+    db = client.tigersnatch
+
+    if "notifs" not in db.list_collection_names():
+        print("notifs collection not found - already migrated?")
+        exit(0)
+    if "waitlists" in db.list_collection_names():
+        print("run _exec_migrate_subscriptions.py first", file=stderr)
+        exit(1)
+
+    history = get_legacy_history(db)
+    print(f"found {len(history)} history entr{'ies' if len(history) != 1 else 'y'}")
+    if dry_run:
+        exit(0)
+
+    n_matched = migrate(db, history)
+    print(
+        f"migrated {n_matched} entries, dropped {len(history) - n_matched} without a subscription"
+    )
+
+    missing = verify(db, history)
+    if len(missing) > 0:
+        print(f"{len(missing)} entries failed to migrate:", file=stderr)
+        print(missing, file=stderr)
+        print("legacy data was left in place", file=stderr)
+        exit(1)
+
+    db.drop_collection("notifs")
+    print("done")
@@ -0,0 +1,152 @@
+# ----------------------------------------------------------------------
+# _exec_migrate_subscriptions.py
+# One-time migration from the array-based subscription storage (the
+# users.waitlists arrays and the waitlists collection) to the
+# subscriptions collection, which holds one document per (netid,
+# classid) pair:
+#   {"netid": ..., "classid": ..., "courseid": ..., "time": ...}
+#
+# Waitlist order is preserved through "time": entries of each class's
+# waitlist array get increasing times, and classids that appear only in
+# a user's waitlists array are appended after them. Once every
+# subscription is verified to be in the new collection, users get a
+# num_subscriptions counter, the users.waitlists arrays are removed, and
+# the waitlists collection is dropped.
+#
+# Run this once, before deploying the code that reads from
+# subscriptions (Database() refuses to start until the collections
+# match COLLECTIONS in config.py). It is safe to re-run.
+#
+# Specify --dry-run to only print what would be migrated.
+#
+# Example: python _exec_migrate_subscriptions.py --dry-run
+# ----------------------------------------------------------------------
+
+from sys import argv, exit, stderr
+from datetime import datetime, timedelta
+import certifi
+from pymongo import MongoClient
+from pymongo.errors import BulkWriteError
+from config import DB_CONNECTION_STR
+from connection import ensure_indexes
+
+# duplicate key error code (subscriptions that were already migrated)
+DUPLICATE_KEY = 11000
+
+
+# returns the list of (netid, classid) pairs to migrate, in waitlist order
+def get_legacy_subscriptions(db):
+    pairs = []
+    seen = set()
+    for waitlist in db.waitlists.find({}, {"_id": 0, "classid": 1, "waitlist": 1}):
+        for netid in waitlist["waitlist"]:
+            if (netid, waitlist["classid"]) not in seen:
+                seen.add((netid, waitlist["classid"]))
+                pairs.append((netid, waitlist["classid"]))
+
+    n_users_only = 0
+    for user in db.users.find({}, {"_id": 0, "netid": 1, "waitlists": 1}):
+        for classid in user.get("waitlists", []):
+            if (user["netid"], classid) not in seen:
+                seen.add((user["netid"], classid))
+                pairs.append((user["netid"], classid))
+                n_users_only += 1
+    if n_users_only > 0:
+        print(f"{n_users_only} subscription(s) found only in users.waitlists")
+
+    return pairs
+
+
+def build_documents(db, pairs):
+    classids = list({classid for _, classid in pairs})
+    courseids = {
+        e["classid"]: e["courseid"]
+        for e in db.enrollments.find(
+            {"classid": {"$in": classids}}, {"_id": 0, "classid": 1, "courseid": 1}
+        )
+    }
+
+    # Mongo dates have millisecond precision
+    start = datetime.utcnow()
+    return [
+        {
+            "netid": netid,
+            "classid": classid,
+            "courseid": courseids.get(classid),
+            "time": start + timedelta(milliseconds=i),
+        }
+        for i, (netid, classid) in enumerate(pairs)
+    ]
+
+
+def insert_documents(db, docs):
+    if len(docs) == 0:
+        return 0
+    try:
+        return len(db.subscriptions.insert_many(docs, ordered=False).inserted_ids)
+    except BulkWriteError as e:
+        errors = e.details["writeErrors"]
+        if any(error["code"] != DUPLICATE_KEY for error in errors):
+            raise
+        return e.details["nInserted"]
+
+
+# returns the pairs that are missing from the subscriptions collection
+def verify(db, pairs):
+    migrated = {
+        (s["netid"], s["classid"])
+        for s in db.subscriptions.find({}, {"_id": 0, "netid": 1, "classid": 1})
+    }
+    return [pair for pair in pairs if pair not in migrated]
+
+
+def finalize(db):
+    counts = {
+        e["_id"]: e["n"]
+        for e in db.subscriptions.aggregate(
+            [{"$group": {"_id": "$netid", "n": {"$sum": 1}}}]
+        )
+    }
+    for user in db.users.find({}, {"_id": 0, "netid": 1}):
+        db.users.update_one(
+            {"netid": user["netid"]},
+            {
+                "$set": {"num_subscriptions": counts.get(user["netid"], 0)},
+                "$unset": {"waitlists": ""},
+            },
+        )
+    db.drop_collection("waitlists")
+
+
+if __name__ == "__main__":
+    dry_run = "--dry-run" in argv[1:]
+    client = MongoClient(
+        DB_CONNECTION_STR, serverSelectionTimeoutMS=5000, tlsCAFile=certifi.where()
+    )
+    db = client.tigersnatch
+
+    if "waitlists" not in db.list_collection_names():
+        print("waitlists collection not found - already migrated?")
+        exit(0)
+
+    pairs = get_legacy_subscriptions(db)
+    print(f"found {len(pairs)} subscription(s) to migrate")
+    if dry_run:
+        exit(0)
+
+    if "subscriptions" not in db.list_collection_names():
+        db.create_collection("subscriptions")
+    ensure_indexes(db)
+
+    n_inserted = insert_documents(db, build_documents(db, pairs))
+    print(f"inserted {n_inserted} subscription(s)")
+
+    missing = verify(db, pairs)
+    if len(missing) > 0:
+        print(f"{len(missing)} subscription(s) failed to migrate:", file=stderr)
+        print(missing, file=stderr)
+        print("legacy data was left in place", file=stderr)
+        exit(1)
+
+    finalize(db)
+    print("done")
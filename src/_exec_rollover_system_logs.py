@@ -0,0 +1,182 @@
+# ----------------------------------------------------------------------
+# _exec_rollover_system_logs.py
+# Rolls completed months of the system collection over into compact
+# storage. For each month before the current one that still has logs
+# in system:
+#   * writes one summary document per log type to system_summaries
+#     ({period: "YYYY-MM", type, count, first, last, avg_response_time})
+#   * moves logs of types kept for at least SYSTEM_LOG_ARCHIVE_MIN_DAYS
+#     (see config.py) into the archive collection system_archive_YYYY_MM,
+#     which expires them at the same time (TTL index on expire_at)
+# Logs of other types stay in system until they expire. Summaries are
+# written before any log is deleted and never overwritten (a re-run
+# would count fewer logs once some have expired), archiving skips logs
+# that were already copied, and a log is only deleted from system once
+# it is confirmed to be in the archive, so the script is safe to re-run.
+#
+# Specify --backfill-expiry to first set expire_at (see
+# SYSTEM_LOG_RETENTION_DAYS in config.py) on logs, including archived
+# ones, written before retention was introduced.
+#
+# Approximate execution frequency: once a month, shortly after the start
+# of the month.
+#
+# Example: python _exec_rollover_system_logs.py --backfill-expiry
+# ----------------------------------------------------------------------
+
+from sys import argv
+from datetime import datetime, timedelta
+from pymongo import InsertOne
+from pymongo.errors import BulkWriteError
+from config import (
+    SYSTEM_LOG_RETENTION_DAYS,
+    SYSTEM_LOG_DEFAULT_RETENTION_DAYS,
+    SYSTEM_LOG_ARCHIVE_MIN_DAYS,
+)
+from database import Database
+
+BATCH_SIZE = 1000
+DUPLICATE_KEY = 11000
+
+
+def get_retention_days(type):
+    return SYSTEM_LOG_RETENTION_DAYS.get(type, SYSTEM_LOG_DEFAULT_RETENTION_DAYS)
+
+
+def month_start(time):
+    return datetime(time.year, time.month, 1)
+
+
+def next_month_start(time):
+    return month_start(month_start(time) + timedelta(days=32))
+
+
+# sets expire_at on every log in system and the archive collections that
+# doesn't have one yet
+def backfill_expiry(db):
+    colls = ["system"] + [
+        name
+        for name in db.list_collection_names()
+        if name.startswith("system_archive_")
+    ]
+    for coll in colls:
+        types = db[coll].distinct("type", {"expire_at": {"$exists": False}})
+        for type in types:
+            res = db[coll].update_many(
+                {"type": type, "expire_at": {"$exists": False}},
+                [
+                    {
+                        "$set": {
+                            "expire_at": {
+                                "$add": [
+                                    "$time",
+                                    get_retention_days(type) * 24 * 60 * 60 * 1000,
+                                ]
+                            }
+                        }
+                    }
+                ],
+            )
+            print(f"set expire_at on {res.modified_count} {type} log(s) in {coll}")
+
+
+def summarize(db, start, end):
+    return list(
+        db.system.aggregate(
+            [
+                {"$match": {"time": {"$gte": start, "$lt": end}}},
+                {
+                    "$group": {
+                        "_id": "$type",
+                        "count": {"$sum": 1},
+                        "first": {"$min": "$time"},
+                        "last": {"$max": "$time"},
+                        "avg_response_time": {"$avg": "$response_time"},
+                    }
+                },
+            ]
+        )
+    )
+
+
+# moves the logs of the given types in [start, end) into archive,
+# skipping logs that were already copied; a log is deleted from system
+# only once its _id is found in archive. Returns the number of logs
+# copied and deleted
+def archive(db, archive, types, start, end):
+    db[archive].create_index([("expire_at", 1)], expireAfterSeconds=0)
+    n_copied, n_deleted = 0, 0
+    batch = []
+
+    # raises unless every failed insert was a log that is already archived
+    def write(batch):
+        nonlocal n_copied, n_deleted
+        try:
+            ops = [InsertOne(doc) for doc in batch]
+            n_copied += db[archive].bulk_write(ops, ordered=False).inserted_count
+        except BulkWriteError as e:
+            errors = e.details["writeErrors"]
+            if any(error["code"] != DUPLICATE_KEY for error in errors):
+                raise
+            n_copied += e.details["nInserted"]
+
+        ids = [doc["_id"] for doc in batch]
+        archived = db[archive].distinct("_id", {"_id": {"$in": ids}})
+        n_deleted += db.system.delete_many({"_id": {"$in": archived}}).deleted_count
+
+    for doc in db.system.find(
+        {"type": {"$in": types}, "time": {"$gte": start, "$lt": end}}
+    ):
+        batch.append(doc)
+        if len(batch) == BATCH_SIZE:
+            write(batch)
+            batch = []
+    if len(batch) > 0:
+        write(batch)
+    return n_copied, n_deleted
+
+
+def rollover_month(db, start):
+    end = next_month_start(start)
+    period = start.strftime("%Y-%m")
+
+    summaries = summarize(db, start, end)
+    if len(summaries) == 0:
+        return
+    for summary in summaries:
+        db.system_summaries.update_one(
+            {"period": period, "type": summary["_id"]},
+            {"$setOnInsert": {k: v for k, v in summary.items() if k != "_id"}},
+            upsert=True,
+        )
+
+    types = [
+        summary["_id"]
+        for summary in summaries
+        if get_retention_days(summary["_id"]) >= SYSTEM_LOG_ARCHIVE_MIN_DAYS
+    ]
+    name = f"system_archive_{start.strftime('%Y_%m')}"
+    n_archived, n_deleted = 0, 0
+    if len(types) > 0:
+        n_archived, n_deleted = archive(db, name, types, start, end)
+    print(
+        f"{period}: summarized {len(summaries)} type(s), archived {n_archived} log(s) to {name}, deleted {n_deleted} log(s)"
+    )
+
+
+if __name__ == "__main__":
+    db = Database()._db
+
+    if "--backfill-expiry" in argv[1:]:
+        backfill_expiry(db)
+
+    oldest = db.system.find_one(
+        {"time": {"$exists": True}}, {"_id": 0, "time": 1}, sort=[("time", 1)]
+    )
+    current = month_start(datetime.utcnow())
+    start = None if oldest is None else month_start(oldest["time"])
+    while start is not None and start < current:
+        rollover_month(db, start)
+        start = next_month_start(start)
+
+    print("done")
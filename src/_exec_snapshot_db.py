@@ -0,0 +1,41 @@
+# ----------------------------------------------------------------------
+# _exec_snapshot_db.py
+# Writes the collections in COLLECTIONS (except the system logs, unless
+# --include-system is specified) of the database at DB_CONNECTION_STR to
+# an Extended JSON file. Point DB_MEMORY_SNAPSHOT at the file and set
+# DB_BACKEND=memory to run the app, the notifications script, or
+# _exec_benchmarks.py against an in-memory copy of that data (see
+# connection.py).
+#
+# Example: python _exec_snapshot_db.py snapshot.json
+# ----------------------------------------------------------------------
+
+from sys import argv, exit
+from bson import json_util
+from config import COLLECTIONS
+from database import Database
+
+
+# writes the given collections of db to an Extended JSON file readable by
+# connection.load_snapshot()
+def dump_snapshot(db, path, collections):
+    data = {name: list(db[name].find({})) for name in collections}
+    with open(path, "w") as f:
+        f.write(json_util.dumps(data))
+
+
+if __name__ == "__main__":
+    args = [arg for arg in argv[1:] if not arg.startswith("--")]
+    if len(args) != 1:
+        print("specify the output path")
+        exit(2)
+
+    collections = sorted(COLLECTIONS)
+    if "--include-system" not in argv[1:]:
+        collections.remove("system")
+
+    db = Database()._db
+    dump_snapshot(db, args[0], collections)
+    for coll in collections:
+        print(f"{coll}: {db[coll].estimated_document_count()} document(s)")
+    print(f"wrote {args[0]}")
@@ -0,0 +1,115 @@
+# ----------------------------------------------------------------------
+# _exec_stress_waitlists.py
+# Concurrency stress test for Database.add_to_waitlist and
+# remove_from_waitlist: creates temporary users, subscribes all of them
+# to one section from hundreds of threads at once, checks that no
+# subscription was lost, then unsubscribes them all concurrently and
+# checks that the section's waitlist is gone. The temporary users are
+# removed afterwards.
+#
+# WARNING: this script writes to the database. Only run it with
+# DB_CONNECTION_STR pointing at a local/development database.
+#
+# Optionally specify a classid and a number of threads (default: the
+# first class in enrollments and 200 threads).
+#
+# Example: python _exec_stress_waitlists.py 40287 300
+# ----------------------------------------------------------------------
+
+from sys import argv, exit
+from time import time
+from concurrent.futures import ThreadPoolExecutor
+from database import Database
+
+NETID_PREFIX = "stresstest"
+
+
+def create_users(db, netids):
+    for netid in netids:
+        db.create_user(netid)
+
+
+# unsubscribes the users through remove_from_waitlist (so that the stats
+# and subscription counters stay right), then deletes them
+def remove_users(db, netids):
+    for sub in db._db.subscriptions.find(
+        {"netid": {"$in": netids}}, {"_id": 0, "netid": 1, "classid": 1}
+    ):
+        db.remove_from_waitlist(sub["netid"], sub["classid"])
+    db._db.logs.delete_many({"netid": {"$in": netids}})
+    res = db._db.users.delete_many({"netid": {"$in": netids}})
+    db._inc_stats_counters(total_users=-res.deleted_count)
+
+
+# runs fn(netid) for every netid in netids from n_threads threads;
+# returns the list of exceptions raised
+def hammer(fn, netids, n_threads):
+    def run(netid):
+        try:
+            fn(netid)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        return [e for e in executor.map(run, netids) if e is not None]
+
+
+if __name__ == "__main__":
+    db = Database()
+    if len(argv) > 1:
+        classid = argv[1]
+    else:
+        classid = db._db.enrollments.find_one({}, {"classid": 1})["classid"]
+    n_threads = int(argv[2]) if len(argv) > 2 else 200
+
+    netids = [f"{NETID_PREFIX}{i:04d}" for i in range(n_threads)]
+    remove_users(db, netids)
+    create_users(db, netids)
+    existing = db.get_class_waitlist(classid)
+    n_existing = 0 if existing is None else len(existing["waitlist"])
+    n_failed = 0
+
+    try:
+        start = time()
+        errors = hammer(
+            lambda netid: Database().add_to_waitlist(
+                netid, classid, disable_checks=True
+            ),
+            netids,
+            n_threads,
+        )
+        print(f"subscribed {len(netids)} users in {time() - start:.2f}s")
+        for e in errors:
+            print("error:", e)
+
+        waitlist = set(db.get_class_waitlist(classid)["waitlist"])
+        lost = [netid for netid in netids if netid not in waitlist]
+        lost += [
+            netid for netid in netids if classid not in db.get_user(netid, "waitlists")
+        ]
+        if len(waitlist) != n_existing + len(netids) or len(lost) > 0:
+            print(f"FAIL lost subscriptions: {sorted(set(lost))}")
+            n_failed += 1
+
+        start = time()
+        errors = hammer(
+            lambda netid: Database().remove_from_waitlist(netid, classid),
+            netids,
+            n_threads,
+        )
+        print(f"unsubscribed {len(netids)} users in {time() - start:.2f}s")
+        for e in errors:
+            print("error:", e)
+
+        waitlist = db.get_class_waitlist(classid)
+        remaining = [] if waitlist is None else waitlist["waitlist"]
+        leftover = [netid for netid in remaining if netid.startswith(NETID_PREFIX)]
+        if len(leftover) > 0 or (n_existing == 0 and waitlist is not None):
+            print(f"FAIL users left on waitlist: {leftover}")
+            n_failed += 1
+    finally:
+        remove_users(db, netids)
+
+    if n_failed > 0:
+        exit(1)
+    print("done")
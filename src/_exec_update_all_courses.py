@@ -6,6 +6,17 @@
 # Specify one of the following flags:
 #   --soft: resets only course-related data
 # 	--hard: resets both course and subscription-related data
+#   --sync: writes only the courses and sections of the current term
+#           that changed (see Database.sync_courses())
+#   --rollback: restores the course data replaced by the last update
+#
+# New course data is written to staging collections while the app keeps
+# serving the live ones, and is swapped in only once it is complete and
+# valid (see Database.commit_term_update()), so the app is only in
+# maintenance mode while the collections are renamed. The replaced
+# collections are kept until the next update, so --rollback restores
+# them at once (it does not restore subscription-related data cleared
+# by --hard, nor the previous term code).
 #
 # Approximate execution frequency: once at the start of every course
 # selection period i.e. on or after (asap) the date when courses for the
@@ -17,7 +28,9 @@
 # at the very beginning of the course selection period. If you wish to
 # refresh only course (non-subscription) data, run with --soft (this may be
 # run safely throughout the semester, but that is not recommended unless
-# there are MAJOR changes to the semester's course offerings).
+# there are MAJOR changes to the semester's course offerings). To
+# refresh course data regularly, run with --sync, which compares the
+# MobileApp data to the stored data and writes only what changed.
 #
 # Example: python _exec_update_all_courses.py --soft
 # ----------------------------------------------------------------------
@@ -27,11 +40,17 @@ from database import Database
 from sys import argv, exit
 from time import time
 from os import system
-from update_all_courses_utils import get_all_dept_codes, process_dept_codes
+from update_all_courses_utils import (
+    get_all_dept_codes,
+    process_dept_codes,
+    sync_dept_codes,
+)
+from querystats import query_scope
 
 
 # True --> hard reset
 # False --> soft reset
+@query_scope("cron:update_courses")
 def do_update(reset_type):
     tic = time()
     hard_reset = reset_type
@@ -46,15 +65,11 @@ def do_update(reset_type):
     try:
         current_term_code = terms["term"][0]["code"]
         current_term_name = terms["term"][0]["cal_name"]
-        did_update_term_code = db.update_current_term_code(
-            current_term_code, current_term_name
-        )
-        if hard_reset and not did_update_term_code:
+        if hard_reset and db.get_current_term_code()[0] == current_term_code:
             return
     except:
         raise Exception("failed to get current term code")
 
-    db.set_maintenance_status(True)
     try:
         db._add_system_log(
             "admin",
@@ -65,23 +80,25 @@ def do_update(reset_type):
         )
         print(f"getting all courses in term code {current_term_code}")
 
-        DEPT_CODES = ",".join(get_all_dept_codes(current_term_code))
-        n_courses, n_classes, new_courses = process_dept_codes(
+        DEPT_CODES = get_all_dept_codes(current_term_code)
+        n_courses, n_classes, new_courses, failed_depts = process_dept_codes(
             DEPT_CODES, current_term_code, hard_reset
         )
     except:
-        if hard_reset:
-            raise Exception(
-                "failed to hard-update courses and did not disable maintenance mode"
-            )
-        db.set_maintenance_status(False)
-        raise Exception("failed to soft-update courses and disabled maintenance mode")
+        raise Exception(
+            f"failed to {'hard' if hard_reset else 'soft'}-update courses and did not change the live course data"
+        )
 
-    db.set_maintenance_status(False)
+    # the term changes along with the course data
+    db.update_current_term_code(current_term_code, current_term_name)
 
     log_msg = f"{'hard' if hard_reset else 'soft'}-updated to term code {current_term_code} in {round(time()-tic)} seconds ({n_courses} courses, {n_classes} sections)"
     if not hard_reset and len(new_courses) > 0:
         log_msg += f" - new courses: {', '.join(new_courses)}"
+    if len(failed_depts) > 0:
+        log_msg += (
+            f" - kept current data of failed departments: {', '.join(failed_depts)}"
+        )
 
     db._add_admin_log(log_msg)
 
@@ -94,6 +111,46 @@ def do_update(reset_type):
     print(f"success: approx. {round(time()-tic)} seconds")
 
 
+# writes only the courses and sections of the current term that differ
+# from the MobileApp data, and logs how many documents that saved
+@query_scope("cron:sync_courses")
+def do_sync():
+    tic = time()
+    db = Database()
+    current_term_code = db.get_current_term_code()[0]
+
+    try:
+        print(f"syncing all courses in term code {current_term_code}")
+        DEPT_CODES = get_all_dept_codes(current_term_code)
+        n_courses, n_classes, new_courses, report = sync_dept_codes(
+            DEPT_CODES, current_term_code
+        )
+    except:
+        raise Exception("failed to sync courses")
+
+    writes = ", ".join(f"{n} {coll}" for coll, n in report["writes"].items())
+    log_msg = f"synced term code {current_term_code} in {round(time()-tic)} seconds ({n_courses} courses, {n_classes} sections, {report['n_changed_courses']} changed): wrote {report['n_writes']} documents ({writes}) instead of {report['n_full_writes']}"
+    if len(new_courses) > 0:
+        log_msg += f" - new courses: {', '.join(new_courses)}"
+    if len(report["failed_depts"]) > 0:
+        log_msg += f" - kept current data of failed departments: {', '.join(report['failed_depts'])}"
+
+    db._add_admin_log(log_msg)
+    db._add_system_log("admin", {"message": log_msg}, netid="SYSTEM_AUTO")
+    print(f"success: {log_msg}")
+
+
+# swaps the course data replaced by the last update back in
+def do_rollback():
+    db = Database()
+    db.rollback_term_update()
+
+    log_msg = "rolled back the last course term update"
+    db._add_admin_log(log_msg)
+    db._add_system_log("admin", {"message": log_msg}, netid="SYSTEM_AUTO")
+    print("success")
+
+
 def do_update_async_HARD():
     # needed for execution on heroku servers to avoid the 30 second
     # request timeout for syncronous processes
@@ -106,14 +163,33 @@ def do_update_async_SOFT():
     system("python src/_exec_update_all_courses.py --soft &")
 
 
+def do_update_async_SYNC():
+    # needed for execution on heroku servers to avoid the 30 second
+    # request timeout for syncronous processes
+    system("python src/_exec_update_all_courses.py --sync &")
+
+
 if __name__ == "__main__":
 
     def process_args():
-        if len(argv) != 2 or (argv[1] != "--soft" and argv[1] != "--hard"):
+        if len(argv) != 2 or argv[1] not in (
+            "--soft",
+            "--hard",
+            "--sync",
+            "--rollback",
+        ):
             print("specify one of the following flags:")
             print("\t--soft: resets only course-related data")
             print("\t--hard: resets both course and waitlist-related data")
+            print("\t--sync: writes only the courses and sections that changed")
+            print("\t--rollback: restores the course data replaced by the last update")
             exit(2)
-        return argv[1] == "--hard"
-
-    do_update(process_args())
+        return argv[1]
+
+    flag = process_args()
+    if flag == "--rollback":
+        do_rollback()
+    elif flag == "--sync":
+        do_sync()
+    else:
+        do_update(flag == "--hard")
@@ -0,0 +1,96 @@
+# ----------------------------------------------------------------------
+# admincache.py
+# Contains AdminCache, a short-lived, process-wide read-through cache of
+# the singleton admin document. Database mutators invalidate it so that
+# admin actions still take effect immediately in the current process;
+# other processes see them once the TTL expires.
+# ----------------------------------------------------------------------
+
+from os import register_at_fork
+from threading import Lock
+from time import time
+from config import ADMIN_CACHE_TTL_SECS
+
+
+class AdminCache:
+    # admin document fields that are cached (logs and stats counters are
+    # always read directly)
+    FIELDS = (
+        "admins",
+        "blacklist",
+        "disabled_courses",
+        "current_term_code",
+        "current_term_name",
+        "notifs_schedule",
+        "notifs_status",
+        "stats_top_subs",
+        "catalog_version",
+        "catalog_stale",
+    )
+
+    def __init__(self, ttl=ADMIN_CACHE_TTL_SECS):
+        self._ttl = ttl
+        self._lock = Lock()
+        self._data = None
+        self._fetched_at = 0
+        self._generation = 0
+        self._n_hits = 0
+        self._n_misses = 0
+        self._n_invalidations = 0
+
+    # returns the cached view of the admin document, re-reading it from
+    # the admin collection coll if it is missing or older than the TTL
+
+    def get(self, coll):
+        data = self._data
+        if data is not None and time() - self._fetched_at < self._ttl:
+            self._n_hits += 1
+            return data
+
+        self._n_misses += 1
+        generation = self._generation
+        doc = coll.find_one({}, {k: 1 for k in AdminCache.FIELDS} | {"_id": 0})
+        if doc is None:
+            raise Exception("admin document does not exist")
+
+        data = dict(doc)
+        data["blacklist_set"] = frozenset(doc.get("blacklist", []))
+        data["admins_set"] = frozenset(doc.get("admins", []))
+        data["disabled_courses_set"] = frozenset(doc.get("disabled_courses", []))
+        data["top_subs_set"] = frozenset(
+            e["deptnum"] for e in doc.get("stats_top_subs", [])
+        )
+
+        # don't store a result that raced with an invalidation
+        with self._lock:
+            if generation == self._generation:
+                self._data = data
+                self._fetched_at = time()
+        return data
+
+    # drops the cached view; the next get() re-reads the admin document
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._data = None
+            self._n_invalidations += 1
+
+    # returns hit/miss counters and the hit rate of this cache
+
+    def get_stats(self):
+        n_total = self._n_hits + self._n_misses
+        return {
+            "ttl_secs": self._ttl,
+            "hits": self._n_hits,
+            "misses": self._n_misses,
+            "invalidations": self._n_invalidations,
+            "hit_rate": 0 if n_total == 0 else self._n_hits / n_total,
+        }
+
+    def _after_fork(self):
+        self._lock = Lock()
+
+
+admin_cache = AdminCache()
+register_at_fork(after_in_child=admin_cache._after_fork)
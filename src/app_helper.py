@@ -5,6 +5,7 @@
 
 from database import Database
 from monitor import Monitor
+from schema import get_course_classes, get_course_details
 import re
 from sys import stderr
 from markdown import markdown
@@ -49,31 +50,17 @@ def pull_course(courseid, db):
     # updates course info if it has been 2 minutes since last update
     Monitor(db).pull_course_updates(courseid)
     course = db.get_course_with_enrollment(courseid)
+    classes_list = get_course_classes(course)
+    waitlist_sizes = db.get_class_waitlist_sizes(
+        curr_class["classid"] for curr_class in classes_list
+    )
 
     # split course data into basic course details, and list of classes
     # with enrollmemnt data
-    course_details = {}
-    classes_list = []
-    for key in course.keys():
-        if key.startswith("class_"):
-            curr_class = course[key]
-            try:
-                waitlist_count = db.get_class_waitlist_size(curr_class["classid"])
-            except Exception:
-                waitlist_count = 0
-            try:
-                time_of_last_notif = db.get_time_of_last_notif(curr_class["classid"])
-            except Exception:
-                time_of_last_notif = None
-            curr_class["wl_size"] = waitlist_count
-            curr_class["time_of_last_notif"] = (
-                time_of_last_notif if time_of_last_notif is not None else "-"
-            )
-            classes_list.append(curr_class)
-        else:
-            course_details[key] = course[key]
-
-    return course_details, classes_list
+    for curr_class in classes_list:
+        curr_class["wl_size"] = waitlist_sizes.get(curr_class["classid"], 0)
+
+    return get_course_details(course), classes_list
 
 
 def is_admin(netid, db):
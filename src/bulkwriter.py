@@ -0,0 +1,98 @@
+# ----------------------------------------------------------------------
+# bulkwriter.py
+# Contains BulkWriter, which inserts course data (courses, mappings, and
+# enrollments documents) in batches. Each document is validated against
+# schema.py, documents whose key (courseid or classid) was already added
+# are skipped, and the pending documents of a collection are written
+# with one unordered insert_many once BULK_INSERT_BATCH_SIZE of them
+# accumulate. Term updates (see update_all_courses_utils.py) use it
+# instead of one insert_one round-trip per document.
+# ----------------------------------------------------------------------
+
+from time import time
+from pymongo.errors import BulkWriteError
+from config import BULK_INSERT_BATCH_SIZE
+from schema import validate_document, to_classes_layout
+
+# the field that identifies a document of each collection
+KEYS = {"courses": "courseid", "mappings": "courseid", "enrollments": "classid"}
+
+DUPLICATE_KEY = 11000
+
+
+class BulkWriter:
+    def __init__(self, db, suffix="", batch_size=BULK_INSERT_BATCH_SIZE):
+        self._db = db
+        self._suffix = suffix
+        self._batch_size = batch_size
+        self._pending = {coll: [] for coll in KEYS}
+        self._keys = {coll: set() for coll in KEYS}
+        self._stats = {
+            coll: {"n_inserted": 0, "n_duplicates": 0, "n_batches": 0, "secs": 0.0}
+            for coll in KEYS
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+
+    # validates doc and queues it for insertion into coll (the collection
+    # named coll plus the writer's suffix); returns False, queuing
+    # nothing, if a document with the same key was already added
+
+    def add(self, coll, doc):
+        validate_document(coll, doc)
+        key = doc[KEYS[coll]]
+        if key in self._keys[coll]:
+            self._stats[coll]["n_duplicates"] += 1
+            return False
+        self._keys[coll].add(key)
+
+        self._pending[coll].append(to_classes_layout(doc) if coll == "courses" else doc)
+        if len(self._pending[coll]) >= self._batch_size:
+            self.flush(coll)
+        return True
+
+    # writes the pending documents of coll (of every collection if coll is
+    # None); documents rejected as duplicates by a unique index are
+    # counted and skipped
+
+    def flush(self, coll=None):
+        for coll in KEYS if coll is None else [coll]:
+            docs = self._pending[coll]
+            if len(docs) == 0:
+                continue
+            self._pending[coll] = []
+
+            stats = self._stats[coll]
+            tic = time()
+            try:
+                res = self._db[coll + self._suffix].insert_many(docs, ordered=False)
+                stats["n_inserted"] += len(res.inserted_ids)
+            except BulkWriteError as e:
+                errors = e.details["writeErrors"]
+                if any(error["code"] != DUPLICATE_KEY for error in errors):
+                    raise
+                stats["n_inserted"] += e.details["nInserted"]
+                stats["n_duplicates"] += len(errors)
+            stats["n_batches"] += 1
+            stats["secs"] += time() - tic
+
+    # returns {coll: {"n_inserted", "n_duplicates", "n_batches", "secs",
+    # "docs_per_sec"}} for each collection and "total", where secs is the
+    # time spent in insert_many
+
+    def get_stats(self):
+        res = {coll: dict(stats) for coll, stats in self._stats.items()}
+        res["total"] = {
+            k: sum(stats[k] for stats in self._stats.values())
+            for k in ("n_inserted", "n_duplicates", "n_batches", "secs")
+        }
+        for stats in res.values():
+            stats["docs_per_sec"] = (
+                round(stats["n_inserted"] / stats["secs"]) if stats["secs"] > 0 else 0
+            )
+        return res
@@ -0,0 +1,364 @@
+# ----------------------------------------------------------------------
+# catalog.py
+# Contains Catalog, a read-only snapshot of the course catalog laid out
+# as flat arrays in one file, and CatalogStore, which memory-maps the
+# current version of that file. Every process on a machine maps the
+# same file, so gunicorn workers share one copy through the page cache
+# and serve searches and course lookups without MongoDB round-trips.
+# The searchable fields of the mappings collection (displayname,
+# displayname_whitespace, title) are copies of the courses', so the
+# snapshot is built from the courses collection alone.
+#
+# Versions are numbered by the admin document (see
+# Database.rebuild_catalog()). Each version is written to a temporary
+# file and renamed into place, and a process swaps to a new version in
+# one assignment, so readers always see a complete snapshot.
+#
+# File layout (little-endian, every part padded to 8 bytes):
+#   header          MAGIC, then int64 n_strings, n_courses, n_sections,
+#                   strings_len, search_len
+#   string_offsets  int64[n_strings + 1], into strings
+#   courses         int32[n_courses, 7], sorted by displayname: courseid,
+#                   displayname, displayname_whitespace, title (string
+#                   ids), has_reserved_seats, first section, n_sections
+#   sections        int32[n_sections, 9]: classid, section, type_name,
+#                   start_time, end_time, days (string ids), enrollment,
+#                   capacity, status_is_open
+#   by_courseid     int32[n_courses], course rows sorted by courseid
+#   search_offsets  int64[n_courses + 1], into search
+#   strings         UTF-8 text of every distinct string
+#   search          "displayname\ndisplayname_whitespace\ntitle\n" for
+#                   each course row
+# Missing fields are stored as -1.
+# ----------------------------------------------------------------------
+
+import mmap
+import re
+from os import O_CREAT, O_EXCL, O_WRONLY, close, getpid, listdir, makedirs
+from os import open as open_fd
+from os import register_at_fork, remove, replace
+from os.path import getmtime, join
+from sys import stderr
+from threading import Lock
+from time import time
+import numpy as np
+from config import CATALOG_DIR
+from schema import get_course_classes
+
+MAGIC = b"TSCATLG1"
+MISSING = -1
+
+COURSE_STR_FIELDS = ("courseid", "displayname", "displayname_whitespace", "title")
+CLASS_STR_FIELDS = ("classid", "section", "type_name", "start_time", "end_time", "days")
+CLASS_INT_FIELDS = ("enrollment", "capacity", "status_is_open")
+# columns of the courses table after its string fields
+HAS_RESERVED_SEATS, FIRST_SECTION, N_SECTIONS = 4, 5, 6
+
+# versions older than this many are deleted when a new one is written
+N_VERSIONS_KEPT = 2
+# a build lock older than this is assumed to be left by a crashed process
+BUILD_LOCK_TIMEOUT_SECS = 120
+
+
+def _pad(n):
+    return (n + 7) // 8 * 8
+
+
+# writes the catalog of course documents (in either section layout) to
+# path, atomically replacing any existing file
+def write_catalog(path, courses):
+    strings = {}
+
+    def intern(value):
+        if value is None:
+            return MISSING
+        if value not in strings:
+            strings[value] = len(strings)
+        return strings[value]
+
+    rows = sorted(courses, key=lambda course: course["displayname"])
+    course_table = np.full((len(rows), 7), MISSING, dtype="<i4")
+    section_rows = []
+    search = bytearray()
+    search_offsets = [0]
+    for i, course in enumerate(rows):
+        for j, k in enumerate(COURSE_STR_FIELDS):
+            course_table[i, j] = intern(course.get(k))
+        if "has_reserved_seats" in course:
+            course_table[i, HAS_RESERVED_SEATS] = int(course["has_reserved_seats"])
+        classes = get_course_classes(course)
+        course_table[i, FIRST_SECTION] = len(section_rows)
+        course_table[i, N_SECTIONS] = len(classes)
+        for class_ in classes:
+            section_rows.append(
+                [intern(class_.get(k)) for k in CLASS_STR_FIELDS]
+                + [
+                    MISSING if class_.get(k) is None else int(class_[k])
+                    for k in CLASS_INT_FIELDS
+                ]
+            )
+        for k in COURSE_STR_FIELDS[1:]:
+            search += course.get(k, "").encode() + b"\n"
+        search_offsets.append(len(search))
+
+    section_table = np.array(section_rows, dtype="<i4").reshape(-1, 9)
+    by_courseid = np.array(
+        sorted(range(len(rows)), key=lambda i: rows[i]["courseid"]), dtype="<i4"
+    )
+    encoded = [s.encode() for s in strings]
+    string_offsets = np.zeros(len(encoded) + 1, dtype="<i8")
+    string_offsets[1:] = np.cumsum([len(s) for s in encoded])
+    blob = b"".join(encoded)
+
+    header = np.array(
+        [len(encoded), len(rows), len(section_rows), len(blob), len(search)],
+        dtype="<i8",
+    )
+    parts = [
+        MAGIC + header.tobytes(),
+        string_offsets.tobytes(),
+        course_table.tobytes(),
+        section_table.tobytes(),
+        by_courseid.tobytes(),
+        np.array(search_offsets, dtype="<i8").tobytes(),
+        blob,
+        bytes(search),
+    ]
+    tmp_path = f"{path}.{getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        for part in parts:
+            f.write(part)
+            f.write(b"\0" * (_pad(len(part)) - len(part)))
+    replace(tmp_path, path)
+
+
+class Catalog:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._buf[: len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a catalog file")
+        self._offset = len(MAGIC)
+        n_strings, n_courses, n_sections, strings_len, search_len = (
+            int(n) for n in self._take("<i8", 5)
+        )
+        self._string_offsets = self._take("<i8", n_strings + 1)
+        self._courses = self._take("<i4", n_courses * 7).reshape(-1, 7)
+        self._sections = self._take("<i4", n_sections * 9).reshape(-1, 9)
+        self._by_courseid = self._take("<i4", n_courses)
+        self._search_offsets = self._take("<i8", n_courses + 1)
+        self._strings_start = self._offset
+        self._search_start = _pad(self._strings_start + strings_len)
+        self._search_end = self._search_start + search_len
+
+    # returns a view of the next n values of dtype in the file
+
+    def _take(self, dtype, n):
+        arr = np.frombuffer(self._buf, dtype=dtype, count=n, offset=self._offset)
+        self._offset = _pad(self._offset + arr.nbytes)
+        return arr
+
+    def __len__(self):
+        return len(self._courses)
+
+    def _str(self, i):
+        if i < 0:
+            return None
+        start = self._strings_start + int(self._string_offsets[i])
+        end = self._strings_start + int(self._string_offsets[i + 1])
+        return self._buf[start:end].decode()
+
+    # returns the row of courseid (None if it is not in the catalog),
+    # using binary search over by_courseid
+
+    def _find(self, courseid):
+        lo, hi = 0, len(self._by_courseid)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            row = int(self._by_courseid[mid])
+            value = self._str(self._courses[row, 0])
+            if value == courseid:
+                return row
+            if value < courseid:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
+
+    def _get_fields(self, row):
+        res = {}
+        for j, k in enumerate(COURSE_STR_FIELDS):
+            value = self._str(self._courses[row, j])
+            if value is not None:
+                res[k] = value
+        return res
+
+    # returns the course document of courseid in the "classes" array
+    # layout (without _id), or None if the catalog has no such course
+
+    def get_course(self, courseid):
+        row = self._find(courseid)
+        if row is None:
+            return None
+        course = self._get_fields(row)
+        if self._courses[row, HAS_RESERVED_SEATS] != MISSING:
+            course["has_reserved_seats"] = bool(self._courses[row, HAS_RESERVED_SEATS])
+
+        first = int(self._courses[row, FIRST_SECTION])
+        course["classes"] = []
+        for section in self._sections[first : first + self._courses[row, N_SECTIONS]]:
+            class_ = {}
+            for j, k in enumerate(CLASS_STR_FIELDS):
+                value = self._str(section[j])
+                if value is not None:
+                    class_[k] = value
+            for j, k in enumerate(CLASS_INT_FIELDS, len(CLASS_STR_FIELDS)):
+                if section[j] != MISSING:
+                    class_[k] = int(section[j])
+            if "status_is_open" in class_:
+                class_["status_is_open"] = bool(class_["status_is_open"])
+            course["classes"].append(class_)
+        return course
+
+    # returns the displayname of courseid (None if it is not in the
+    # catalog)
+
+    def get_displayname(self, courseid):
+        row = self._find(courseid)
+        return None if row is None else self._str(self._courses[row, 1])
+
+    # returns {"courseid", "displayname", "displayname_whitespace",
+    # "title"} for every course with a field that matches query (a
+    # compiled regex), sorted by displayname. The whole search text is
+    # scanned in place; rows it hits are then checked field by field so
+    # that no match spans two fields
+
+    def search(self, query):
+        pattern = re.compile(
+            query.pattern.encode(), (query.flags & ~re.UNICODE) | re.MULTILINE
+        )
+        res = []
+        pos = self._search_start
+        while pos <= self._search_end:
+            match = pattern.search(self._buf, pos, self._search_end)
+            if match is None:
+                break
+            row = (
+                int(
+                    np.searchsorted(
+                        self._search_offsets,
+                        match.start() - self._search_start,
+                        side="right",
+                    )
+                )
+                - 1
+            )
+            if row >= len(self._courses):
+                break
+            fields = self._get_fields(row)
+            if any(
+                fields.get(k) is not None and query.search(fields[k])
+                for k in COURSE_STR_FIELDS[1:]
+            ):
+                res.append(fields)
+            pos = self._search_start + int(self._search_offsets[row + 1])
+        return res
+
+
+# process-wide holder of the mapped catalog version
+class CatalogStore:
+    def __init__(self, directory=CATALOG_DIR):
+        self._dir = directory
+        # (version, Catalog), replaced in one assignment
+        self._current = (None, None)
+        self._lock = Lock()
+
+    def is_enabled(self):
+        return self._dir != ""
+
+    def _get_path(self, version):
+        return join(self._dir, f"catalog_{version}.bin")
+
+    # returns the catalog of version, mapping it first if this process
+    # has another version mapped; None if its file doesn't exist (yet)
+
+    def get(self, version):
+        current_version, catalog = self._current
+        if current_version == version:
+            return catalog
+        if not self.is_enabled() or version is None:
+            return None
+
+        with self._lock:
+            current_version, catalog = self._current
+            if current_version == version:
+                return catalog
+            try:
+                catalog = Catalog(self._get_path(version))
+            except FileNotFoundError:
+                return None
+            except Exception as e:
+                print(f"failed to map catalog version {version}: {e}", file=stderr)
+                return None
+            # the previous version stays mapped until no reader uses it
+            self._current = (version, catalog)
+            return catalog
+
+    # writes version of the catalog from course documents and deletes
+    # versions older than the last N_VERSIONS_KEPT
+
+    def write(self, version, courses):
+        makedirs(self._dir, exist_ok=True)
+        write_catalog(self._get_path(version), courses)
+
+        versions = []
+        for name in listdir(self._dir):
+            if name.startswith("catalog_") and name.endswith(".bin"):
+                try:
+                    versions.append(int(name[len("catalog_") : -len(".bin")]))
+                except ValueError:
+                    continue
+        for old in sorted(versions)[:-N_VERSIONS_KEPT]:
+            if old < version:
+                try:
+                    remove(self._get_path(old))
+                except FileNotFoundError:
+                    pass
+
+    # returns True if this process may build version (no other process
+    # on this machine is building it)
+
+    def try_lock(self, version):
+        if not self.is_enabled():
+            return False
+        makedirs(self._dir, exist_ok=True)
+        path = self._get_path(version) + ".lock"
+        try:
+            if time() - getmtime(path) > BUILD_LOCK_TIMEOUT_SECS:
+                remove(path)
+        except FileNotFoundError:
+            pass
+        try:
+            close(open_fd(path, O_CREAT | O_EXCL | O_WRONLY))
+            return True
+        except FileExistsError:
+            return False
+
+    def unlock(self, version):
+        try:
+            remove(self._get_path(version) + ".lock")
+        except FileNotFoundError:
+            pass
+
+    # returns the mapped version and its number of courses
+
+    def get_stats(self):
+        version, catalog = self._current
+        return {"version": version, "n_courses": 0 if catalog is None else len(catalog)}
+
+    def _after_fork(self):
+        self._lock = Lock()
+
+
+catalog_store = CatalogStore()
+register_at_fork(after_in_child=catalog_store._after_fork)
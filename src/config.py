@@ -4,25 +4,50 @@
 # ----------------------------------------------------------------------
 
 from os import environ
+from os.path import join
+from tempfile import gettempdir
 
 # TigerSnatch host URL
 TS_HOST = "localhost"
 TS_DOMAIN = environ["TS_DOMAIN"]
 
-# primary MongoDB server connection string
-DB_CONNECTION_STR = environ["DB_CONNECTION_STR"]
+# storage backend: "mongo" (default) or "memory", an in-process mongomock
+# store for benchmarks (see connection.py) that starts from the Extended
+# JSON snapshot at DB_MEMORY_SNAPSHOT, if set
+DB_BACKEND = environ.get("DB_BACKEND", "mongo")
+DB_MEMORY_SNAPSHOT = environ.get("DB_MEMORY_SNAPSHOT", "")
+
+# primary MongoDB server connection string (not needed by the memory
+# backend)
+DB_CONNECTION_STR = (
+    environ["DB_CONNECTION_STR"]
+    if DB_BACKEND == "mongo"
+    else environ.get("DB_CONNECTION_STR", "")
+)
+
+# directory of the memory-mapped course catalog snapshots shared by the
+# processes on one machine (see catalog.py); empty to always read the
+# catalog from MongoDB (the default for the memory backend, whose data
+# is per process)
+CATALOG_DIR = environ.get(
+    "CATALOG_DIR",
+    join(gettempdir(), "tigersnatch_catalog") if DB_BACKEND == "mongo" else "",
+)
+
+# number of courses changed since the catalog snapshot was built (and
+# thus read from MongoDB) past which the snapshot is rebuilt
+CATALOG_MAX_STALE_COURSES = int(environ.get("CATALOG_MAX_STALE_COURSES", 100))
 
 # set of collections that are in a proper tigersnatch database
 COLLECTIONS = {
     "mappings",
     "courses",
     "users",
-    "waitlists",
+    "subscriptions",
     "enrollments",
     "admin",
     "logs",
     "system",
-    "notifs",
 }
 
 # MobileApp keys
@@ -59,12 +84,96 @@ NOTIFS_INTERVAL_SECS = int(environ["NOTIFS_INTERVAL_SECS"])
 # minimum time interval on which stats on Activity page are updated
 STATS_INTERVAL_MINS = int(environ["STATS_INTERVAL_MINS"])
 
+# interval on which the stats counters on the Activity page are
+# recomputed from scratch to repair any drift
+STATS_RECONCILE_INTERVAL_MINS = int(environ.get("STATS_RECONCILE_INTERVAL_MINS", 60))
+
 # maximum number of sections a user can be on waitlists for
 MAX_WAITLIST_SIZE = int(environ["MAX_WAITLIST_SIZE"])
 
+# whether waitlist subscribe/unsubscribe updates run inside a
+# multi-document transaction (requires MongoDB to be a replica set; not
+# supported by the memory backend)
+WAITLIST_TRANSACTIONS = (
+    DB_BACKEND == "mongo"
+    and environ.get("WAITLIST_TRANSACTIONS", "false").lower() == "true"
+)
+
 # maximum number of entries in custom user logs
 MAX_LOG_LENGTH = MAX_WAITLIST_SIZE * 2
 
+# maximum age of the per-process cached copy of the admin document
+# (blacklist, admins, disabled courses, term, notifs schedule, etc.)
+ADMIN_CACHE_TTL_SECS = float(environ.get("ADMIN_CACHE_TTL_SECS", 5))
+
+# buffering of system collection logs (see logsink.py): maximum number
+# of pending logs per process, maximum logs per insert_many, maximum
+# time a log stays pending, and what to do when the buffer is full
+# (drop_newest, drop_oldest, block, or sync)
+LOG_SINK_MAX_QUEUE = int(environ.get("LOG_SINK_MAX_QUEUE", 10000))
+LOG_SINK_BATCH_SIZE = int(environ.get("LOG_SINK_BATCH_SIZE", 500))
+LOG_SINK_FLUSH_INTERVAL_SECS = float(environ.get("LOG_SINK_FLUSH_INTERVAL_SECS", 1))
+LOG_SINK_POLICY = environ.get("LOG_SINK_POLICY", "drop_newest")
+
+# MongoDB command monitoring (see querystats.py): commands slower than
+# QUERY_SLOW_MS are logged, and QUERY_BUDGETS caps the number of commands
+# one run of a Flask route or cron job (optionally one stage of it) may
+# issue, e.g. QUERY_BUDGETS="/course=12,cron:notify/prefetch=4";
+# with QUERY_BUDGETS_STRICT, exceeding a budget raises an error instead
+# of being logged (e.g. to fail tests)
+QUERY_SLOW_MS = float(environ.get("QUERY_SLOW_MS", 100))
+QUERY_BUDGETS = {
+    label.strip(): int(budget)
+    for label, budget in (
+        entry.rsplit("=", 1)
+        for entry in environ.get("QUERY_BUDGETS", "").split(",")
+        if entry.strip() != ""
+    )
+}
+QUERY_BUDGETS_STRICT = environ.get("QUERY_BUDGETS_STRICT", "false").lower() == "true"
+
+# days that system collection logs of each type are kept before MongoDB
+# deletes them (TTL index on expire_at); other types are kept for
+# SYSTEM_LOG_DEFAULT_RETENTION_DAYS. When a month is rolled over (see
+# _exec_rollover_system_logs.py), every type is summarized, and logs of
+# types kept for at least SYSTEM_LOG_ARCHIVE_MIN_DAYS are moved into that
+# month's archive collection, where they expire at the same time
+SYSTEM_LOG_RETENTION_DAYS = {
+    "mobileapp": 14,
+    "user": 30,
+    "heroku": 30,
+    "error": 90,
+    "subscription": 180,
+    "trade": 180,
+    "cron": 400,
+    "admin": 400,
+}
+SYSTEM_LOG_DEFAULT_RETENTION_DAYS = 90
+SYSTEM_LOG_ARCHIVE_MIN_DAYS = 180
+
+# a term update (see _exec_update_all_courses.py) is not committed, and
+# the live course data is left untouched, if it staged fewer than this
+# fraction of the live number of courses (e.g. after a partial MobileApp
+# response)
+TERM_UPDATE_MIN_COURSES_RATIO = float(environ.get("TERM_UPDATE_MIN_COURSES_RATIO", 0.5))
+
+# a term update fetches courses from MobileApp in shards of
+# TERM_UPDATE_SHARD_SIZE department codes on a pool of
+# TERM_UPDATE_FETCH_PROCESSES processes, trying each shard up to
+# TERM_UPDATE_FETCH_ATTEMPTS times. Departments whose shard fails, or
+# that are still pending when no shard has finished for
+# TERM_UPDATE_FETCH_TIMEOUT_SECS, keep their current course data
+TERM_UPDATE_SHARD_SIZE = int(environ.get("TERM_UPDATE_SHARD_SIZE", 5))
+TERM_UPDATE_FETCH_PROCESSES = int(environ.get("TERM_UPDATE_FETCH_PROCESSES", 4))
+TERM_UPDATE_FETCH_ATTEMPTS = int(environ.get("TERM_UPDATE_FETCH_ATTEMPTS", 3))
+TERM_UPDATE_FETCH_TIMEOUT_SECS = float(
+    environ.get("TERM_UPDATE_FETCH_TIMEOUT_SECS", 300)
+)
+
+# maximum number of documents per insert_many when a term update writes
+# course data (see bulkwriter.py)
+BULK_INSERT_BATCH_SIZE = int(environ.get("BULK_INSERT_BATCH_SIZE", 1000))
+
 # maximum number of entries in admin panel logs
 MAX_ADMIN_LOG_LENGTH = int(environ["MAX_ADMIN_LOG_LENGTH"])
 
@@ -0,0 +1,312 @@
+# ----------------------------------------------------------------------
+# connection.py
+# Contains ConnectionManager, a process-wide owner of the MongoClient
+# that every Database object borrows from. The client is rebuilt lazily
+# after fork() (gunicorn workers, multiprocess pools), and the database
+# integrity check runs once per process instead of once per Database().
+# With DB_BACKEND=memory, the client is an in-memory mongomock
+# MongoClient instead, which forked children keep.
+# ----------------------------------------------------------------------
+
+from sys import stderr
+from os import getpid, register_at_fork
+from hashlib import sha1
+from threading import Lock
+from time import time
+import certifi
+import mongomock
+from bson import json_util
+from pymongo import MongoClient
+from pymongo.errors import ConnectionFailure, OperationFailure
+from pymongo.monitoring import ConnectionPoolListener
+from config import DB_CONNECTION_STR, DB_BACKEND, DB_MEMORY_SNAPSHOT, COLLECTIONS
+from schema import INDEXES
+from querystats import query_listener
+
+
+# checks that all required collections are available in db (other
+# collections, e.g. system log archives, may exist too); raises a
+# RuntimeError if not
+def check_basic_integrity(db):
+    if not COLLECTIONS <= set(db.list_collection_names()):
+        raise RuntimeError(
+            "one or more database collections is misnamed and/or missing"
+        )
+
+
+# returns a MongoClient for DB_CONNECTION_STR after verifying that the
+# server is reachable
+def create_mongo_client(event_listeners):
+    client = MongoClient(
+        DB_CONNECTION_STR,
+        serverSelectionTimeoutMS=5000,
+        maxIdleTimeMS=600000,
+        tlsCAFile=certifi.where(),
+        event_listeners=event_listeners,
+    )
+
+    try:
+        client.admin.command("ismaster")
+    except ConnectionFailure:
+        print("failed (server not available)", file=stderr)
+        raise Exception("server unavailable")
+    return client
+
+
+# loads collections from an Extended JSON file ({collection: [documents]},
+# see _exec_snapshot_db.py) into db, replacing their contents
+def load_snapshot(db, path):
+    with open(path) as f:
+        data = json_util.loads(f.read())
+    for name, docs in data.items():
+        db.drop_collection(name)
+        if len(docs) > 0:
+            db[name].insert_many(docs)
+
+
+# returns a mongomock MongoClient holding the DB_MEMORY_SNAPSHOT data (if
+# any) and every collection in COLLECTIONS; mongomock issues no commands,
+# so event_listeners are not notified. It supports neither transactions
+# (see WAITLIST_TRANSACTIONS) nor TTL expiry
+def create_memory_client(event_listeners):
+    client = mongomock.MongoClient()
+    db = client.tigersnatch
+    if DB_MEMORY_SNAPSHOT != "":
+        load_snapshot(db, DB_MEMORY_SNAPSHOT)
+    existing = set(db.list_collection_names())
+    for coll in COLLECTIONS - existing:
+        db.create_collection(coll)
+    return client
+
+
+BACKENDS = {"mongo": create_mongo_client, "memory": create_memory_client}
+
+
+# creates any index in INDEXES that is missing from db and verifies that
+# existing ones have the declared options; returns a dictionary with the
+# names of created, verified, and mismatched/failed indexes
+def ensure_indexes(db, indexes=INDEXES):
+    res = {"created": [], "verified": [], "failed": []}
+    existing = {}
+
+    for coll, keys, options in indexes:
+        if coll not in existing:
+            existing[coll] = {
+                tuple(tuple(k) for k in info["key"]): info
+                for info in db[coll].index_information().values()
+            }
+
+        key = tuple((k, v) for k, v in keys)
+        name = f"{coll}." + "_".join(f"{k}_{v}" for k, v in keys)
+        info = existing[coll].get(key)
+
+        if info is not None:
+            if all(info.get(opt) == val for opt, val in options.items()):
+                res["verified"].append(name)
+            else:
+                print(
+                    f"index {name} exists but does not have options {options}",
+                    file=stderr,
+                )
+                res["failed"].append(name)
+            continue
+
+        try:
+            db[coll].create_index(keys, **options)
+            res["created"].append(name)
+        except OperationFailure as e:
+            print(f"failed to create index {name}: {e}", file=stderr)
+            res["failed"].append(name)
+
+    return res
+
+
+# runs ensure_indexes() unless it already succeeded for the current
+# INDEXES, as recorded (as a hash of INDEXES) in the admin document's
+# indexes_version, so that it runs once after a deploy changes INDEXES
+# instead of in every worker process; returns its result, or None if it
+# was skipped
+def ensure_indexes_once(db):
+    version = sha1(repr(INDEXES).encode()).hexdigest()
+    if db.admin.find_one({"indexes_version": version}, {"_id": 1}) is not None:
+        return None
+
+    status = ensure_indexes(db)
+    if len(status["failed"]) == 0:
+        db.admin.update_one({}, {"$set": {"indexes_version": version}})
+    return status
+
+
+# counts connection pool events for the current process's client
+class _PoolStatsListener(ConnectionPoolListener):
+    def __init__(self):
+        self.counts = {
+            "pools_created": 0,
+            "pools_cleared": 0,
+            "connections_created": 0,
+            "connections_closed": 0,
+            "checkouts": 0,
+            "checkout_failures": 0,
+            "checkins": 0,
+        }
+
+    def pool_created(self, event):
+        self.counts["pools_created"] += 1
+
+    def pool_cleared(self, event):
+        self.counts["pools_cleared"] += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self.counts["connections_created"] += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self.counts["connections_closed"] += 1
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self.counts["checkout_failures"] += 1
+
+    def connection_checked_out(self, event):
+        self.counts["checkouts"] += 1
+
+    def connection_checked_in(self, event):
+        self.counts["checkins"] += 1
+
+
+class ConnectionManager:
+    def __init__(self):
+        self._reset()
+
+    # forgets the current client without closing it; called in the child
+    # after fork() since sockets inherited from the parent must not be
+    # reused (or closed) by the child
+
+    def _reset(self):
+        self._lock = Lock()
+        self._pid = getpid()
+        self._client = None
+        self._db = None
+        self._connected_at = None
+        self._n_borrows = 0
+        self._index_status = None
+        self._pool_listener = _PoolStatsListener()
+
+    # creates the client, verifies that the server is reachable, checks
+    # database integrity, and ensures indexes if INDEXES changed since
+    # they were last ensured (see ensure_indexes_once())
+
+    def _connect(self):
+        if DB_BACKEND not in BACKENDS:
+            raise RuntimeError(f"DB_BACKEND must be one of {list(BACKENDS)}")
+        client = BACKENDS[DB_BACKEND]([self._pool_listener, query_listener])
+
+        db = client.tigersnatch
+        check_basic_integrity(db)
+        self._index_status = ensure_indexes_once(db)
+        if self._index_status is not None and len(self._index_status["created"]) > 0:
+            print("created indexes", ", ".join(self._index_status["created"]))
+
+        self._client = client
+        self._db = db
+        self._connected_at = time()
+
+    # returns a reference to the tigersnatch database, connecting first
+    # if this process has not done so yet
+
+    def get_db(self):
+        if self._pid != getpid():
+            self._reset()
+
+        if self._db is None:
+            with self._lock:
+                if self._db is None:
+                    self._connect()
+
+        self._n_borrows += 1
+        return self._db
+
+    # returns the underlying MongoClient (e.g. to start a session)
+
+    def get_client(self):
+        self.get_db()
+        return self._client
+
+    # returns the result of ensure_indexes_once() for this process's
+    # client
+
+    def get_index_status(self):
+        self.get_db()
+        return self._index_status
+
+    # returns a dictionary of connection pool statistics for this process
+
+    def get_pool_stats(self):
+        stats = {
+            "pid": self._pid,
+            "connected": self._client is not None,
+            "uptime_secs": (
+                0 if self._connected_at is None else round(time() - self._connected_at)
+            ),
+            "n_borrows": self._n_borrows,
+        }
+        stats.update(self._pool_listener.counts)
+        stats["connections_open"] = (
+            stats["connections_created"] - stats["connections_closed"]
+        )
+        stats["connections_in_use"] = stats["checkouts"] - stats["checkins"]
+        if self._client is not None:
+            stats["max_pool_size"] = self._client.max_pool_size
+        return stats
+
+    # called in the child after fork(); an in-memory store has no sockets
+    # and holds the only copy of its data, so the child keeps it
+
+    def _after_fork_in_child(self):
+        client, db, index_status = self._client, self._db, self._index_status
+        self._reset()
+        if isinstance(client, mongomock.MongoClient):
+            self._client, self._db = client, db
+            self._index_status = index_status
+            self._connected_at = time()
+
+    # closes the client owned by this process (if any)
+
+    def close(self):
+        with self._lock:
+            if self._client is not None and self._pid == getpid():
+                self._client.close()
+            self._reset()
+
+
+_manager = ConnectionManager()
+register_at_fork(after_in_child=_manager._after_fork_in_child)
+
+
+def get_db():
+    return _manager.get_db()
+
+
+def get_client():
+    return _manager.get_client()
+
+
+def get_pool_stats():
+    return _manager.get_pool_stats()
+
+
+def get_index_status():
+    return _manager.get_index_status()
+
+
+if __name__ == "__main__":
+    get_db()
+    get_db()
+    print(get_pool_stats())
@@ -6,48 +6,75 @@
 
 from sys import stderr, stdout
 import re
-import certifi
 from config import (
-    DB_CONNECTION_STR,
-    COLLECTIONS,
     MAX_LOG_LENGTH,
     MAX_WAITLIST_SIZE,
     MAX_ADMIN_LOG_LENGTH,
     HEROKU_API_KEY,
     HEROKU_APP_NAME,
+    WAITLIST_TRANSACTIONS,
+    SYSTEM_LOG_RETENTION_DAYS,
+    SYSTEM_LOG_DEFAULT_RETENTION_DAYS,
+    TERM_UPDATE_MIN_COURSES_RATIO,
+    DB_BACKEND,
+    CATALOG_MAX_STALE_COURSES,
+)
+from schema import (
+    ENROLLMENT_CONTENT_FIELDS,
+    INDEXES,
+    LEGACY_CLASS_PREFIX,
+    get_course_classes,
+    get_course_class,
+    to_classes_layout,
+    get_course_content_hash,
+    get_course_dept,
+    validate_document,
+)
+from admincache import admin_cache
+from logsink import log_sink
+from identitymap import get_identity_map
+from querystats import query_listener
+from catalog import catalog_store
+from bulkwriter import BulkWriter
+from connection import (
+    get_db,
+    get_client,
+    get_pool_stats,
+    get_index_status,
+    check_basic_integrity,
+    ensure_indexes,
 )
-from schema import COURSES_SCHEMA, CLASS_SCHEMA, MAPPINGS_SCHEMA, ENROLLMENTS_SCHEMA
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure
 from datetime import datetime, timedelta
 from random import randint
+from pymongo import ReturnDocument, UpdateOne, ReplaceOne, DeleteOne
+from pymongo.errors import DuplicateKeyError
 import pytz
 import heroku3
 
 
 TZ = pytz.timezone("US/Eastern")
 
+# section fields shown for each subscription on the dashboard
+DASHBOARD_CLASS_FIELDS = ("section", "start_time", "end_time", "days")
 
-class Database:
+# collections rebuilt by a term update: it writes "<name>_next" while the
+# app keeps serving "<name>", then swaps them in, keeping the replaced
+# ones as "<name>_prev" (see commit_term_update())
+TERM_UPDATE_COLLECTIONS = ("mappings", "courses", "enrollments")
+STAGING_SUFFIX = "_next"
+PREVIOUS_SUFFIX = "_prev"
 
-    # creates a reference to the TigerSnatch MongoDB database
+# enrollment fields that a soft term update keeps for existing classes
+CARRIED_OVER_ENROLLMENT_FIELDS = ("last_notif", "prev_enrollment", "swap_out")
 
-    def __init__(self):
-        self._db = MongoClient(
-            DB_CONNECTION_STR,
-            serverSelectionTimeoutMS=5000,
-            maxIdleTimeMS=600000,
-            tlsCAFile=certifi.where(),
-        )
 
-        try:
-            self._db.admin.command("ismaster")
-        except ConnectionFailure:
-            print("failed (server not available)", file=stderr)
-            raise Exception("server unavailable")
+class Database:
 
-        self._db = self._db.tigersnatch
-        self._check_basic_integrity()
+    # creates a reference to the TigerSnatch MongoDB database, borrowed
+    # from the process-wide connection manager (see connection.py)
+
+    def __init__(self):
+        self._db = get_db()
 
     # ----------------------------------------------------------------------
     # TRADES METHODS
@@ -97,7 +124,7 @@ class Database:
                 if match_netid == netid:
                     continue
                 # check if match wants your section
-                if not curr_section in self.get_user(match_netid, "waitlists"):
+                if not self.is_subscribed(match_netid, curr_section):
                     continue
                 if match_netid in matches:
                     raise Exception(
@@ -127,9 +154,7 @@ class Database:
     # returns list of users who want to swap out of a class
 
     def get_swapout_for_class(self, classid):
-        return self._db.enrollments.find_one(
-            {"classid": classid}, {"swap_out": 1, "_id": 0}
-        )["swap_out"]
+        return self._find_enrollment(classid)["swap_out"]
 
     # updates a user's current section (classid) for a course (courseid)
 
@@ -153,10 +178,12 @@ class Database:
             self._db.users.update_one(
                 {"netid": netid}, {"$set": {"current_sections": current_sections}}
             )
+            self._evict("users", netid)
 
             self._db.enrollments.update_one(
                 {"classid": classid}, {"$addToSet": {"swap_out": netid}}
             )
+            self._evict("enrollments", classid)
         except:
             return False
 
@@ -176,10 +203,12 @@ class Database:
                 self._db.users.update_one(
                     {"netid": netid}, {"$set": {"current_sections": current_sections}}
                 )
+                self._evict("users", netid)
 
                 self._db.enrollments.update_one(
                     {"classid": classid}, {"$pull": {"swap_out": netid}}
                 )
+                self._evict("enrollments", classid)
             else:
                 print(
                     "user",
@@ -210,6 +239,7 @@ class Database:
             return False
         try:
             self._db.admin.update_one({}, {"$addToSet": {"disabled_courses": courseid}})
+            admin_cache.invalidate()
             self.clear_course_waitlists(courseid, "SYSTEM_AUTO")
             return True
         except:
@@ -223,6 +253,7 @@ class Database:
             return False
         try:
             self._db.admin.update_one({}, {"$pull": {"disabled_courses": courseid}})
+            admin_cache.invalidate()
             return True
         except:
             print(
@@ -251,10 +282,25 @@ class Database:
             },
         )
 
+    # returns the cached view of the admin document (see admincache.py)
+
+    def _get_admin_cached(self):
+        return admin_cache.get(self._db.admin)
+
+    # drops the cached view of the admin document in this process
+
+    def invalidate_admin_cache(self):
+        admin_cache.invalidate()
+
+    # returns hit/miss counters for the cached view of the admin document
+
+    def get_admin_cache_stats(self):
+        return admin_cache.get_stats()
+
     # check if netid is an admin is defined in the database
 
     def is_admin(self, netid):
-        return netid in self._db.admin.find_one({}, {"admins": 1, "_id": 0})["admins"]
+        return netid in self._get_admin_cached()["admins_set"]
 
     # returns MAX_ADMIN_LOG_LENGTH most recent admin logs
 
@@ -269,17 +315,12 @@ class Database:
     # returns dictionary with app-related data
 
     def get_app_data(self):
-        num_users = self._db.users.count_documents({})
-        num_users_on_waitlists = self._db.waitlists.count_documents(
-            {"waitlists": {"$not": {"$size": 0}}}
-        )
-        num_courses_in_db = self._db.mappings.count_documents({})
-        num_sections_with_waitlists = self._db.waitlists.count_documents({})
+        counters = self.get_stats_counters()
         return {
-            "num_users": num_users,
-            "num_users_on_waitlists": num_users_on_waitlists,
-            "num_courses_in_db": num_courses_in_db,
-            "num_sections_with_waitlists": num_sections_with_waitlists,
+            "num_users": counters["total_users"],
+            "num_users_on_waitlists": counters["subbed_users"],
+            "num_courses_in_db": self._db.mappings.count_documents({}),
+            "num_sections_with_waitlists": counters["subbed_sections"],
         }
 
     # sets notification script status to either True (on) or False (off)
@@ -291,6 +332,7 @@ class Database:
         try:
             new_status = "on" if status else "off"
             self._db.admin.update_one({}, {"$set": {"notifs_status": new_status}})
+            admin_cache.invalidate()
             if log:
                 self._add_admin_log(f"notification script is now {new_status}")
             self._add_system_log(
@@ -305,12 +347,7 @@ class Database:
 
     def get_cron_notification_status(self):
         try:
-            return (
-                self._db.admin.find_one({}, {"notifs_status": 1, "_id": 0})[
-                    "notifs_status"
-                ]
-                == "on"
-            )
+            return self._get_admin_cached()["notifs_status"] == "on"
         except:
             raise Exception('ensure that key "notifs_status" is in admin collection')
 
@@ -328,9 +365,7 @@ class Database:
     def get_current_or_next_notifs_interval(self, fmt="%-m/%-d @ %-I:%M %p"):
         tz_utc = pytz.timezone("UTC")
         tz_et = pytz.timezone("US/Eastern")
-        curr = self._db.admin.find_one({}, {"notifs_schedule": 1, "_id": 0})[
-            "notifs_schedule"
-        ]
+        curr = self._get_admin_cached()["notifs_schedule"]
         if len(curr) == 0:
             return "Next notifications period isn't scheduled. Notify a TigerApps member if this isn't fixed soon!"
         start, end = tz_utc.localize(curr[0][0]), tz_utc.localize(curr[0][1])
@@ -348,15 +383,20 @@ class Database:
 
     def update_notifs_schedule(self, data):
         self._db.admin.update_one({}, {"$set": {"notifs_schedule": data}})
+        admin_cache.invalidate()
 
     # clears and removes users from all waitlists
 
     def clear_all_waitlists(self, admin_netid):
         try:
             self._add_admin_log("clearing all subscriptions")
-            self._db.users.update_many({}, {"$set": {"waitlists": []}})
+            self._db.users.update_many({}, {"$set": {"num_subscriptions": 0}})
+            self._evict("users")
 
-            self._db["waitlists"].delete_many({})
+            self._db.subscriptions.delete_many({})
+            self._evict("waitlists")
+            self._evict("user_waitlists")
+            self._reset_subscription_counters()
 
             self._add_system_log(
                 "admin", {"message": "all subscriptions cleared"}, netid=admin_netid
@@ -371,8 +411,10 @@ class Database:
         try:
             self._add_admin_log("clearing all trades")
             self._db.users.update_many({}, {"$set": {"current_sections": {}}})
+            self._evict("users")
 
             self._db.enrollments.update_many({}, {"$set": {"swap_out": []}})
+            self._evict("enrollments")
 
             self._add_system_log(
                 "admin", {"message": "all trades cleared"}, netid=admin_netid
@@ -429,10 +471,7 @@ class Database:
 
     def clear_course_waitlists(self, courseid, admin_netid):
         try:
-            course_data = self.get_course(courseid)
-            classids = [
-                i.split("_")[1] for i in course_data.keys() if i.startswith("class_")
-            ]
+            classids = self.get_classes_in_course(courseid)
             self._add_admin_log(f"clearing subscriptions for course {courseid}")
 
             for classid in classids:
@@ -466,11 +505,13 @@ class Database:
                 self.remove_current_section(netid, courseid)
 
             print("removing user", netid, "from users and logs collections")
-            self._db.users.delete_one({"netid": netid})
-            self._db.notifs.delete_one({"netid": netid})
+            if self._db.users.delete_one({"netid": netid}).deleted_count > 0:
+                self._inc_stats_counters(total_users=-1)
+            self._evict("users", netid)
             self._db.logs.delete_one({"netid": netid})
 
         try:
+            admin_cache.invalidate()
             if self.is_admin(netid):
                 self._add_admin_log(f"user {netid} is an admin - cannot be blocked")
                 return False
@@ -479,18 +520,16 @@ class Database:
                 self._add_admin_log(f"user {netid} does not exist - cannot be blocked")
                 return False
 
-            blacklist = self.get_blacklist()
-
             # check if user is already in blacklist
-            if netid in blacklist:
+            if self.is_blacklisted(netid):
                 self._add_admin_log(f"user {netid} already blocked - not added")
                 return False
 
             if self.is_user_created(netid):
                 remove_user(netid)
 
-            blacklist.append(netid)
-            self._db.admin.update_one({}, {"$set": {"blacklist": blacklist}})
+            self._db.admin.update_one({}, {"$addToSet": {"blacklist": netid}})
+            admin_cache.invalidate()
             self._add_admin_log(f"user {netid} blocked and removed from database")
 
             self._add_system_log(
@@ -508,13 +547,13 @@ class Database:
 
     def remove_from_blacklist(self, netid, admin_netid):
         try:
-            blacklist = self.get_blacklist()
-            if netid not in blacklist:
+            admin_cache.invalidate()
+            if not self.is_blacklisted(netid):
                 self._add_admin_log(f"user {netid} not blocked - not removed")
                 return False
 
-            blacklist.remove(netid)
-            self._db.admin.update_one({}, {"$set": {"blacklist": blacklist}})
+            self._db.admin.update_one({}, {"$pull": {"blacklist": netid}})
+            admin_cache.invalidate()
             self._add_admin_log(f"user {netid} unblocked")
 
             self._add_system_log(
@@ -530,7 +569,7 @@ class Database:
     # returns list of blacklisted netids
 
     def get_blacklist(self):
-        return self._db.admin.find_one({}, {"blacklist": 1, "_id": 0})["blacklist"]
+        return list(self._get_admin_cached()["blacklist"])
 
     # returns a user's waited-on sections
 
@@ -546,11 +585,9 @@ class Database:
             return "missing"
         res = []
 
-        for classid in classids:
-            try:
-                deptnum, name, section, _ = self.classid_to_classinfo(classid)
-            except:
-                continue
+        for deptnum, name, section, _ in self.classid_to_classinfo_many(
+            classids
+        ).values():
             res.append(f"{name} ({deptnum}): {section}")
 
         if len(res) == 0:
@@ -566,13 +603,6 @@ class Database:
         def get_current_term_name():
             return self.get_current_term_code()[1]
 
-        def get_total_users():
-            return self._db.users.count_documents({})
-
-        def get_total_subscriptions():
-            data = self._db.waitlists.find({}, {"waitlist": 1, "_id": 0})
-            return sum([len(k["waitlist"]) for k in data])
-
         def get_top_n_subscribed_sections(n):
             data = self.get_top_subscriptions(target_num=n)
             if len(data) == 0:
@@ -585,9 +615,7 @@ class Database:
             return res
 
         def get_disabled_courses():
-            data = self._db.admin.find_one({}, {"disabled_courses": 1, "_id": 0})[
-                "disabled_courses"
-            ]
+            data = self.get_disabled_courses()
             if len(data) == 0:
                 return ["No courses are disabled"]
             res = ["Disabled courses:"]
@@ -611,25 +639,25 @@ class Database:
                 res.append(f"{start.strftime(fmt)} to {end.strftime(fmt)}")
             return res
 
-        def get_users_who_auto_resub():
-            return len(
-                list(
-                    self._db.users.find(
-                        {"auto_resub": {"$eq": True}}, {"_id": 0, "auto_resub": 1}
-                    )
-                )
-            )
-
         try:
+            counters = self.get_stats_counters()
+            n_auto_resub = self._db.users.count_documents({"auto_resub": True})
+            log_sink_stats = self.get_log_sink_stats()
+            n_commands = sum(e["count"] for e in self.get_query_stats())
+            catalog_stats = catalog_store.get_stats()
             res = [
                 f"Current term: {get_current_term_name()}",
-                f"# users: {get_total_users()}",
-                f"# users with >0 subscriptions: {self.get_users_who_subscribe()}",
-                f"# users with auto resub on: {get_users_who_auto_resub()}",
-                f"# subscriptions: {get_total_subscriptions()}",
-                f"# subscribed sections: {self.get_num_subscribed_sections()}",
-                f"# subscribed courses: {self.get_num_subscribed_courses()}",
+                f"# users: {counters['total_users']}",
+                f"# users with >0 subscriptions: {counters['subbed_users']}",
+                f"# users with auto resub on: {n_auto_resub}",
+                f"# subscriptions: {counters['total_subs']}",
+                f"# subscribed sections: {counters['subbed_sections']}",
+                f"# subscribed courses: {counters['subbed_courses']}",
                 f"# notifications sent: {self.get_email_counter()}",
+                f"admin cache hit rate (this worker): {round(100 * self.get_admin_cache_stats()['hit_rate'])}%",
+                f"system logs flushed/dropped (this worker): {log_sink_stats['flushed']}/{log_sink_stats['dropped']}",
+                f"MongoDB commands/slow commands (this worker): {n_commands}/{query_listener.get_n_slow()}",
+                f"course catalog version/courses (this worker): {catalog_stats['version']}/{catalog_stats['n_courses']}",
                 "====================",
             ]
             res.extend(get_top_n_subscribed_sections(n=10))
@@ -651,13 +679,14 @@ class Database:
             data = self.get_all_subscriptions_raw()
             if len(data) == 0:
                 return ["No Subscriptions found"]
+            classinfo = self.classid_to_classinfo_many(
+                [s_data["classid"] for s_data in data], entire_crosslisting=True
+            )
             res = []
             for s_data in data:
                 try:
-                    deptnum, name, section, _ = self.classid_to_classinfo(
-                        s_data["classid"], entire_crosslisting=True
-                    )
-                except:
+                    deptnum, name, section, _ = classinfo[s_data["classid"]]
+                except KeyError:
                     continue
                 res.append(f"[{s_data['size']}] {name} ({deptnum}): {section}")
             return res
@@ -674,13 +703,16 @@ class Database:
 
     # if include_waitlist is True, include each section's waitlist array in result
     def get_all_subscriptions_raw(self, include_waitlist=False):
-        fields = {"classid": 1, "size": 1, "_id": 0}
+        group = {"_id": "$classid", "size": {"$sum": 1}}
+        fields = {"classid": "$_id", "size": 1, "_id": 0}
         if include_waitlist:
+            group["waitlist"] = {"$push": "$netid"}
             fields["waitlist"] = 1
         data = list(
-            self._db.waitlists.aggregate(
+            self._db.subscriptions.aggregate(
                 [
-                    {"$addFields": {"size": {"$size": "$waitlist"}}},
+                    {"$sort": {"time": 1}},
+                    {"$group": group},
                     {"$sort": {"size": -1}},
                     {"$project": fields},
                 ]
@@ -697,13 +729,16 @@ class Database:
         if unique_courses:
             try:
                 waitlists = self.get_all_subscriptions_raw()
+                classinfo = self.classid_to_classinfo_many(
+                    [data["classid"] for data in waitlists], entire_crosslisting=True
+                )
                 courses = set()
                 for data in waitlists:
                     if len(courses) >= target_num:
                         break
-                    deptnum, name, section, _ = self.classid_to_classinfo(
-                        data["classid"], entire_crosslisting=True
-                    )
+                    if data["classid"] not in classinfo:
+                        continue
+                    deptnum, name, section, _ = classinfo[data["classid"]]
                     if deptnum not in courses:
                         courses.add(deptnum)
                         res.append(
@@ -720,10 +755,13 @@ class Database:
         else:
             try:
                 waitlists = self.get_all_subscriptions_raw()[0:target_num]
+                classinfo = self.classid_to_classinfo_many(
+                    [data["classid"] for data in waitlists], entire_crosslisting=True
+                )
                 for data in waitlists:
-                    deptnum, name, section, _ = self.classid_to_classinfo(
-                        data["classid"], entire_crosslisting=True
-                    )
+                    if data["classid"] not in classinfo:
+                        continue
+                    deptnum, name, section, _ = classinfo[data["classid"]]
                     res.append(
                         {
                             "deptnum": deptnum,
@@ -740,24 +778,207 @@ class Database:
     def get_total_user_count(self):
         return self._db.users.count_documents({})
 
+    # the following admin document counters are kept up to date with $inc
+    # as users are created/removed and (un)subscribe (see
+    # _inc_stats_counters), so that reading stats doesn't scan any
+    # collection; reconcile_stats_counters() repairs any drift
+    STATS_COUNTERS = (
+        "total_users",
+        "total_subs",
+        "subbed_users",
+        "subbed_sections",
+        "subbed_courses",
+    )
+
+    # returns the current values of STATS_COUNTERS (0 if missing)
+
+    def get_stats_counters(self):
+        stats = self._db.admin.find_one(
+            {}, {f"stats_{name}": 1 for name in Database.STATS_COUNTERS}
+        )
+        return {name: stats.get(f"stats_{name}", 0) for name in Database.STATS_COUNTERS}
+
+    # adds the given deltas (keyword arguments named after STATS_COUNTERS)
+    # to the stats counters
+
+    def _inc_stats_counters(self, **deltas):
+        deltas = {f"stats_{name}": n for name, n in deltas.items() if n != 0}
+        if len(deltas) > 0:
+            self._db.admin.update_one({}, {"$inc": deltas})
+
+    # adds delta to the number of subscriptions counted under key (e.g.
+    # "classid:12345" or "courseid:001234") in subscription_counts and
+    # returns the new number; since the read is part of the atomic
+    # update, exactly one (un)subscription sees that it was the first (1)
+    # or the last (0) one
+
+    def _inc_subscription_count(self, key, delta, session=None):
+        n = self._db.subscription_counts.find_one_and_update(
+            {"_id": key},
+            {"$inc": {"n": delta}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+            session=session,
+        )["n"]
+        if n == 0:
+            self._db.subscription_counts.delete_one(
+                {"_id": key, "n": 0}, session=session
+            )
+        return n
+
+    def _reset_subscription_counters(self):
+        self._db.subscription_counts.delete_many({})
+        self._db.admin.update_one(
+            {},
+            {
+                "$set": {
+                    "stats_total_subs": 0,
+                    "stats_subbed_users": 0,
+                    "stats_subbed_sections": 0,
+                    "stats_subbed_courses": 0,
+                }
+            },
+        )
+
+    # recomputes STATS_COUNTERS and each user's num_subscriptions from
+    # scratch, and overwrites any that have drifted (e.g. due to
+    # concurrent first/last subscriptions to a section, or a failed
+    # write), as well as the per-class and per-course counts in
+    # subscription_counts; returns a dictionary mapping each drifted
+    # counter to its (stored, actual) values. The stored values are read
+    # first and only
+    # overwritten if they are unchanged, so an $inc made while counting is
+    # never lost (the counter is rechecked on the next run instead)
+
+    def reconcile_stats_counters(self):
+        stored = self._db.admin.find_one(
+            {}, {f"stats_{name}": 1 for name in Database.STATS_COUNTERS}
+        )
+        users = list(
+            self._db.users.find({}, {"_id": 0, "netid": 1, "num_subscriptions": 1})
+        )
+        stored_counts = {
+            doc["_id"]: doc["n"] for doc in self._db.subscription_counts.find({})
+        }
+
+        user_stats = self.get_user_stats()
+        subscription_stats = self.get_subscription_stats()
+        actual = {
+            "total_users": user_stats["total_users"],
+            "total_subs": subscription_stats["total_subscriptions"],
+            "subbed_users": subscription_stats["subscribed_users"],
+            "subbed_sections": subscription_stats["subscribed_sections"],
+            "subbed_courses": subscription_stats["subscribed_courses"],
+        }
+        drift = {}
+        for name in Database.STATS_COUNTERS:
+            # None matches a missing counter
+            value = stored.get(f"stats_{name}")
+            if (0 if value is None else value) == actual[name]:
+                continue
+            res = self._db.admin.update_one(
+                {f"stats_{name}": value}, {"$set": {f"stats_{name}": actual[name]}}
+            )
+            if res.modified_count > 0:
+                drift[name] = (0 if value is None else value, actual[name])
+
+        counts = {
+            e["_id"]: e["n"]
+            for e in self._db.subscriptions.aggregate(
+                [{"$group": {"_id": "$netid", "n": {"$sum": 1}}}]
+            )
+        }
+        for user in users:
+            n = counts.get(user["netid"], 0)
+            value = user.get("num_subscriptions")
+            if value == n:
+                continue
+            res = self._db.users.update_one(
+                {"netid": user["netid"], "num_subscriptions": value},
+                {"$set": {"num_subscriptions": n}},
+            )
+            if res.modified_count > 0:
+                drift[f"num_subscriptions of {user['netid']}"] = (value, n)
+                self._evict("users", user["netid"])
+
+        actual_counts = {}
+        for field in ("classid", "courseid"):
+            for e in self._db.subscriptions.aggregate(
+                [{"$group": {"_id": f"${field}", "n": {"$sum": 1}}}]
+            ):
+                actual_counts[f"{field}:{e['_id']}"] = e["n"]
+        for key in stored_counts.keys() | actual_counts.keys():
+            value = stored_counts.get(key, 0)
+            n = actual_counts.get(key, 0)
+            if value == n:
+                continue
+            if key in stored_counts:
+                res = self._db.subscription_counts.update_one(
+                    {"_id": key, "n": value}, {"$set": {"n": n}}
+                )
+                fixed = res.modified_count > 0
+            else:
+                try:
+                    self._db.subscription_counts.insert_one({"_id": key, "n": n})
+                    fixed = True
+                except DuplicateKeyError:
+                    fixed = False
+            if fixed:
+                drift[f"subscriptions of {key}"] = (value, n)
+
+        return drift
+
     def get_total_subscriptions(self):
-        data = self._db.waitlists.find({}, {"waitlist": 1, "_id": 0})
-        return sum([len(k["waitlist"]) for k in data])
+        return self._db.subscriptions.count_documents({})
 
     def get_users_who_subscribe(self):
-        data = self._db.users.find({}, {"waitlists": 1, "_id": 0})
-        return sum([len(k["waitlists"]) > 0 for k in data])
+        return self.get_subscription_stats()["subscribed_users"]
 
     def get_num_subscribed_sections(self):
-        return self._db.waitlists.count_documents({})
+        return self.get_subscription_stats()["subscribed_sections"]
 
     def get_num_subscribed_courses(self):
-        waited_classes = list(self.get_waited_classes())
-        classids = [e["classid"] for e in waited_classes]
-        courseids = self._db.enrollments.find(
-            {"classid": {"$in": [classid for classid in classids]}}
+        return self.get_subscription_stats()["subscribed_courses"]
+
+    # returns the number of subscriptions and of distinct subscribed users,
+    # sections, and courses, computed server-side in one aggregation
+
+    def get_subscription_stats(self):
+        def count_distinct(field):
+            return [{"$group": {"_id": f"${field}"}}, {"$count": "n"}]
+
+        return self._get_facet_counts(
+            "subscriptions",
+            {
+                "total_subscriptions": [{"$count": "n"}],
+                "subscribed_users": count_distinct("netid"),
+                "subscribed_sections": count_distinct("classid"),
+                "subscribed_courses": count_distinct("courseid"),
+            },
+        )
+
+    # returns the number of users and of users with auto resub on,
+    # computed server-side in one aggregation
+
+    def get_user_stats(self):
+        return self._get_facet_counts(
+            "users",
+            {
+                "total_users": [{"$count": "n"}],
+                "auto_resub_users": [
+                    {"$match": {"auto_resub": True}},
+                    {"$count": "n"},
+                ],
+            },
         )
-        return len(set([e["courseid"] for e in courseids]))
+
+    # runs each pipeline in facets (all ending in {"$count": "n"}) in
+    # one $facet aggregation on coll; returns a dictionary mapping each
+    # facet name to its count
+
+    def _get_facet_counts(self, coll, facets):
+        res = next(self._db[coll].aggregate([{"$facet": facets}]))
+        return {name: res[name][0]["n"] if res[name] else 0 for name in facets}
 
     def get_email_counter(self):
         return self._db.admin.find_one({}, {"_id": 0, "stats_total_notifs": 1})[
@@ -820,8 +1041,7 @@ class Database:
 
     def is_blacklisted(self, netid):
         try:
-            blacklist = self.get_blacklist()
-            return netid in blacklist
+            return netid in self._get_admin_cached()["blacklist_set"]
         except Exception:
             print(f"error in checking if {netid} is on blacklist", file=stderr)
 
@@ -832,9 +1052,7 @@ class Database:
     # checks if user exists in users collection
 
     def is_user_created(self, netid):
-        return (
-            self._db.users.find_one({"netid": netid.rstrip()}, {"netid": 1}) is not None
-        )
+        return self._find_user(netid.rstrip()) is not None
 
     # creates user entry in users collection
 
@@ -848,13 +1066,14 @@ class Database:
                 "netid": netid,
                 "email": f"{netid}@princeton.edu",
                 "phone": "",
-                "waitlists": [],
+                "num_subscriptions": 0,
                 "current_sections": {},
                 "auto_resub": False,
             }
         )
-        self._db.notifs.insert_one({"netid": netid})
+        self._evict("users", netid)
         self._db.logs.insert_one({"netid": netid, "waitlist_log": [], "trade_log": []})
+        self._inc_stats_counters(total_users=1)
         print(f"successfully created user {netid}")
 
     # update user netid's waitlist log
@@ -916,7 +1135,12 @@ class Database:
 
     def get_user(self, netid, key):
         try:
-            return self._db.users.find_one({"netid": netid}, {key: 1, "_id": 0})[key]
+            user = self._find_user(netid)
+            # subscriptions live in their own collection (see
+            # get_user_waitlists) but are still served under this key
+            if key == "waitlists" and user is not None:
+                return self.get_user_waitlists(netid)
+            return user[key]
         except:
             raise Exception(f"failed to get key {key} for netid {netid}")
 
@@ -924,39 +1148,64 @@ class Database:
 
     def get_dashboard_data(self, netid):
         dashboard_data = {}
-        try:
-            waitlists = self._db.users.find_one({"netid": netid})["waitlists"]
-        except:
+        if self._find_user(netid) is None:
             raise RuntimeError(f"user {netid} does not exist")
+        waitlists = self.get_user_waitlists(netid)
+        if len(waitlists) == 0:
+            return dashboard_data
+
+        # fetch all enrollments, then all parent courses (only the fields
+        # needed for the user's sections), with one query each
+        enrollments = {
+            e["classid"]: e
+            for e in self._db.enrollments.find(
+                {"classid": {"$in": waitlists}}, {"_id": 0}
+            )
+        }
+        projection = {"_id": 0, "courseid": 1, "displayname": 1}
+        projection.update(
+            {f"classes.{k}": 1 for k in ("classid",) + DASHBOARD_CLASS_FIELDS}
+        )
+        projection.update(
+            {f"{LEGACY_CLASS_PREFIX}{classid}": 1 for classid in waitlists}
+        )
+        courses = {
+            c["courseid"]: c
+            for c in self._db.courses.find(
+                {
+                    "courseid": {
+                        "$in": list({e["courseid"] for e in enrollments.values()})
+                    }
+                },
+                projection,
+            )
+        }
+
         for classid in waitlists:
-            class_stats = self.get_class_enrollment(classid)
+            class_stats = enrollments.get(classid)
             if class_stats is None:
                 continue
 
             dashboard_data[classid] = {}
 
             courseid = class_stats["courseid"]
-            course_data = self.get_course(courseid)
-            try:
-                class_data = course_data[f"class_{classid}"]
-            except:
+            course_data = courses.get(courseid)
+            class_data = (
+                None if course_data is None else get_course_class(course_data, classid)
+            )
+            if class_data is None:
                 print(f"classid {classid} not found in courses", file=stderr)
                 del dashboard_data[classid]
                 continue
 
             dashboard_data[classid]["courseid"] = courseid
             dashboard_data[classid]["displayname"] = course_data["displayname"]
-            dashboard_data[classid]["section"] = class_data["section"]
-            dashboard_data[classid]["start_time"] = class_data["start_time"]
-            dashboard_data[classid]["end_time"] = class_data["end_time"]
-            dashboard_data[classid]["days"] = class_data["days"]
+            for k in DASHBOARD_CLASS_FIELDS:
+                dashboard_data[classid][k] = class_data[k]
             dashboard_data[classid]["enrollment"] = class_stats["enrollment"]
             dashboard_data[classid]["capacity"] = class_stats["capacity"]
 
-            try:
-                time_of_last_notif = self.get_time_of_last_notif(classid)
-            except Exception:
-                time_of_last_notif = None
+            time_of_last_notif = self._format_last_notif(class_stats.get("last_notif"))
             dashboard_data[classid]["time_of_last_notif"] = (
                 time_of_last_notif if time_of_last_notif is not None else "-"
             )
@@ -968,12 +1217,14 @@ class Database:
     def update_user(self, netid, email):
         try:
             self._db.users.update_one({"netid": netid}, {"$set": {"email": email}})
+            self._evict("users", netid)
         except:
             raise RuntimeError(f"attempt to update email for {netid} failed")
 
     def update_user_phone(self, netid, phone):
         try:
             self._db.users.update_one({"netid": netid}, {"$set": {"phone": phone}})
+            self._evict("users", netid)
         except:
             raise RuntimeError(f"attempt to update phone for {netid} failed")
 
@@ -1001,12 +1252,12 @@ class Database:
             print("user", netid, "does not exist", file=stderr)
             return None
         res = []
+        classinfo = self.classid_to_classinfo_many(current_sections.values())
 
-        for courseid in current_sections.keys():
+        for courseid, classid in current_sections.items():
             try:
-                course_name = self.courseid_to_displayname(courseid)
-                section_name = self.classid_to_sectionname(current_sections[courseid])
-            except:
+                course_name, _, section_name, _ = classinfo[classid]
+            except KeyError:
                 continue
             res.append((course_name, section_name, courseid))
 
@@ -1019,6 +1270,7 @@ class Database:
             self._db.users.update_one(
                 {"netid": netid}, {"$set": {"auto_resub": auto_resub}}
             )
+            self._evict("users", netid)
             return True
         except:
             print(f"attempt to update auto_resub for {netid} failed", file=stderr)
@@ -1028,30 +1280,61 @@ class Database:
 
     def get_user_auto_resub(self, netid):
         try:
-            auto_resub_dict = self._db.users.find_one(
-                {"netid": netid}, {"auto_resub": 1, "_id": 0}
-            )
+            auto_resub_dict = self._find_user(netid)
             if "auto_resub" not in auto_resub_dict:
                 return False
             return auto_resub_dict["auto_resub"]
         except:
             raise Exception(f"failed to get key auto_resub flag for netid {netid}")
 
-    # returns data in notifs collection corresponding to netid > classid
+    # returns the notification history (n_open_spots and last_notif) of
+    # user netid's subscription to class classid
 
     def get_user_notifs_history(self, netid, classid):
-        return self._db.notifs.find_one({"netid": netid}, {classid: 1, "_id": 0})[
-            classid
-        ]
+        return self._db.subscriptions.find_one(
+            {"netid": netid, "classid": classid},
+            {"_id": 0, "n_open_spots": 1, "last_notif": 1},
+        )
 
-    # updates n_open_spots and last_notif fields for data in notifs collection
+    # returns a snapshot of everything Notify needs about the users
+    # subscribed to classids, read in two queries (one on subscriptions,
+    # one on users):
+    #   "waitlists": {classid: [netid, ...] in waitlist order}
+    #   "history": {classid: {netid: notification history}}
+    #   "users": {netid: {"email", "phone", "auto_resub"}}
+
+    def get_notifs_snapshot(self, classids):
+        waitlists, history = {}, {}
+        subs = self._db.subscriptions.find(
+            {"classid": {"$in": list(classids)}},
+            {"_id": 0, "netid": 1, "classid": 1, "n_open_spots": 1, "last_notif": 1},
+        ).sort([("classid", 1), ("time", 1)])
+        for sub in subs:
+            waitlists.setdefault(sub["classid"], []).append(sub["netid"])
+            history.setdefault(sub["classid"], {})[sub["netid"]] = sub
+
+        netids = list({netid for waitlist in waitlists.values() for netid in waitlist})
+        users = {
+            user["netid"]: user
+            for user in self._db.users.find(
+                {"netid": {"$in": netids}},
+                {"_id": 0, "netid": 1, "email": 1, "phone": 1, "auto_resub": 1},
+            )
+        }
+        return {"waitlists": waitlists, "history": history, "users": users}
+
+    # updates n_open_spots and last_notif fields of the subscriptions to
+    # class classid
 
     def update_users_notifs_history(self, netids, classid, n_open_spots):
-        # update n_open_spots for all users subbed to classid (key classid exists)
-        self._db.notifs.update_many(
-            {classid: {"$exists": True}},
-            {"$set": {f"{classid}.n_open_spots": n_open_spots}},
+        # update n_open_spots for all users subbed to classid (skipping
+        # subscriptions that are already up to date)
+        self._db.subscriptions.update_many(
+            {"classid": classid, "n_open_spots": {"$ne": n_open_spots}},
+            {"$set": {"n_open_spots": n_open_spots}},
         )
+        if len(netids) == 0:
+            return
 
         # update last_notif for only users who received notifs (i.e. netids)
         # add or subtract a random small amount of time to help spread out notifs
@@ -1059,9 +1342,9 @@ class Database:
         new_last_notif = datetime.now(TZ) + timedelta(
             minutes=randint(-RAND_OFFSET_MINS, RAND_OFFSET_MINS)
         )
-        self._db.notifs.update_many(
-            {"netid": {"$in": netids}, classid: {"$exists": True}},
-            {"$set": {f"{classid}.last_notif": new_last_notif}},
+        self._db.subscriptions.update_many(
+            {"classid": classid, "netid": {"$in": netids}},
+            {"$set": {"last_notif": new_last_notif}},
         )
 
     # ----------------------------------------------------------------------
@@ -1071,20 +1354,20 @@ class Database:
     # gets current term code from admin collection
 
     def get_current_term_code(self):
-        res = self._db.admin.find_one(
-            {}, {"current_term_code": 1, "current_term_name": 1, "_id": 0}
-        )
+        res = self._get_admin_cached()
         return res["current_term_code"], res["current_term_name"]
 
     # updates current term code from admin collection
 
     def update_current_term_code(self, code, name):
+        admin_cache.invalidate()
         if self.get_current_term_code()[0] == code:
             return False
 
         self._db.admin.update_one(
             {}, {"$set": {"current_term_code": code, "current_term_name": name}}
         )
+        admin_cache.invalidate()
         return True
 
     # ----------------------------------------------------------------------
@@ -1094,44 +1377,154 @@ class Database:
     # returns course displayname corresponding to courseid
 
     def courseid_to_displayname(self, courseid):
+        catalog = self._get_catalog(courseid)
         try:
-            displayname = self._db.mappings.find_one({"courseid": courseid})[
-                "displayname"
-            ]
+            if catalog is not None:
+                displayname = catalog.get_displayname(courseid)
+            else:
+                displayname = self._db.mappings.find_one({"courseid": courseid})[
+                    "displayname"
+                ]
+            return displayname.split("/")[0]
         except:
             raise RuntimeError(f"courseid {courseid} not found in courses")
 
-        return displayname.split("/")[0]
+    # return basic course details for course with given courseid; fresh
+    # reads it from MongoDB, bypassing the catalog snapshot and the
+    # identity map
+
+    def get_course(self, courseid, fresh=False):
+        if fresh:
+            return self._db.courses.find_one({"courseid": courseid}, {"_id": 0})
+
+        def fetch():
+            catalog = self._get_catalog(courseid)
+            if catalog is not None:
+                return catalog.get_course(courseid)
+            return self._db.courses.find_one({"courseid": courseid}, {"_id": 0})
+
+        return self._get_cached("courses", courseid, fetch)
+
+    # returns the memory-mapped catalog snapshot (see catalog.py) of the
+    # current catalog version, building it on this machine if another
+    # one published it; None if course data (or that of courseid, if it
+    # changed since the snapshot was built) must be read from MongoDB
+
+    def _get_catalog(self, courseid=None):
+        try:
+            admin = self._get_admin_cached()
+        except:
+            return None
+        version = admin.get("catalog_version")
+        if version is None or not catalog_store.is_enabled():
+            return None
+        if courseid is not None and courseid in admin.get("catalog_stale", {}):
+            return None
+
+        catalog = catalog_store.get(version)
+        if catalog is None and catalog_store.try_lock(version):
+            try:
+                catalog_store.write(version, self._db.courses.find({}, {"_id": 0}))
+            except Exception as e:
+                print(f"failed to build catalog version {version}: {e}", file=stderr)
+            finally:
+                catalog_store.unlock(version)
+            catalog = catalog_store.get(version)
+        return catalog
+
+    # publishes a new catalog version built from the courses collection;
+    # call after replacing course data in bulk (term updates and syncs).
+    # Other processes switch to it once their cached admin document
+    # expires
+
+    def rebuild_catalog(self):
+        seq = self._reserve_catalog_seq()
+        stale = self._db.admin.find_one({}, {"_id": 0, "catalog_stale": 1})
+        if catalog_store.is_enabled():
+            catalog_store.write(seq, self._db.courses.find({}, {"_id": 0}))
+        self._publish_catalog_version(seq, seq)
+
+        # courses changed again while the snapshot was built stay stale
+        for courseid, n_changes in stale.get("catalog_stale", {}).items():
+            self._db.admin.update_one(
+                {f"catalog_stale.{courseid}": n_changes},
+                {"$unset": {f"catalog_stale.{courseid}": ""}},
+            )
+        admin_cache.invalidate()
+
+    # makes every process read course courseid from MongoDB until the next
+    # rebuild_catalog(); call after changing a single course, instead of
+    # rebuilding the whole catalog. The change that makes more than
+    # CATALOG_MAX_STALE_COURSES courses stale rebuilds it, so that the
+    # stale set stays small
+
+    def _mark_catalog_stale(self, courseid):
+        admin = self._db.admin.find_one_and_update(
+            {},
+            {"$inc": {f"catalog_stale.{courseid}": 1}},
+            projection={"catalog_stale": 1, "catalog_version": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        admin_cache.invalidate()
+
+        stale = admin["catalog_stale"]
+        if (
+            admin.get("catalog_version") is not None
+            and stale[courseid] == 1
+            and len(stale) == CATALOG_MAX_STALE_COURSES + 1
+        ):
+            print(f"more than {CATALOG_MAX_STALE_COURSES} courses are stale")
+            self.rebuild_catalog()
 
-    # return basic course details for course with given courseid
+    # makes every process read course data from MongoDB until the next
+    # rebuild_catalog()
 
-    def get_course(self, courseid):
-        return self._db.courses.find_one({"courseid": courseid}, {"_id": 0})
+    def invalidate_catalog(self):
+        self._publish_catalog_version(self._reserve_catalog_seq(), None)
+
+    def _reserve_catalog_seq(self):
+        return self._db.admin.find_one_and_update(
+            {},
+            {"$inc": {"catalog_seq": 1}},
+            projection={"catalog_seq": 1},
+            return_document=ReturnDocument.AFTER,
+        )["catalog_seq"]
+
+    # sets the current catalog version unless a later-reserved one was
+    # already published (versions are built in the order they're reserved
+    # but may finish out of order)
+
+    def _publish_catalog_version(self, seq, version):
+        self._db.admin.update_one(
+            {
+                "$or": [
+                    {"catalog_published_seq": {"$lt": seq}},
+                    {"catalog_published_seq": {"$exists": False}},
+                ]
+            },
+            {"$set": {"catalog_published_seq": seq, "catalog_version": version}},
+        )
+        admin_cache.invalidate()
 
     # returns list of tuples (section_name, classid) for a course
     # set include_lecture to True if you want Lecture section included
 
     def get_section_names_in_course(self, courseid, include_lecture=False):
         section_name_list = []
-        course_dict = self.get_course(courseid)
-        for key in course_dict.keys():
-            if key.startswith("class_"):
-                section_name = course_dict[key]["section"]
-                classid = course_dict[key]["classid"]
-                if not include_lecture and section_name.startswith("L"):
-                    continue
-                section_name_list.append((section_name, classid))
+        for class_ in get_course_classes(self.get_course(courseid)):
+            section_name = class_["section"]
+            if not include_lecture and section_name.startswith("L"):
+                continue
+            section_name_list.append((section_name, class_["classid"]))
         return section_name_list
 
     # return list of class ids for a course
 
     def get_classes_in_course(self, courseid):
-        classid_list = []
-        course_dict = self.get_course(courseid)
-        for key in course_dict.keys():
-            if key.startswith("class_"):
-                classid_list.append(course_dict[key]["classid"])
-        return classid_list
+        return [
+            class_["classid"]
+            for class_ in get_course_classes(self.get_course(courseid))
+        ]
 
     # returns dictionary with basic course details AND enrollment,
     # capacity, and boolean isFull field for each class
@@ -1140,25 +1533,37 @@ class Database:
     def get_course_with_enrollment(self, courseid):
         course_info = self.get_course(courseid)
         has_reserved_seats = course_info["has_reserved_seats"]
-        for key in course_info.keys():
-            if key.startswith("class_"):
-                class_dict = course_info[key]
-                classid = class_dict["classid"]
-                class_data = self.get_class_enrollment(classid)
-                class_dict["enrollment"] = class_data["enrollment"]
-                class_dict["capacity"] = class_data["capacity"]
-                # we mark a class as full (i.e. allow subbing) if at least one is true:
-                #   1. capacity is non-zero and enrollment is at least as large as capacity
-                #   2. class has reserved seating and positive enrollment
-                #   3. class is closed
-                class_dict["isFull"] = (
-                    (
-                        class_dict["capacity"] > 0
-                        and class_dict["enrollment"] >= class_dict["capacity"]
-                    )
-                    or (has_reserved_seats and class_dict["enrollment"] > 0)
-                    or not class_dict["status_is_open"]
+        classids = [class_["classid"] for class_ in get_course_classes(course_info)]
+        enrollments = {
+            e["classid"]: e
+            for e in self._db.enrollments.find(
+                {"classid": {"$in": classids}}, {"_id": 0}
+            )
+        }
+        for class_dict in get_course_classes(course_info):
+            classid = class_dict["classid"]
+            try:
+                class_data = enrollments[classid]
+            except KeyError:
+                raise RuntimeError(f"classid {classid} not found in enrollments")
+            class_dict["enrollment"] = class_data["enrollment"]
+            class_dict["capacity"] = class_data["capacity"]
+            # we mark a class as full (i.e. allow subbing) if at least one is true:
+            #   1. capacity is non-zero and enrollment is at least as large as capacity
+            #   2. class has reserved seating and positive enrollment
+            #   3. class is closed
+            class_dict["isFull"] = (
+                (
+                    class_dict["capacity"] > 0
+                    and class_dict["enrollment"] >= class_dict["capacity"]
                 )
+                or (has_reserved_seats and class_dict["enrollment"] > 0)
+                or not class_dict["status_is_open"]
+            )
+            time_of_last_notif = self._format_last_notif(class_data.get("last_notif"))
+            class_dict["time_of_last_notif"] = (
+                time_of_last_notif if time_of_last_notif is not None else "-"
+            )
         return course_info
 
     # updates time that a course page was last updated
@@ -1184,25 +1589,45 @@ class Database:
     # passed-in courseid
 
     def courses_contains_courseid(self, courseid):
-        return self._db.courses.find_one({"courseid": courseid}) is not None
+        return self.get_course(courseid) is not None
 
     # returns list of results whose title and displayname
     # contain user query string
 
     def search_for_course(self, query):
         query = re.compile(query, re.IGNORECASE)
+        matches = {
+            "$or": [
+                {"displayname": {"$regex": query}},
+                {"displayname_whitespace": {"$regex": query}},
+                {"title": {"$regex": query}},
+            ]
+        }
+        catalog = self._get_catalog()
+        if catalog is not None:
+            # courses changed since the snapshot was built are matched in
+            # MongoDB
+            stale = list(self._get_admin_cached().get("catalog_stale", {}))
+            res = [
+                course
+                for course in catalog.search(query)
+                if course["courseid"] not in stale
+            ]
+            if len(stale) > 0:
+                res += self._db.mappings.find(
+                    {"courseid": {"$in": stale}} | matches,
+                    {
+                        "_id": 0,
+                        "courseid": 1,
+                        "displayname": 1,
+                        "displayname_whitespace": 1,
+                        "title": 1,
+                    },
+                )
+                res.sort(key=lambda course: course["displayname"])
+            return res
 
-        res = list(
-            self._db.mappings.find(
-                {
-                    "$or": [
-                        {"displayname": {"$regex": query}},
-                        {"displayname_whitespace": {"$regex": query}},
-                        {"title": {"$regex": query}},
-                    ]
-                }
-            ).sort("displayname")
-        )
+        res = list(self._db.mappings.find(matches).sort("displayname"))
 
         return res
 
@@ -1210,10 +1635,7 @@ class Database:
 
     def is_course_disabled(self, courseid):
         try:
-            disabled_courses = self._db.admin.find_one(
-                {}, {"disabled_courses": 1, "_id": 0}
-            )["disabled_courses"]
-            return courseid in disabled_courses
+            return courseid in self._get_admin_cached()["disabled_courses_set"]
         except:
             return False
 
@@ -1221,9 +1643,7 @@ class Database:
 
     def get_disabled_courses(self):
         try:
-            return self._db.admin.find_one({}, {"disabled_courses": 1, "_id": 0})[
-                "disabled_courses"
-            ]
+            return list(self._get_admin_cached()["disabled_courses"])
         except:
             return []
 
@@ -1240,9 +1660,7 @@ class Database:
     def is_course_top_n_subscribed(self, displayname):
         try:
             displayname = " / ".join(displayname.split("/"))
-            data = self._db.admin.find_one({}, {"_id": 0, "stats_top_subs": 1})
-            top_courses = set([e["deptnum"] for e in data["stats_top_subs"]])
-            return displayname in top_courses
+            return displayname in self._get_admin_cached()["top_subs_set"]
         except:
             return False
 
@@ -1253,21 +1671,14 @@ class Database:
     # returns True if classid is found in course with courseid
     def is_classid_in_courseid(self, classid, courseid):
         try:
-            return (
-                self._db.enrollments.find_one(
-                    {"classid": classid}, {"_id": 0, "courseid": 1}
-                )["courseid"]
-                == courseid
-            )
+            return self._find_enrollment(classid)["courseid"] == courseid
         except:
             raise RuntimeError(f"classid {classid} not found in enrollments")
 
     # returns name of section specified by classid
     def classid_to_sectionname(self, classid):
         try:
-            return self._db.enrollments.find_one(
-                {"classid": classid}, {"_id": 0, "section": 1}
-            )["section"]
+            return self._find_enrollment(classid)["section"]
         except:
             raise RuntimeError(f"classid {classid} not found in enrollments")
 
@@ -1275,7 +1686,7 @@ class Database:
 
     def classid_to_course_info(self, classid):
         try:
-            courseid = self._db.enrollments.find_one({"classid": classid})["courseid"]
+            courseid = self._find_enrollment(classid)["courseid"]
         except:
             raise RuntimeError(f"classid {classid} not found in enrollments")
 
@@ -1293,19 +1704,70 @@ class Database:
 
     def classid_to_classinfo(self, classid, entire_crosslisting=False):
         try:
-            classinfo = self._db.enrollments.find_one({"classid": classid})
+            classinfo = self._find_enrollment(classid)
             courseid = classinfo["courseid"]
             sectionname = classinfo["section"]
         except:
             raise Exception(f"classid {classid} cannot be found")
 
         try:
-            mapping = self._db.courses.find_one({"courseid": courseid})
+            mapping = self.get_course(courseid)
             displayname = mapping["displayname"]
             title = mapping["title"]
         except:
             raise Exception(f"courseid {courseid} cannot be found")
 
+        return self._format_classinfo(
+            displayname, title, sectionname, courseid, entire_crosslisting
+        )
+
+    # batched version of classid_to_classinfo: resolves any iterable of
+    # classids with one $in query on enrollments and one on courses.
+    # returns a dictionary mapping classid to (dept_num, title, sectionname,
+    # courseid), in the order of classids; classids whose class or course
+    # cannot be found are left out.
+
+    def classid_to_classinfo_many(self, classids, entire_crosslisting=False):
+        classids = list(dict.fromkeys(classids))
+        if len(classids) == 0:
+            return {}
+
+        enrollments = {
+            e["classid"]: e
+            for e in self._db.enrollments.find(
+                {"classid": {"$in": classids}},
+                {"_id": 0, "classid": 1, "courseid": 1, "section": 1},
+            )
+        }
+        courseids = list({e["courseid"] for e in enrollments.values()})
+        courses = {
+            c["courseid"]: c
+            for c in self._db.courses.find(
+                {"courseid": {"$in": courseids}},
+                {"_id": 0, "courseid": 1, "displayname": 1, "title": 1},
+            )
+        }
+
+        res = {}
+        for classid in classids:
+            try:
+                enrollment = enrollments[classid]
+                course = courses[enrollment["courseid"]]
+            except KeyError:
+                continue
+            res[classid] = self._format_classinfo(
+                course["displayname"],
+                course["title"],
+                enrollment["section"],
+                enrollment["courseid"],
+                entire_crosslisting,
+            )
+        return res
+
+    @staticmethod
+    def _format_classinfo(
+        displayname, title, sectionname, courseid, entire_crosslisting
+    ):
         dept_num = displayname.split("/")[0]
         if entire_crosslisting:
             dept_num = " / ".join(displayname.split("/"))
@@ -1314,19 +1776,54 @@ class Database:
     # get dictionary for class with given classid in courses
 
     def get_class(self, courseid, classid):
-        try:
-            course_data = self.get_course(courseid)
-        except:
+        # fetch only the matching array element
+        course_data = self._db.courses.find_one(
+            {"courseid": courseid, "classes.classid": classid},
+            {"_id": 0, "classes": {"$elemMatch": {"classid": classid}}},
+        )
+        if course_data is not None:
+            return course_data["classes"][0]
+
+        course_data = self._db.courses.find_one(
+            {"courseid": courseid},
+            {"_id": 0, f"{LEGACY_CLASS_PREFIX}{classid}": 1},
+        )
+        if course_data is None:
             raise RuntimeError(f"courseid {courseid} not found in courses")
         try:
-            return course_data[f"class_{classid}"]
+            return course_data[f"{LEGACY_CLASS_PREFIX}{classid}"]
         except:
             raise RuntimeError(f"class {classid} not found in courses")
 
+    # sets fields of section classid in the document of course courseid
+    # with the positional operator, or under its class_<classid> key if
+    # the course has the legacy layout; unsets the course's content_hash,
+    # so the next sync_courses() rewrites it
+
+    def _update_course_class(self, courseid, classid, fields):
+        res = self._db.courses.update_one(
+            {"courseid": courseid, "classes.classid": classid},
+            {
+                "$set": {f"classes.$.{k}": v for k, v in fields.items()},
+                "$unset": {"content_hash": ""},
+            },
+        )
+        if res.matched_count == 0:
+            key = f"{LEGACY_CLASS_PREFIX}{classid}"
+            self._db.courses.update_one(
+                {"courseid": courseid, key: {"$exists": True}},
+                {
+                    "$set": {f"{key}.{k}": v for k, v in fields.items()},
+                    "$unset": {"content_hash": ""},
+                },
+            )
+        self._evict("courses", courseid)
+        self._mark_catalog_stale(courseid)
+
     # returns capacity and enrollment for course with given classid
 
     def get_class_enrollment(self, classid):
-        return self._db.enrollments.find_one({"classid": classid}, {"_id": 0})
+        return self._find_enrollment(classid)
 
     # updates the enrollment and capacity for class classid
 
@@ -1343,47 +1840,32 @@ class Database:
         # term update. the previous issue was that `update_one` DOES NOT add to a collection; it simply updates
         # an entry if it exists; but an entry for a new section cannot exist. as a result, the new section was being
         # added to the courses collection but not the enrollments collection, causing an error on the frontend.
-        if self._db.enrollments.find_one({"classid": classid}) is None:
+        enrollment = self._find_enrollment(classid)
+        if enrollment is None:
             self.add_to_enrollments(entirely_new_enrollment)
             return
         self._db.enrollments.update_one(
             {"classid": classid},
             {"$set": {"enrollment": new_enroll, "capacity": new_cap}},
         )
+        self._evict("enrollments", classid)
 
+        fields = {}
         if update_courses_entry:
-            courseid = self._db.enrollments.find_one(
-                {"classid": classid}, {"_id": 0, "courseid": 1}
-            )["courseid"]
-            self._db.courses.update_one(
-                {"courseid": courseid},
-                {
-                    "$set": {
-                        f"class_{classid}.enrollment": new_enroll,
-                        f"class_{classid}.capacity": new_cap,
-                    }
-                },
-            )
-
+            fields["enrollment"] = new_enroll
+            fields["capacity"] = new_cap
         # used by the "fill section" feature on the admin panel so that subbing is possible
         if set_status_to_closed:
-            self._db.courses.update_one(
-                {"courseid": courseid},
-                {
-                    "$set": {
-                        f"class_{classid}.status_is_open": False,
-                    }
-                },
-            )
+            fields["status_is_open"] = False
+        if len(fields) > 0:
+            self._update_course_class(enrollment["courseid"], classid, fields)
 
     # return the previous enrollment of a class whose course has reserved seats
     # defaults to 0 (which will not trigger notifications)
     # USE ONLY IF THE CORRESPONDING COURSE HAS RESERVED SEATS!
     def get_prev_enrollment_RESERVED_SEATS_ONLY(self, classid):
         try:
-            return self._db.enrollments.find_one({"classid": classid}, {"_id": 0})[
-                "prev_enrollment"
-            ]
+            return self._find_enrollment(classid)["prev_enrollment"]
         except:
             return 0
 
@@ -1392,6 +1874,7 @@ class Database:
             self._db.enrollments.update_one(
                 {"classid": classid}, {"$set": {"prev_enrollment": enrollment}}
             )
+            self._evict("enrollments", classid)
         except:
             raise RuntimeError(f"class {classid} not found in enrollments")
 
@@ -1402,18 +1885,27 @@ class Database:
             self._db.enrollments.update_one(
                 {"classid": classid}, {"$set": {"last_notif": datetime.now(TZ)}}
             )
+            self._evict("enrollments", classid)
         except:
             raise RuntimeError(f"class {classid} not found in enrollments")
 
     # returns the time of last notif as a string, or None if it does not exist, for class classid
     # can pass a custom format string for the datetime
     def get_time_of_last_notif(self, classid, fmt="%-m/%-d @ %-I:%M %p"):
+        try:
+            time = self._find_enrollment(classid)["last_notif"]
+        except:
+            return None
+        return self._format_last_notif(time, fmt)
+
+    # converts a UTC last_notif time (as stored in enrollments) to a
+    # string in US/Eastern time; returns None if time is missing or invalid
+
+    @staticmethod
+    def _format_last_notif(time, fmt="%-m/%-d @ %-I:%M %p"):
         try:
             tz_utc = pytz.timezone("UTC")
             tz_et = pytz.timezone("US/Eastern")
-            time = self._db.enrollments.find_one({"classid": classid}, {"_id": 0})[
-                "last_notif"
-            ]
             time = tz_utc.localize(time)
             time = time.astimezone(tz_et)
             return time.strftime(fmt)
@@ -1427,16 +1919,58 @@ class Database:
     # returns all classes to which there are waitlisted students
 
     def get_waited_classes(self):
-        return self._db.waitlists.find({}, {"courseid": 1, "classid": 1, "_id": 0})
+        return self._db.subscriptions.aggregate(
+            [
+                {"$group": {"_id": "$classid"}},
+                {"$project": {"_id": 0, "classid": "$_id"}},
+            ]
+        )
 
-    # returns a specific classid's waitlist document
+    # returns a specific classid's waitlist document, i.e.
+    # {"classid": classid, "waitlist": [netids in order of subscription]},
+    # or None if no one is subscribed to classid
 
     def get_class_waitlist(self, classid):
+        def fetch():
+            netids = [
+                s["netid"]
+                for s in self._db.subscriptions.find(
+                    {"classid": classid}, {"_id": 0, "netid": 1}
+                ).sort("time", 1)
+            ]
+            if len(netids) == 0:
+                return None
+            return {"classid": classid, "waitlist": netids}
+
         try:
-            return self._db.waitlists.find_one({"classid": classid})
+            return self._get_cached("waitlists", classid, fetch)
         except:
             raise Exception(f"classid {classid} does not exist")
 
+    # returns the classids that user netid is subscribed to, in order of
+    # subscription
+
+    def get_user_waitlists(self, netid):
+        def fetch():
+            subscriptions = self._db.subscriptions.find(
+                {"netid": netid}, {"_id": 0, "classid": 1, "time": 1}
+            )
+            return [
+                s["classid"] for s in sorted(subscriptions, key=lambda s: s["time"])
+            ]
+
+        return self._get_cached("user_waitlists", netid, fetch)
+
+    # returns True if user netid is subscribed to class classid
+
+    def is_subscribed(self, netid, classid):
+        return (
+            self._db.subscriptions.find_one(
+                {"netid": netid, "classid": classid}, {"_id": 1}
+            )
+            is not None
+        )
+
     # returns a specific classid's waitlist size
 
     def get_class_waitlist_size(self, classid):
@@ -1445,33 +1979,34 @@ class Database:
         except:
             raise Exception(f"classid {classid} does not exist")
 
+    # returns a dictionary mapping each classid in classids that has a
+    # waitlist to the size of that waitlist, using one aggregation
+
+    def get_class_waitlist_sizes(self, classids):
+        classids = list(classids)
+        if len(classids) == 0:
+            return {}
+        return {
+            wl["_id"]: wl["size"]
+            for wl in self._db.subscriptions.aggregate(
+                [
+                    {"$match": {"classid": {"$in": classids}}},
+                    {"$group": {"_id": "$classid", "size": {"$sum": 1}}},
+                ]
+            )
+        }
+
     # adds user of given netid to waitlist for class classid
 
     def add_to_waitlist(self, netid, classid, disable_checks=False):
-        # validation checks
-        def validate(courseid):
+        # validation checks that don't depend on the user's or the class's
+        # subscriptions (those are enforced atomically by the updates below)
+        def validate():
             # helper method to check if class is full
             def is_class_full(enrollment_dict):
                 return enrollment_dict["enrollment"] >= enrollment_dict["capacity"]
 
-            has_reserved_seats = self.does_course_have_reserved_seats(
-                self.classid_to_course_info(classid)[1]
-            )
-
-            # if user does not exist, do not allow sub
-            if not self.is_user_created(netid):
-                raise Exception(f"user {netid} does not exist")
-
-            class_enrollment = self.get_class_enrollment(classid)
-            # if class does not exist, do not allow sub
-            if class_enrollment is None:
-                raise Exception(f"class {classid} does not exist")
-
-            # if user is already subbed to class, do not allow sub
-            if classid in self.get_user(netid, "waitlists"):
-                raise Exception(
-                    f"user {netid} is already in waitlist for class {classid}"
-                )
+            has_reserved_seats = course_info.get("has_reserved_seats", False)
 
             # if class is in a disabled course, do not allow sub
             if self.is_course_disabled(courseid):
@@ -1479,8 +2014,9 @@ class Database:
                     f"{netid}: class {classid} is in disabled course {courseid}"
                 )
 
-            course_info = self.get_course(courseid)
-            class_status_is_open = course_info[f"class_{classid}"]["status_is_open"]
+            class_status_is_open = get_course_class(course_info, classid)[
+                "status_is_open"
+            ]
 
             # if class is open and doesn't have reserved seats, do not allow sub
             if class_status_is_open and not has_reserved_seats:
@@ -1504,49 +2040,80 @@ class Database:
                     f"user cannot enter waitlist for reserved class {classid} because its enrollment is 0"
                 )
 
-        netid = netid.strip()
-        coursedeptnum, courseid = self.classid_to_course_info(classid)
-        if not disable_checks:
-            validate(courseid)
+        # reserves one of the user's MAX_WAITLIST_SIZE subscriptions (only
+        # if the user exists and is below the limit), then inserts the
+        # subscription; the unique (netid, classid) index rejects
+        # duplicates. Returns the changes to the stats counters, or None if
+        # the user has reached the limit
+        def subscribe(session):
+            user = self._db.users.find_one_and_update(
+                {
+                    "netid": netid,
+                    "num_subscriptions": {"$not": {"$gte": MAX_WAITLIST_SIZE}},
+                },
+                {"$inc": {"num_subscriptions": 1}},
+                projection={"num_subscriptions": 1},
+                return_document=ReturnDocument.AFTER,
+                session=session,
+            )
+            if user is None:
+                self._explain_failed_subscribe(netid, session)
+                return None
 
-        # add classid to user's waitlist
-        user_waitlists = self.get_user(netid, "waitlists")
-        try:
-            if len(user_waitlists) >= MAX_WAITLIST_SIZE:
-                print(
-                    "user",
-                    netid,
-                    "exceeded the waitlist limit of",
-                    MAX_WAITLIST_SIZE,
-                    file=stderr,
+            now = datetime.now(TZ)
+            try:
+                self._db.subscriptions.insert_one(
+                    {
+                        "netid": netid,
+                        "classid": classid,
+                        "courseid": courseid,
+                        "time": now,
+                        "n_open_spots": 0,
+                        "last_notif": now,
+                    },
+                    session=session,
+                )
+            except DuplicateKeyError:
+                # inside a transaction, the abort undoes the reservation
+                if session is None:
+                    self._db.users.update_one(
+                        {"netid": netid}, {"$inc": {"num_subscriptions": -1}}
+                    )
+                raise Exception(
+                    f"user {netid} is already in waitlist for class {classid}"
                 )
-                return 0
-        except Exception as e:
-            print(e, file=stderr)
-
-        user_waitlists.append(classid)
-        self._db.users.update_one(
-            {"netid": netid}, {"$set": {"waitlists": user_waitlists}}
-        )
 
-        # add user to waitlist for classid
-        waitlist = self.get_class_waitlist(classid)
-        if waitlist is None:
-            self._db.waitlists.insert_one({"classid": classid, "waitlist": []})
-            class_waitlist = []
-        else:
-            class_waitlist = waitlist["waitlist"]
+            n_class = self._inc_subscription_count(f"classid:{classid}", 1, session)
+            n_course = self._inc_subscription_count(f"courseid:{courseid}", 1, session)
+            return {
+                "total_subs": 1,
+                "subbed_users": int(user["num_subscriptions"] == 1),
+                "subbed_sections": int(n_class == 1),
+                "subbed_courses": int(n_course == 1),
+            }
 
-        class_waitlist.append(netid)
-        self._db.waitlists.update_one(
-            {"classid": classid}, {"$set": {"waitlist": class_waitlist}}
-        )
+        netid = netid.strip()
+        class_enrollment = self.get_class_enrollment(classid)
+        # if class does not exist, do not allow sub
+        if class_enrollment is None:
+            raise Exception(f"class {classid} does not exist")
+        courseid = class_enrollment["courseid"]
+        course_info = self.get_course(courseid, fresh=True)
+        if course_info is None:
+            raise RuntimeError(f"courseid {courseid} not found in courses")
+        coursedeptnum = course_info["displayname"].split("/")[0]
+        if not disable_checks:
+            validate()
 
-        # add class to user's document in notifs collection with default values
-        self._db.notifs.update_one(
-            {"netid": netid},
-            {"$set": {classid: {"n_open_spots": 0, "last_notif": datetime.now(TZ)}}},
-        )
+        try:
+            deltas = self._run_waitlist_update(subscribe)
+        finally:
+            self._evict_subscription(netid, classid)
+        if deltas is None:
+            return 0
+        # outside the transaction, so that the admin document isn't a
+        # write conflict between concurrent (un)subscriptions
+        self._inc_stats_counters(**deltas)
 
         self._add_system_log(
             "subscription",
@@ -1557,56 +2124,96 @@ class Database:
 
         return 1
 
-    # removes user of given netid to waitlist for class classid
-    # if waitlist for class is empty now, delete entry from waitlists collection
+    # called when the conditional update in add_to_waitlist matched no
+    # user; raises if the user does not exist, and prints that the user
+    # has reached the waitlist limit otherwise
+
+    def _explain_failed_subscribe(self, netid, session=None):
+        user = self._db.users.find_one({"netid": netid}, {"_id": 1}, session=session)
+        if user is None:
+            raise Exception(f"user {netid} does not exist")
+        print(
+            "user",
+            netid,
+            "exceeded the waitlist limit of",
+            MAX_WAITLIST_SIZE,
+            file=stderr,
+        )
+
+    # forgets cached copies of the user and class documents and
+    # subscription lists affected by a (un)subscription
+
+    def _evict_subscription(self, netid, classid):
+        self._evict("users", netid)
+        self._evict("user_waitlists", netid)
+        self._evict("waitlists", classid)
+
+    # runs update(session) inside a multi-document transaction if
+    # WAITLIST_TRANSACTIONS is set (requires a replica set), otherwise
+    # runs update(None); returns the result of update
+
+    def _run_waitlist_update(self, update):
+        if not WAITLIST_TRANSACTIONS:
+            return update(None)
+        with get_client().start_session() as session:
+            return session.with_transaction(update)
+
+    # removes user of given netid from waitlist for class classid
 
     def remove_from_waitlist(self, netid, classid):
-        def validate(courseid):
-            if not self.is_user_created(netid):
-                raise Exception(f"user {netid} does not exist")
-            waitlist = self.get_class_waitlist(classid)
-            if waitlist is None:
-                raise Exception(
-                    f"no waitlist for class {classid} exists (user {netid})"
-                )
-            if (
-                classid not in self.get_user(netid, "waitlists")
-                or netid not in waitlist["waitlist"]
-            ):
+        # deletes the subscription (if it exists) and releases one of the
+        # user's subscriptions; returns the changes to the stats counters
+        def unsubscribe(session):
+            res = self._db.subscriptions.delete_one(
+                {"netid": netid, "classid": classid}, session=session
+            )
+            if res.deleted_count == 0:
+                if not self._db.users.find_one(
+                    {"netid": netid}, {"_id": 1}, session=session
+                ):
+                    raise Exception(f"user {netid} does not exist")
                 raise Exception(f"user {netid} not in waitlist for class {classid}")
-            if self.is_course_disabled(courseid):
-                raise Exception(
-                    f"{netid}: class {classid} is in disabled course {courseid}"
-                )
 
-        netid = netid.strip()
-        coursedeptnum, courseid = self.classid_to_course_info(classid)
-        validate(courseid)
+            user = self._db.users.find_one_and_update(
+                {"netid": netid},
+                {"$inc": {"num_subscriptions": -1}},
+                projection={"num_subscriptions": 1},
+                return_document=ReturnDocument.AFTER,
+                session=session,
+            )
 
-        # remove classid from user's waitlist
-        user_waitlists = self.get_user(netid, "waitlists")
-        user_waitlists.remove(classid)
-        self._db.users.update_one(
-            {"netid": netid}, {"$set": {"waitlists": user_waitlists}}
-        )
+            n_class = self._inc_subscription_count(f"classid:{classid}", -1, session)
+            n_course = self._inc_subscription_count(f"courseid:{courseid}", -1, session)
+            return {
+                "total_subs": -1,
+                "subbed_users": -int(
+                    user is not None and user["num_subscriptions"] == 0
+                ),
+                "subbed_sections": -int(n_class == 0),
+                "subbed_courses": -int(n_course == 0),
+            }
 
-        # remove user from waitlist for classid
-        class_waitlist = self.get_class_waitlist(classid)["waitlist"]
-        class_waitlist.remove(netid)
-        if len(class_waitlist) == 0:
-            self._db.waitlists.delete_one({"classid": classid})
-            # reset prev_enrollment to 0 if the course has reserved seats
-            if self.does_course_have_reserved_seats(
-                self.classid_to_course_info(classid)[1]
-            ):
-                self.update_prev_enrollment_RESERVED_SEATS_ONLY(classid, 0)
-        else:
-            self._db.waitlists.update_one(
-                {"classid": classid}, {"$set": {"waitlist": class_waitlist}}
+        netid = netid.strip()
+        class_enrollment = self.get_class_enrollment(classid)
+        if class_enrollment is None:
+            raise RuntimeError(f"classid {classid} not found in enrollments")
+        courseid = class_enrollment["courseid"]
+        coursedeptnum = self.courseid_to_displayname(courseid)
+        if self.is_course_disabled(courseid):
+            raise Exception(
+                f"{netid}: class {classid} is in disabled course {courseid}"
             )
 
-        # remove class from user's document in notifs collection
-        self._db.notifs.update_one({"netid": netid}, {"$unset": {classid: ""}})
+        try:
+            deltas = self._run_waitlist_update(unsubscribe)
+        finally:
+            self._evict_subscription(netid, classid)
+        self._inc_stats_counters(**deltas)
+        is_empty = deltas["subbed_sections"] == -1
+
+        # reset prev_enrollment to 0 if the course has reserved seats
+        if is_empty and self.does_course_have_reserved_seats(courseid):
+            self.update_prev_enrollment_RESERVED_SEATS_ONLY(classid, 0)
 
         self._add_system_log(
             "subscription",
@@ -1623,20 +2230,9 @@ class Database:
     # (see Technical Documentation for schema)
 
     def add_to_courses(self, data):
-        def validate(data):
-            # validates the keys of the passed-in course data dictionary
-
-            if not all(k in data for k in COURSES_SCHEMA):
-                raise RuntimeError("invalid courses document schema")
-
-            for k in data:
-                if not k.startswith("class_"):
-                    continue
-                if not all(k_ in data[k] for k_ in CLASS_SCHEMA):
-                    raise RuntimeError("invalid individual class document schema")
-
-        validate(data)
-        self._db.courses.insert_one(data)
+        validate_document("courses", data)
+        self._db.courses.insert_one(to_classes_layout(data))
+        self._evict("courses", data["courseid"])
 
     # updates course entry in courses, mappings, and enrollment
     # collections with data dictionary
@@ -1650,21 +2246,12 @@ class Database:
         new_cap,
         entirely_new_enrollments,
     ):
-        def validate(new_course, new_mapping):
-            if not all(k in new_course for k in COURSES_SCHEMA):
-                raise RuntimeError("invalid courses document schema")
-
-            for k in new_course:
-                if not k.startswith("class_"):
-                    continue
-                if not all(k_ in new_course[k] for k_ in CLASS_SCHEMA):
-                    raise RuntimeError("invalid individual class document schema")
-
-            if not all(k in new_mapping for k in MAPPINGS_SCHEMA):
-                raise RuntimeError("invalid mappings document schema")
-
-        validate(new_course, new_mapping)
-        self._db.courses.replace_one({"courseid": courseid}, new_course)
+        validate_document("courses", new_course)
+        validate_document("mappings", new_mapping)
+        self._db.courses.replace_one(
+            {"courseid": courseid}, to_classes_layout(new_course)
+        )
+        self._evict("courses", courseid)
         for classid in new_enroll.keys():
             self.update_enrollment(
                 classid,
@@ -1674,34 +2261,28 @@ class Database:
                 update_courses_entry=False,
             )
         self._db.mappings.replace_one({"courseid": courseid}, new_mapping)
+        self._mark_catalog_stale(courseid)
 
     # adds a document containing mapping data to the mappings collection
     # (see Technical Documentation for schema)
 
     def add_to_mappings(self, data):
-        def validate(data):
-            # validates the keys of the passed-in mappings data
-            # dictionary
-
-            if not all(k in data for k in MAPPINGS_SCHEMA):
-                raise RuntimeError("invalid mappings document schema")
-
-        validate(data)
+        validate_document("mappings", data)
         self._db.mappings.insert_one(data)
 
     # adds a document containing enrollment data to the enrollments
     # collection (see Technical Documentation for schema)
 
     def add_to_enrollments(self, data):
-        def validate(data):
-            # validates the keys of the passed-in enrollments data
-            # dictionary
+        validate_document("enrollments", data)
+        self._db.enrollments.insert_one(data)
+        self._evict("enrollments", data["classid"])
 
-            if not all(k in data for k in ENROLLMENTS_SCHEMA):
-                raise RuntimeError("invalid enrollments document schema")
+    # returns the live collection coll, or its staging collection if
+    # staged is True
 
-        validate(data)
-        self._db.enrollments.insert_one(data)
+    def _get_term_coll(self, coll, staged):
+        return self._db[coll + STAGING_SUFFIX] if staged else self._db[coll]
 
     # ----------------------------------------------------------------------
     # DATABASE RESET METHODS
@@ -1712,7 +2293,8 @@ class Database:
     #   * deletes all documents from mappings
     #   * deletes all documents from courses
     #   * deletes all documents from enrollments
-    #   * deletes all documents from waitlists
+    #   * deletes all documents from subscriptions
+    #   * stops serving the course catalog snapshot
     # NOTE: does not affect user-specific data apart from clearing a
     # user's subscriptions
 
@@ -1720,48 +2302,442 @@ class Database:
         def clear_coll(coll):
             print("clearing", coll)
             self._db[coll].delete_many({})
+            self._evict(coll)
 
-        print("clearing waitlists and current_sections in users")
+        self._clear_subscription_data()
+        self.invalidate_catalog()
+        clear_coll("mappings")
+        clear_coll("courses")
+        clear_coll("enrollments")
+
+    # clears the subscription-related data that reset_db() clears: user
+    # subscription counts, current sections, and logs, disabled courses,
+    # and all subscriptions
+
+    def _clear_subscription_data(self):
+        print("clearing num_subscriptions and current_sections in users")
         self._db.users.update_many(
-            {}, {"$set": {"waitlists": [], "current_sections": {}}}
+            {}, {"$set": {"num_subscriptions": 0, "current_sections": {}}}
         )
+        self._evict("users")
 
         print("resetting user logs")
         self._db.logs.update_many({}, {"$set": {"waitlist_log": [], "trade_log": []}})
 
         print("clearing disabled courses")
         self._db.admin.update_one({}, {"$set": {"disabled_courses": []}})
+        admin_cache.invalidate()
 
-        clear_coll("mappings")
-        clear_coll("courses")
-        clear_coll("enrollments")
-        clear_coll("waitlists")
-        clear_coll("notifs")
-
-        print("repopulating documents in notifs")
-        for doc in self._db.users.find({}, {"netid": 1}):
-            self._db.notifs.insert_one({"netid": doc["netid"]})
+        print("clearing subscriptions")
+        self._db.subscriptions.delete_many({})
+        self._evict("subscriptions")
+        self._evict("waitlists")
+        self._evict("user_waitlists")
+        self._reset_subscription_counters()
 
     # does the following:
     #   * deletes all documents from mappings
     #   * deletes all documents from courses
     #   * deletes all documents from enrollments
     #   * deletes all user current sections
+    #   * stops serving the course catalog snapshot
     # NOTE: does NOT clear waitlist-related data, unlike self.reset_db()
 
     def soft_reset_db(self):
         def clear_coll(coll):
             print("clearing", coll)
             self._db[coll].delete_many({})
+            self._evict(coll)
 
+        self.invalidate_catalog()
         clear_coll("mappings")
         clear_coll("courses")
         clear_coll("enrollments")
 
+    # ----------------------------------------------------------------------
+    # TERM UPDATE METHODS
+    # ----------------------------------------------------------------------
+
+    # drops any leftover staging collections of a term update and creates
+    # their indexes (a renamed collection keeps its indexes); add staged
+    # documents with get_term_update_writer(), then call
+    # commit_term_update(). The app keeps serving the live collections in
+    # the meantime
+
+    def begin_term_update(self):
+        for coll in TERM_UPDATE_COLLECTIONS:
+            self._db.drop_collection(coll + STAGING_SUFFIX)
+        status = ensure_indexes(
+            self._db,
+            [
+                (coll + STAGING_SUFFIX, keys, options)
+                for coll, keys, options in INDEXES
+                if coll in TERM_UPDATE_COLLECTIONS
+            ],
+        )
+        if len(status["failed"]) > 0:
+            raise RuntimeError(f"failed to create staging indexes {status['failed']}")
+
+    # returns a BulkWriter (see bulkwriter.py) into the staging collections
+    # of a term update
+
+    def get_term_update_writer(self):
+        return BulkWriter(self._db, STAGING_SUFFIX)
+
+    # returns a list of problems that prevent committing the staged term
+    # update (empty if there are none): every staged course must have a
+    # mapping and an enrollment per section, and at least
+    # TERM_UPDATE_MIN_COURSES_RATIO as many courses as are live must be
+    # staged
+
+    def validate_term_update(self):
+        problems = []
+        staged_courses = list(
+            self._get_term_coll("courses", True).find(
+                {}, {"_id": 0, "courseid": 1, "classes": 1}
+            )
+        )
+        n_live = self._db.courses.count_documents({})
+        if len(staged_courses) == 0:
+            problems.append("no courses were staged")
+        elif len(staged_courses) < TERM_UPDATE_MIN_COURSES_RATIO * n_live:
+            problems.append(
+                f"only {len(staged_courses)} courses were staged ({n_live} are live)"
+            )
+
+        courseids = {course["courseid"] for course in staged_courses}
+        classids = {
+            class_["classid"]
+            for course in staged_courses
+            for class_ in get_course_classes(course)
+        }
+        mapped = {
+            mapping["courseid"]
+            for mapping in self._get_term_coll("mappings", True).find(
+                {}, {"_id": 0, "courseid": 1}
+            )
+        }
+        enrolled = {
+            enrollment["classid"]
+            for enrollment in self._get_term_coll("enrollments", True).find(
+                {}, {"_id": 0, "classid": 1}
+            )
+        }
+        if len(courseids - mapped) > 0:
+            problems.append(f"{len(courseids - mapped)} staged courses have no mapping")
+        if len(classids - enrolled) > 0:
+            problems.append(
+                f"{len(classids - enrolled)} staged sections have no enrollment"
+            )
+        return problems
+
+    # validates the staged term update and swaps the staged collections in
+    # for the live ones, keeping the replaced ones for
+    # rollback_term_update(); raises a RuntimeError (leaving the live
+    # collections untouched) if validation fails. A soft update first
+    # copies CARRIED_OVER_ENROLLMENT_FIELDS of existing classes into the
+    # staged enrollments, so changes made while it was staged are kept; a
+    # hard update clears subscription-related data (see reset_db())
+
+    def commit_term_update(self, hard_reset):
+        problems = self.validate_term_update()
+        if len(problems) > 0:
+            raise RuntimeError(f"invalid term update: {'; '.join(problems)}")
+
+        if not hard_reset:
+            self._carry_over_enrollments()
+        self._swap_term_collections(STAGING_SUFFIX, PREVIOUS_SUFFIX)
+        if hard_reset:
+            self._clear_subscription_data()
+        self.rebuild_catalog()
+
+    # swaps the previous generation of course data back in, keeping the
+    # rolled-back one in the staging collections until the next
+    # begin_term_update(); subscription-related data cleared by a hard
+    # update is not restored
+
+    def rollback_term_update(self):
+        existing = set(self._db.list_collection_names())
+        missing = [
+            coll + PREVIOUS_SUFFIX
+            for coll in TERM_UPDATE_COLLECTIONS
+            if coll + PREVIOUS_SUFFIX not in existing
+        ]
+        if len(missing) > 0:
+            raise RuntimeError(f"no previous generation to roll back to: {missing}")
+
+        self._swap_term_collections(PREVIOUS_SUFFIX, STAGING_SUFFIX)
+        self.rebuild_catalog()
+
+    # renames every live coll to "<coll><replaced_suffix>", then every
+    # "<coll><suffix>" to coll. The app is put in maintenance mode (unless
+    # it already is, or uses the in-memory backend) while the renames run,
+    # since it would otherwise see some collections missing or a mix of
+    # old and new ones
+
+    def _swap_term_collections(self, suffix, replaced_suffix):
+        existing = set(self._db.list_collection_names())
+        was_in_maintenance = DB_BACKEND != "mongo" or self.get_maintenance_status()
+        if not was_in_maintenance:
+            self.set_maintenance_status(True)
+        try:
+            for coll in TERM_UPDATE_COLLECTIONS:
+                if coll in existing:
+                    self._db[coll].rename(coll + replaced_suffix, dropTarget=True)
+            for coll in TERM_UPDATE_COLLECTIONS:
+                self._db[coll + suffix].rename(coll, dropTarget=True)
+        finally:
+            if not was_in_maintenance:
+                self.set_maintenance_status(False)
+
+        for coll in TERM_UPDATE_COLLECTIONS:
+            self._evict(coll)
+        print(
+            "swapped in", ", ".join(coll + suffix for coll in TERM_UPDATE_COLLECTIONS)
+        )
+
+    # writes only the differences between documents, an iterable of
+    # (mapping, course, enrollments) fetched from MobileApp (see
+    # update_all_courses_utils.py), and the live course data: courses
+    # whose content hash differs from the stored one (see
+    # get_course_content_hash()) are replaced along with their mapping,
+    # their new or changed sections are upserted (leaving
+    # CARRIED_OVER_ENROLLMENT_FIELDS alone), and courses and sections that
+    # are gone are deleted, except those listed under kept_depts
+    # (departments that failed to be fetched; read once documents are
+    # exhausted, so it may be filled while they are fetched). documents
+    # are streamed: only the stored hashes, the changed courses, and the
+    # fetched ids are held in memory. Raises a RuntimeError, writing
+    # nothing, if fewer than TERM_UPDATE_MIN_COURSES_RATIO as many courses
+    # as are live were fetched or kept. Returns {"n_courses",
+    # "n_sections" (fetched), "n_changed_courses", "new_courses", "writes"
+    # (per collection), "n_writes", "n_full_writes"}, where n_full_writes
+    # is the number of documents a full update (see commit_term_update())
+    # would write instead
+
+    def sync_courses(self, documents, kept_depts=()):
+        stored_hashes = {
+            course["courseid"]: course.get("content_hash")
+            for course in self._db.courses.find(
+                {}, {"_id": 0, "courseid": 1, "content_hash": 1}
+            )
+        }
+        mapped = {
+            mapping["courseid"]
+            for mapping in self._db.mappings.find({}, {"_id": 0, "courseid": 1})
+        }
+
+        writes = {coll: [] for coll in TERM_UPDATE_COLLECTIONS}
+        fetched_courseids = set()
+        fetched_classids = set()
+        # stored classids of changed courses, checked for deleted sections
+        # once every section has been fetched
+        replaced_classids = set()
+        n_changed_courses = 0
+        new_courses = []
+
+        for mapping, course, enrollments in documents:
+            courseid = course["courseid"]
+            fetched_courseids.add(courseid)
+            fetched_classids.update(e["classid"] for e in enrollments)
+            content_hash = get_course_content_hash(course, enrollments)
+            if courseid not in stored_hashes:
+                new_courses.append(course["displayname"])
+            elif stored_hashes[courseid] == content_hash and courseid in mapped:
+                continue
+
+            n_changed_courses += 1
+            writes["mappings"].append(
+                ReplaceOne({"courseid": courseid}, mapping, upsert=True)
+            )
+            writes["courses"].append(
+                ReplaceOne(
+                    {"courseid": courseid},
+                    to_classes_layout(course) | {"content_hash": content_hash},
+                    upsert=True,
+                )
+            )
+            stored_classes = {
+                enrollment["classid"]: enrollment
+                for enrollment in self._db.enrollments.find(
+                    {"courseid": courseid},
+                    {"_id": 0, **{k: 1 for k in ENROLLMENT_CONTENT_FIELDS}},
+                )
+            }
+            for enrollment in enrollments:
+                content = {k: enrollment[k] for k in ENROLLMENT_CONTENT_FIELDS}
+                if stored_classes.pop(enrollment["classid"], None) == content:
+                    continue
+                writes["enrollments"].append(
+                    UpdateOne(
+                        {"classid": enrollment["classid"]},
+                        {"$set": content, "$setOnInsert": {"swap_out": []}},
+                        upsert=True,
+                    )
+                )
+            replaced_classids.update(stored_classes)
+
+        gone_courseids = (stored_hashes.keys() | mapped) - fetched_courseids
+        if len(gone_courseids) > 0 and len(kept_depts) > 0:
+            gone_courseids -= {
+                course["courseid"]
+                for course in self._db.courses.find(
+                    {"courseid": {"$in": list(gone_courseids)}},
+                    {"_id": 0, "courseid": 1, "displayname": 1},
+                )
+                if get_course_dept(course["displayname"]) in kept_depts
+            }
+        n_courses = len((stored_hashes.keys() - gone_courseids) | fetched_courseids)
+        if n_courses < TERM_UPDATE_MIN_COURSES_RATIO * len(stored_hashes):
+            raise RuntimeError(
+                f"only {n_courses} courses were fetched or kept ({len(stored_hashes)} are live)"
+            )
+
+        # sections of changed courses that MobileApp no longer lists, and
+        # courses (and their sections) that it no longer lists at all
+        for classid in replaced_classids - fetched_classids:
+            writes["enrollments"].append(DeleteOne({"classid": classid}))
+        for courseid in gone_courseids:
+            if courseid in stored_hashes:
+                writes["courses"].append(DeleteOne({"courseid": courseid}))
+            if courseid in mapped:
+                writes["mappings"].append(DeleteOne({"courseid": courseid}))
+        if len(gone_courseids) > 0:
+            for enrollment in self._db.enrollments.find(
+                {"courseid": {"$in": list(gone_courseids)}}, {"_id": 0, "classid": 1}
+            ):
+                if enrollment["classid"] not in fetched_classids:
+                    writes["enrollments"].append(
+                        DeleteOne({"classid": enrollment["classid"]})
+                    )
+
+        for coll, ops in writes.items():
+            if len(ops) > 0:
+                self._db[coll].bulk_write(ops, ordered=False)
+                self._evict(coll)
+        if len(writes["courses"]) + len(writes["mappings"]) > 0:
+            self.rebuild_catalog()
+
+        return {
+            "n_courses": len(fetched_courseids),
+            "n_sections": len(fetched_classids),
+            "n_changed_courses": n_changed_courses,
+            "new_courses": new_courses,
+            "writes": {coll: len(ops) for coll, ops in writes.items()},
+            "n_writes": sum(len(ops) for ops in writes.values()),
+            "n_full_writes": 2 * len(fetched_courseids) + len(fetched_classids),
+        }
+
+    # returns the live data of the courses listed under dept_codes as
+    # (mapping, course, enrollments) documents like those fetched from
+    # MobileApp (see update_all_courses_utils.py), so that a term update
+    # can keep departments that it failed to fetch
+
+    def get_live_course_documents(self, dept_codes):
+        courseids = [
+            course["courseid"]
+            for course in self._db.courses.find(
+                {}, {"_id": 0, "courseid": 1, "displayname": 1}
+            )
+            if get_course_dept(course["displayname"]) in dept_codes
+        ]
+        if len(courseids) == 0:
+            return []
+
+        mappings = {
+            mapping["courseid"]: mapping
+            for mapping in self._db.mappings.find(
+                {"courseid": {"$in": courseids}}, {"_id": 0}
+            )
+        }
+        enrollments = {}
+        for enrollment in self._db.enrollments.find(
+            {"courseid": {"$in": courseids}},
+            {"_id": 0, **{k: 1 for k in ENROLLMENT_CONTENT_FIELDS}},
+        ):
+            enrollment["swap_out"] = []
+            enrollments.setdefault(enrollment["courseid"], []).append(enrollment)
+
+        return [
+            (
+                mappings[course["courseid"]],
+                course,
+                enrollments.get(course["courseid"], []),
+            )
+            for course in self._db.courses.find(
+                {"courseid": {"$in": courseids}}, {"_id": 0}
+            )
+            if course["courseid"] in mappings
+        ]
+
+    # copies CARRIED_OVER_ENROLLMENT_FIELDS from live enrollments to the
+    # staged enrollments of the same classes
+
+    def _carry_over_enrollments(self):
+        updates = []
+        for enrollment in self._db.enrollments.find(
+            {},
+            {"_id": 0, "classid": 1, **{k: 1 for k in CARRIED_OVER_ENROLLMENT_FIELDS}},
+        ):
+            fields = {
+                k: enrollment[k]
+                for k in CARRIED_OVER_ENROLLMENT_FIELDS
+                if k in enrollment
+            }
+            # staged enrollments start with an empty trades list
+            if len(fields.get("swap_out", [])) == 0:
+                fields.pop("swap_out", None)
+            if len(fields) > 0:
+                updates.append(
+                    UpdateOne({"classid": enrollment["classid"]}, {"$set": fields})
+                )
+        if len(updates) > 0:
+            res = self._get_term_coll("enrollments", True).bulk_write(
+                updates, ordered=False
+            )
+            print(f"carried over data of {res.matched_count} existing classes")
+
     # ----------------------------------------------------------------------
     # UTILITY METHODS
     # ----------------------------------------------------------------------
 
+    # returns the document in collection coll whose field equals key,
+    # fetching it at most once per request (see identitymap.py)
+
+    def _find_cached(self, coll, field, key):
+        return self._get_cached(
+            coll, key, lambda: self._db[coll].find_one({field: key}, {"_id": 0})
+        )
+
+    # returns fetch(), calling it at most once per request for the given
+    # (coll, key) pair
+
+    def _get_cached(self, coll, key, fetch):
+        imap = get_identity_map()
+        if imap is None:
+            return fetch()
+
+        found, doc = imap.get(coll, key)
+        if found:
+            return doc
+        doc = fetch()
+        imap.put(coll, key, doc)
+        return doc
+
+    def _find_user(self, netid):
+        return self._find_cached("users", "netid", netid)
+
+    def _find_enrollment(self, classid):
+        return self._find_cached("enrollments", "classid", classid)
+
+    # forgets cached copies of documents in coll (those with the given key,
+    # or all of them if key is None) after they are written
+
+    def _evict(self, coll, key=None):
+        imap = get_identity_map()
+        if imap is not None:
+            imap.evict(coll, key)
+
     def increment_email_counter(self, n):
         if n <= 0:
             return
@@ -1776,10 +2752,26 @@ class Database:
     # raises a RuntimeError if not
 
     def _check_basic_integrity(self):
-        if COLLECTIONS != set(self._db.list_collection_names()):
-            raise RuntimeError(
-                "one or more database collections is misnamed and/or missing"
-            )
+        check_basic_integrity(self._db)
+
+    # returns which declared indexes (see INDEXES in schema.py) were
+    # created, verified, or failed when this process connected (None if
+    # they had already been ensured for the current INDEXES)
+
+    def get_index_status(self):
+        return get_index_status()
+
+    # returns connection pool statistics for the current process
+
+    def get_pool_stats(self):
+        return get_pool_stats()
+
+    # returns the count and latency histogram of MongoDB commands issued
+    # by the current process per (scope, collection, operation), where the
+    # scope is a Flask route or cron job (see querystats.py)
+
+    def get_query_stats(self):
+        return query_listener.get_stats()
 
     # turn Heroku maintenance mode ON (True) or OFF (False)
 
@@ -1819,6 +2811,9 @@ class Database:
     def _add_system_log(self, type, meta, netid=None, print_=True):
         meta["type"] = type
         meta["time"] = datetime.now(TZ)
+        meta["expire_at"] = meta["time"] + timedelta(
+            days=SYSTEM_LOG_RETENTION_DAYS.get(type, SYSTEM_LOG_DEFAULT_RETENTION_DAYS)
+        )
         if netid is not None:
             meta["netid"] = netid
         if "message" in meta and print_:
@@ -1826,7 +2821,33 @@ class Database:
                 f'System Log @ {meta["time"].strftime("%-I:%M:%S %p ET")} > {meta["message"]}'
             )
             stdout.flush()
-        self._db.system.insert_one(meta)
+        log_sink.put(meta)
+
+    # returns the per-month summaries of system logs (written when a month
+    # is rolled over, see _exec_rollover_system_logs.py), optionally only
+    # those of the given type and for periods ("YYYY-MM") in [start, end]
+
+    def get_system_log_summaries(self, type=None, start=None, end=None):
+        query = {}
+        if type is not None:
+            query["type"] = type
+        if start is not None or end is not None:
+            query["period"] = {}
+            if start is not None:
+                query["period"]["$gte"] = start
+            if end is not None:
+                query["period"]["$lte"] = end
+        return list(
+            self._db.system_summaries.find(query, {"_id": 0}).sort(
+                [("period", 1), ("type", 1)]
+            )
+        )
+
+    # returns queued/flushed/dropped counters for this process's buffered
+    # system log writer
+
+    def get_log_sink_stats(self):
+        return log_sink.get_stats()
 
     # prints database name, its collections, and the number of documents
     # in each collection
@@ -1837,24 +2858,5 @@ class Database:
         for coll in self._db.list_collection_names():
             ref = self._db[coll]
             ret += f"\t{coll:<15}(#docs: {ref.estimated_document_count()})\n"
+        ret += f"connection pool: {self.get_pool_stats()}\n"
         return ret
-
-
-if __name__ == "__main__":
-    # generate list of all sections that had open-spot notifs with timestamps
-    db = Database()._db
-    res = db.system.find(
-        {
-            "type": "cron",
-            "message": {"$regex": ":"},
-            "time": {"$gt": datetime(2022, 4, 11)},
-        }
-    )
-
-    with open("all-notifs.txt", "w") as f:
-        for doc in res:
-            sections = doc["message"].split(": ")
-            if len(sections) < 2:
-                continue
-            for section in sections[1].split(", "):
-                f.write(f'{doc["time"].isoformat()} {section}\n')
@@ -0,0 +1,66 @@
+# ----------------------------------------------------------------------
+# identitymap.py
+# Contains IdentityMap, a request-scoped map of course, enrollment,
+# user, and waitlist documents that Database consults before querying,
+# so that each document is fetched at most once per Flask request.
+# Outside of a request scope (e.g. cron scripts), no map is active and
+# Database always queries MongoDB directly.
+# ----------------------------------------------------------------------
+
+from contextvars import ContextVar
+from copy import deepcopy
+
+_current = ContextVar("identity_map", default=None)
+
+
+class IdentityMap:
+    def __init__(self):
+        self._docs = {}
+        self.n_hits = 0
+        self.n_misses = 0
+
+    # returns (True, copy of document) if the document for key in
+    # collection coll has already been fetched, (False, None) otherwise
+
+    def get(self, coll, key):
+        try:
+            doc = self._docs[(coll, key)]
+        except KeyError:
+            self.n_misses += 1
+            return False, None
+        self.n_hits += 1
+        return True, deepcopy(doc)
+
+    # records a fetched document (None if it does not exist)
+
+    def put(self, coll, key, doc):
+        self._docs[(coll, key)] = deepcopy(doc)
+
+    # forgets the document for key in coll, or all documents in coll if
+    # key is None; called whenever the corresponding documents are written
+
+    def evict(self, coll, key=None):
+        if key is not None:
+            self._docs.pop((coll, key), None)
+            return
+        for k in [k for k in self._docs if k[0] == coll]:
+            del self._docs[k]
+
+
+# starts a new identity map for the current request
+def begin_request_scope():
+    imap = IdentityMap()
+    _current.set(imap)
+    return imap
+
+
+# ends the current request's identity map and returns it
+def end_request_scope():
+    imap = _current.get()
+    _current.set(None)
+    return imap
+
+
+# returns the current request's identity map, or None outside a request
+def get_identity_map():
+    return _current.get()
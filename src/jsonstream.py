@@ -0,0 +1,164 @@
+# ----------------------------------------------------------------------
+# jsonstream.py
+# Contains JSONStream, an incremental reader of a JSON document that
+# arrives in byte chunks (e.g. a streamed HTTP response), and
+# iter_term_courses(), which uses it to yield the courses of a MobileApp
+# courses/courses response one at a time. Only the value being read and
+# the unread part of the current chunk are held in memory, instead of
+# the whole response text and its parsed tree.
+# ----------------------------------------------------------------------
+
+from codecs import getincrementaldecoder
+from json import JSONDecoder, JSONDecodeError
+
+_decoder = JSONDecoder()
+
+WHITESPACE = " \t\n\r"
+
+# characters that may continue a number
+NUMBER_CHARS = "0123456789+-.eE"
+
+# consumed text is dropped from the buffer once it is this long
+COMPACT_CHARS = 1 << 16
+
+
+class JSONStream:
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._utf8 = getincrementaldecoder("utf-8")()
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+
+    # appends the next chunk to the buffer; returns False at the end of
+    # the document
+
+    def _read(self):
+        if self._eof:
+            return False
+        if self._pos >= COMPACT_CHARS:
+            self._buf = self._buf[self._pos :]
+            self._pos = 0
+        for chunk in self._chunks:
+            text = self._utf8.decode(chunk)
+            if text != "":
+                self._buf += text
+                return True
+        self._buf += self._utf8.decode(b"", final=True)
+        self._eof = True
+        return False
+
+    # skips whitespace and returns the next character ("" at the end of
+    # the document) without consuming it
+
+    def _peek(self):
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._read():
+                return ""
+
+    def _expect(self, chars):
+        ch = self._peek()
+        if ch == "" or ch not in chars:
+            raise ValueError(f"expected one of {chars!r} but found {ch!r}")
+        self._pos += 1
+        return ch
+
+    # reads and returns the next value
+
+    def read_value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self._buf, self._pos)
+            except JSONDecodeError:
+                # the value may continue in the next chunk
+                if not self._read():
+                    raise
+                continue
+            # so may a number, unless a character that can't be part of it
+            # follows
+            if (
+                isinstance(value, (int, float))
+                and not isinstance(value, bool)
+                and (end == len(self._buf) or self._buf[end] in NUMBER_CHARS)
+                and self._read()
+            ):
+                continue
+            self._pos = end
+            return value
+
+    # reads an object, yielding each of its keys; the caller must read
+    # the key's value (e.g. with read_value()) before resuming
+
+    def iter_object(self):
+        self._expect("{")
+        if self._peek() == "}":
+            self._pos += 1
+            return
+        while True:
+            key = self.read_value()
+            if not isinstance(key, str):
+                raise ValueError(f"expected an object key but found {key!r}")
+            self._expect(":")
+            yield key
+            if self._expect(",}") == "}":
+                return
+
+    # reads an array, yielding the index of each of its values; the
+    # caller must read the value before resuming
+
+    def iter_array(self):
+        self._expect("[")
+        if self._peek() == "]":
+            self._pos += 1
+            return
+        i = 0
+        while True:
+            yield i
+            if self._expect(",]") == "]":
+                return
+            i += 1
+
+
+# yields (subject, course) for each course in the first term of a
+# MobileApp courses/courses response read from chunks (bytes), where
+# subject holds the fields of the course's subject other than "courses"
+# (e.g. "code")
+def iter_term_courses(chunks):
+    stream = JSONStream(chunks)
+    for key in stream.iter_object():
+        if key != "term":
+            stream.read_value()
+            continue
+        for i in stream.iter_array():
+            if i > 0:
+                stream.read_value()
+                continue
+            for term_key in stream.iter_object():
+                if term_key != "subjects":
+                    stream.read_value()
+                    continue
+                for _ in stream.iter_array():
+                    yield from _iter_subject_courses(stream)
+
+
+def _iter_subject_courses(stream):
+    subject = {}
+    # courses that precede the subject's code are yielded once it is read
+    pending = []
+    for key in stream.iter_object():
+        if key != "courses":
+            subject[key] = stream.read_value()
+            continue
+        for _ in stream.iter_array():
+            course = stream.read_value()
+            if "code" in subject:
+                yield subject, course
+            else:
+                pending.append(course)
+    for course in pending:
+        yield subject, course
@@ -0,0 +1,160 @@
+# ----------------------------------------------------------------------
+# logsink.py
+# Contains LogSink, a buffered writer for documents in the system
+# collection. Database._add_system_log hands each log document to the
+# process-wide log_sink, whose background thread writes them in batches
+# with insert_many, so logging stays off the latency path of requests
+# and cron runs. Pending logs are flushed on interpreter exit and before
+# fork().
+# ----------------------------------------------------------------------
+
+from sys import stderr
+from os import register_at_fork
+from atexit import register as register_at_exit
+from queue import Queue, Full, Empty
+from threading import Thread, Lock, Event
+from connection import get_db
+from config import (
+    LOG_SINK_MAX_QUEUE,
+    LOG_SINK_BATCH_SIZE,
+    LOG_SINK_FLUSH_INTERVAL_SECS,
+    LOG_SINK_POLICY,
+)
+
+# what put() does when the queue is full:
+#   drop_newest: discard the new log
+#   drop_oldest: discard the oldest queued log to make room
+#   block: wait up to one flush interval for room, then discard the new log
+#   sync: write the new log immediately (bypasses the queue entirely)
+POLICIES = ("drop_newest", "drop_oldest", "block", "sync")
+
+
+class LogSink:
+    def __init__(
+        self,
+        max_queue=LOG_SINK_MAX_QUEUE,
+        batch_size=LOG_SINK_BATCH_SIZE,
+        flush_interval=LOG_SINK_FLUSH_INTERVAL_SECS,
+        policy=LOG_SINK_POLICY,
+    ):
+        if policy not in POLICIES:
+            raise ValueError(f"log sink policy must be one of {POLICIES}")
+        self._max_queue = max_queue
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._policy = policy
+        self._reset()
+
+    def _reset(self):
+        self._n_queued = 0
+        self._n_flushed = 0
+        self._n_dropped = 0
+        self._n_failed = 0
+        self._queue = Queue(self._max_queue)
+        self._flush_lock = Lock()
+        self._start_lock = Lock()
+        self._wakeup = Event()
+        self._thread = None
+
+    # queues doc for insertion into the system collection
+
+    def put(self, doc):
+        if self._policy == "sync":
+            self._insert([doc])
+            return
+
+        self._ensure_started()
+        try:
+            if self._policy == "block":
+                self._queue.put(doc, timeout=self._flush_interval)
+            else:
+                self._queue.put_nowait(doc)
+        except Full:
+            if self._policy != "drop_oldest":
+                self._n_dropped += 1
+                return
+            try:
+                self._queue.get_nowait()
+                self._n_dropped += 1
+            except Empty:
+                pass
+            try:
+                self._queue.put_nowait(doc)
+            except Full:
+                self._n_dropped += 1
+                return
+
+        self._n_queued += 1
+        if self._queue.qsize() >= self._batch_size:
+            self._wakeup.set()
+
+    # writes all queued logs now; called by the background thread, on
+    # exit, and before fork()
+
+    def flush(self):
+        with self._flush_lock:
+            while True:
+                batch = []
+                while len(batch) < self._batch_size:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except Empty:
+                        break
+                if len(batch) == 0:
+                    return
+                self._insert(batch)
+
+    # returns counters for this process's log sink
+
+    def get_stats(self):
+        return {
+            "policy": self._policy,
+            "pending": self._queue.qsize(),
+            "queued": self._n_queued,
+            "flushed": self._n_flushed,
+            "dropped": self._n_dropped,
+            "failed": self._n_failed,
+        }
+
+    def _insert(self, docs):
+        try:
+            get_db().system.insert_many(docs, ordered=False)
+            self._n_flushed += len(docs)
+        except Exception as e:
+            self._n_failed += len(docs)
+            print(f"failed to write {len(docs)} system log(s): {e}", file=stderr)
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = Thread(
+                    target=self._run, name="system-log-sink", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self._flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def _before_fork(self):
+        if self._policy != "sync":
+            self.flush()
+
+    # the flusher thread does not survive fork(), and forked workers (e.g.
+    # multiprocess pools) may exit without running atexit handlers, so
+    # children write their logs synchronously
+
+    def _after_fork_in_child(self):
+        self._reset()
+        self._policy = "sync"
+
+
+log_sink = LogSink()
+register_at_exit(log_sink.flush)
+register_at_fork(
+    before=log_sink._before_fork, after_in_child=log_sink._after_fork_in_child
+)
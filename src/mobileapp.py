@@ -9,10 +9,29 @@
 import requests
 import json
 import base64
+from itertools import chain
 from config import CONSUMER_KEY, CONSUMER_SECRET
 from database import Database
+from jsonstream import iter_term_courses
 from time import time
 
+# size of the chunks in which streamed responses are read
+STREAM_CHUNK_BYTES = 1 << 16
+
+
+# returns a copy of the query arguments args that is small enough to log:
+# comma-separated lists (e.g. course_ids) are replaced by their length
+def compact_log_args(args):
+    res = {}
+    for key, value in args.items():
+        if isinstance(value, dict):
+            res[key] = compact_log_args(value)
+        elif isinstance(value, str) and "," in value:
+            res[f"n_{key}"] = len(value.split(","))
+        else:
+            res[key] = value
+    return res
+
 
 class MobileApp:
     def __init__(self):
@@ -37,6 +56,19 @@ class MobileApp:
         kwargs["fmt"] = "json"
         return self._getJSON(self.configs.COURSE_COURSES, **kwargs)
 
+    # like get_courses, but streams the response and yields (subject,
+    # course) for each course in it (see jsonstream.py) instead of
+    # parsing the whole response at once; used for large queries such as
+    # all departments of a term
+
+    def iter_courses(self, **kwargs):
+        kwargs["fmt"] = "json"
+        req, chunks = self._stream(self.configs.COURSE_COURSES, **kwargs)
+        try:
+            yield from iter_term_courses(chunks)
+        finally:
+            req.close()
+
     # wrapper function for _getJSON with the courses/terms endpoint.
     # takes no arguments.
 
@@ -67,7 +99,7 @@ class MobileApp:
                 "message": "MobileApp API query",
                 "response_time": time() - tic,
                 "endpoint": endpoint,
-                "args": kwargs,
+                "args": compact_log_args(kwargs),
             },
             print_=False,
         )
@@ -77,6 +109,48 @@ class MobileApp:
 
         return json.loads(text)
 
+    # returns the streamed response of a request to endpoint and an
+    # iterator over its body's chunks, refreshing the access token first
+    # if it was rejected; raises a requests.HTTPError if the response
+    # status is not 2xx
+
+    def _stream(self, endpoint, **kwargs):
+        tic = time()
+
+        def request():
+            return requests.get(
+                self.configs.BASE_URL + endpoint,
+                params=kwargs if "kwargs" not in kwargs else kwargs["kwargs"],
+                headers={"Authorization": "Bearer " + self.configs.ACCESS_TOKEN},
+                stream=True,
+            )
+
+        req = request()
+        chunks = req.iter_content(STREAM_CHUNK_BYTES)
+        first = next(chunks, b"")
+        # a rejected token is reported with a short XML response
+        if first.startswith(b"<ams:fault"):
+            req.close()
+            self.configs._refreshToken(grant_type="client_credentials")
+            req = request()
+            chunks = req.iter_content(STREAM_CHUNK_BYTES)
+            first = next(chunks, b"")
+        if not req.ok:
+            req.close()
+            req.raise_for_status()
+
+        self._db._add_system_log(
+            "mobileapp",
+            {
+                "message": "MobileApp API query (streamed)",
+                "response_time": time() - tic,
+                "endpoint": endpoint,
+                "args": compact_log_args(kwargs),
+            },
+            print_=False,
+        )
+        return req, chain([first], chunks)
+
     def _updateConfigs(self, text, endpoint, **kwargs):
         if text.startswith("<ams:fault"):
             self.configs._refreshToken(grant_type="client_credentials")
@@ -25,13 +25,16 @@ class Monitor:
     def _construct_waited_classes(self):
         waited_classes = list(self._db.get_waited_classes())
         disabled_courses = self._db.get_disabled_courses()
+        classinfo = self._db.classid_to_classinfo_many(
+            [class_["classid"] for class_ in waited_classes]
+        )
         data = {}
 
         for class_ in waited_classes:
             classid = class_["classid"]
             try:
-                deptnum, courseid = self._db.classid_to_course_info(classid)
-            except:
+                deptnum, _, _, courseid = classinfo[classid]
+            except KeyError:
                 continue
 
             # skip sections whose course is disabled
@@ -176,8 +176,7 @@ def get_course_in_mobileapp(term, course_, curr_time, db: Database):
                 else:
                     all_new_classes.append(new_class)
 
-            for i, new_class in enumerate(all_new_classes):
-                new[f'class_{new_class["classid"]}'] = new_class
+            new["classes"] = all_new_classes
 
             break
 
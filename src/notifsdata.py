@@ -0,0 +1,106 @@
+# ----------------------------------------------------------------------
+# notifsdata.py
+# Contains NotifsData, a column-oriented, in-memory view of notification
+# history exported by _exec_export_notifs.py. Each row is one section
+# notified in one run of the notifications script:
+#   time:         datetime64[s] (UTC) of the run
+#   classid:      str ("" for runs logged before classids were recorded)
+#   section:      str, e.g. "COS 126 L01"
+#   n_open_spots: int (-1 if unknown)
+#   n_sent:       int, emails and texts sent successfully (-1 if unknown)
+# Aggregations are vectorized with NumPy, so term-wide analyses don't
+# need to read from MongoDB.
+#
+# Example:
+#   data = NotifsData.load("notifs.npz").between("2022-09-01", "2022-09-15")
+#   sections, hours, counts = data.openings_per_section_per_hour()
+# ----------------------------------------------------------------------
+
+import numpy as np
+
+COLUMNS = ("time", "classid", "section", "n_open_spots", "n_sent")
+
+
+class NotifsData:
+    def __init__(self, time, classid, section, n_open_spots, n_sent):
+        self.time = np.asarray(time, dtype="datetime64[s]")
+        self.classid = np.asarray(classid, dtype=str)
+        self.section = np.asarray(section, dtype=str)
+        self.n_open_spots = np.asarray(n_open_spots, dtype=np.int32)
+        self.n_sent = np.asarray(n_sent, dtype=np.int32)
+
+    # reads an .npz file written by save() or _exec_export_notifs.py
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as f:
+            return cls(*(f[col] for col in COLUMNS))
+
+    def save(self, path):
+        np.savez_compressed(path, **{col: getattr(self, col) for col in COLUMNS})
+
+    def __len__(self):
+        return len(self.time)
+
+    # returns the rows selected by mask (a boolean or index array)
+
+    def _select(self, mask):
+        return NotifsData(*(getattr(self, col)[mask] for col in COLUMNS))
+
+    # returns the rows with start <= time < end; either bound may be None
+    # and both accept anything np.datetime64 does (e.g. "2022-09-01")
+
+    def between(self, start=None, end=None):
+        mask = np.ones(len(self), dtype=bool)
+        if start is not None:
+            mask &= self.time >= np.datetime64(start, "s")
+        if end is not None:
+            mask &= self.time < np.datetime64(end, "s")
+        return self._select(mask)
+
+    # returns the rows of sections whose name starts with prefix (e.g. a
+    # department "COS" or a course "COS 126")
+
+    def for_sections(self, prefix):
+        return self._select(np.char.startswith(self.section, prefix))
+
+    # returns (sections, hours, counts), where counts[i, j] is the number
+    # of openings of sections[i] notified in the hour starting at hours[j]
+    # (UTC); with spots=True, openings are weighted by their number of
+    # open spots
+
+    def openings_per_section_per_hour(self, spots=False):
+        sections, i_section = np.unique(self.section, return_inverse=True)
+        hours, i_hour = np.unique(
+            self.time.astype("datetime64[h]"), return_inverse=True
+        )
+        counts = np.zeros((len(sections), len(hours)), dtype=np.int64)
+        weights = np.maximum(self.n_open_spots, 0) if spots else 1
+        np.add.at(counts, (i_section, i_hour), weights)
+        return sections, hours, counts
+
+    # returns (hours, counts), where counts[h] is the number of openings
+    # notified during hour h of the day (0-23, UTC) across all days
+
+    def openings_per_hour_of_day(self):
+        hour_of_day = (self.time.astype("datetime64[h]").astype(np.int64)) % 24
+        return np.arange(24), np.bincount(hour_of_day, minlength=24)
+
+    # returns (sections, n_sent), where n_sent[i] is the total number of
+    # notifications sent for sections[i]; rows with unknown n_sent are
+    # ignored
+
+    def sent_per_section(self):
+        known = self.n_sent >= 0
+        sections, i_section = np.unique(self.section[known], return_inverse=True)
+        return sections, np.bincount(
+            i_section, weights=self.n_sent[known], minlength=len(sections)
+        ).astype(np.int64)
+
+    # returns the n sections with the most openings as a list of
+    # (section, count), most frequent first
+
+    def top_sections(self, n=10):
+        sections, counts = np.unique(self.section, return_counts=True)
+        order = np.argsort(-counts, kind="stable")[:n]
+        return [(str(sections[i]), int(counts[i])) for i in order]
@@ -25,24 +25,36 @@ TZ_UTC = pytz.timezone("UTC")
 class Notify:
     # initializes Notify, fetching all information about a given classid
     # to format and send an email to the first student on the waitlist
-    # for that classid
+    # for that classid. classinfo and snapshot may be passed in if they
+    # were already fetched for a whole notifications run (see
+    # Database.classid_to_classinfo_many and get_notifs_snapshot)
 
-    def __init__(self, classid, n_new_slots, db):
+    def __init__(self, classid, n_new_slots, db, classinfo=None, snapshot=None):
         self._classid = classid
         self.n_new_slots = n_new_slots
         self.db = db
         try:
+            if classinfo is None:
+                classinfo = db.classid_to_classinfo(classid)
+            if snapshot is None:
+                snapshot = db.get_notifs_snapshot([classid])
             (
                 self._deptnum,
                 self._title,
                 self._sectionname,
                 self._courseid,
-            ) = db.classid_to_classinfo(classid)
+            ) = classinfo
             self._has_reserved_seats = db.does_course_have_reserved_seats(
                 self._courseid
             )
             self._coursename = f"{self._deptnum}: {self._title}"
-            self._netids = db.get_class_waitlist(classid)["waitlist"]
+            if classid not in snapshot["waitlists"]:
+                raise Exception(f"class {classid} has no waitlist")
+            # users removed since they subscribed can't be notified
+            users = snapshot["users"]
+            self._netids = [
+                netid for netid in snapshot["waitlists"][classid] if netid in users
+            ]
 
             user_log = f"{n_new_slots} spot{'s'[:n_new_slots^1]} available in {self._deptnum} {self._sectionname}"
 
@@ -52,20 +64,26 @@ class Notify:
                 #   1. the number of new spots (non-zero) has changed from the previous count
                 #   2. it's been more than MIN_NOTIFS_DELAY_MINS minutes since the last notif was sent
                 temp_netids = []
+                histories = snapshot["history"][classid]
                 for netid in self._netids:
                     # if user is not auto resubbed, then always send notif
                     # (they will be removed from waitlist in this script anyway)
-                    if not db.get_user_auto_resub(netid):
+                    if not users[netid].get("auto_resub", False):
                         temp_netids.append(netid)
                         continue
 
-                    history = db.get_user_notifs_history(netid, classid)
-                    open_spots_changed = n_new_slots != history["n_open_spots"]
-                    time_diff_mins = (
-                        datetime.now(TZ_ET) - TZ_UTC.localize(history["last_notif"])
-                    ).total_seconds() / 60
+                    history = histories.get(netid, {})
+                    n_open_spots = history.get("n_open_spots", 0)
+                    if "last_notif" in history:
+                        time_diff_mins = (
+                            datetime.now(TZ_ET) - TZ_UTC.localize(history["last_notif"])
+                        ).total_seconds() / 60
+                    else:
+                        # subscriptions without history were never notified
+                        time_diff_mins = MIN_NOTIFS_DELAY_MINS
+                    open_spots_changed = n_new_slots != n_open_spots
                     notifs_delay_exceeded = (
-                        n_new_slots == history["n_open_spots"]
+                        n_new_slots == n_open_spots
                         and time_diff_mins >= MIN_NOTIFS_DELAY_MINS
                     )
 
@@ -77,10 +95,12 @@ class Notify:
 
             self._emails = []
             self._phones = []
+            self._auto_resubs = []
 
             for netid in self._netids:
-                self._emails.append(db.get_user(netid, "email"))
-                self._phones.append(db.get_user(netid, "phone"))
+                self._emails.append(users[netid]["email"])
+                self._phones.append(users[netid]["phone"])
+                self._auto_resubs.append(users[netid].get("auto_resub", False))
                 db.update_user_waitlist_log(netid, user_log)
 
             db.update_time_of_last_notif(classid)
@@ -112,14 +132,14 @@ class Notify:
         for i in range(len(self._emails)):
             try:
                 if self._has_reserved_seats:
-                    if self.db.get_user_auto_resub(self._netids[i]):
+                    if self._auto_resubs[i]:
                         # yes auto-resub | yes reserved seats
                         template_id = "d-b32c7a8c99f2491899322ced801b216b"
                     else:
                         # no auto-resub | yes reserved seats
                         template_id = "d-632e8760499b40d680742b9acdb8d129"
                 else:
-                    if self.db.get_user_auto_resub(self._netids[i]):
+                    if self._auto_resubs[i]:
                         # yes auto-resub | no reserved seats
                         template_id = "d-c04bc32123ea45ec80889919cc5c377e"
                     else:
@@ -161,7 +181,7 @@ class Notify:
         send_text_args = []
         for i, phone in enumerate(self._phones):
             try:
-                is_auto_resub = self.db.get_user_auto_resub(self._netids[i])
+                is_auto_resub = self._auto_resubs[i]
                 if phone != "":
                     send_text_args.append(
                         [
@@ -0,0 +1,249 @@
+# ----------------------------------------------------------------------
+# querystats.py
+# Contains QueryListener, a pymongo command listener that records the
+# count and a latency histogram of MongoDB commands per (scope,
+# collection, operation), where the scope is the current Flask route
+# (e.g. "/course") or cron job (e.g. "cron:notify"), optionally followed
+# by a stage within it (e.g. "cron:notify/prefetch"). Commands slower
+# than QUERY_SLOW_MS are logged with the shape of their filter, and
+# scopes that issue more commands than their QUERY_BUDGETS entry are
+# reported (or raise QueryBudgetExceeded with QUERY_BUDGETS_STRICT).
+#
+# Commands issued outside of a scope (e.g. by the system log sink's
+# background thread) are recorded under the scope "-".
+# ----------------------------------------------------------------------
+
+from sys import stderr
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from pymongo.monitoring import CommandListener
+from config import QUERY_SLOW_MS, QUERY_BUDGETS, QUERY_BUDGETS_STRICT
+
+# upper bounds (ms) of the latency histogram buckets; the last bucket
+# holds everything slower
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+# commands whose value is not a collection name
+_NO_COLLECTION = {"getMore": "collection"}
+
+_current = ContextVar("query_scope", default=None)
+
+
+class QueryBudgetExceeded(RuntimeError):
+    pass
+
+
+# the commands issued so far by one run of a scope (one request or one
+# cron job execution)
+class QueryScope:
+    def __init__(self, name):
+        self.name = name
+        self.stage = None
+        self.n_commands = 0
+        self.stage_commands = {}
+
+    def get_label(self):
+        return self.name if self.stage is None else f"{self.name}/{self.stage}"
+
+    def count(self):
+        self.n_commands += 1
+        if self.stage is not None:
+            self.stage_commands[self.stage] = self.stage_commands.get(self.stage, 0) + 1
+
+    # returns [(label, n_commands, budget)] for every budget exceeded
+
+    def get_exceeded_budgets(self):
+        counts = {self.name: self.n_commands}
+        for stage, n in self.stage_commands.items():
+            counts[f"{self.name}/{stage}"] = n
+        return [
+            (label, n, QUERY_BUDGETS[label])
+            for label, n in counts.items()
+            if label in QUERY_BUDGETS and n > QUERY_BUDGETS[label]
+        ]
+
+
+# returns the shape of a query filter: its keys and operators, with all
+# values replaced by "?"
+def get_filter_shape(filter):
+    if isinstance(filter, dict):
+        return {k: get_filter_shape(v) for k, v in filter.items()}
+    if isinstance(filter, (list, tuple)):
+        if len(filter) > 0 and all(isinstance(v, dict) for v in filter):
+            return [get_filter_shape(v) for v in filter]
+        return "[?]"
+    return "?"
+
+
+# returns the filter of a command document (None if it has none)
+def get_command_filter(name, command):
+    if name in ("find", "count", "distinct"):
+        return command.get("filter", command.get("query"))
+    if name == "findAndModify":
+        return command.get("query")
+    if name == "update":
+        return [u.get("q") for u in command.get("updates", [])[:1]]
+    if name == "delete":
+        return [d.get("q") for d in command.get("deletes", [])[:1]]
+    if name == "aggregate":
+        pipeline = command.get("pipeline", [])
+        return [stage for stage in pipeline[:1]]
+    return None
+
+
+class QueryListener(CommandListener):
+    def __init__(self):
+        self._lock = Lock()
+        self._pending = {}
+        # (scope label, collection, operation) -> [count, total ms, max ms,
+        # histogram counts]
+        self._stats = {}
+        self._n_slow = 0
+
+    def started(self, event):
+        scope = _current.get()
+        if scope is not None:
+            scope.count()
+        name = event.command_name
+        coll = event.command.get(_NO_COLLECTION.get(name, name))
+        if not isinstance(coll, str):
+            coll = "-"
+        label = "-" if scope is None else scope.get_label()
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = (
+                label,
+                coll,
+                name,
+                event.command,
+            )
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event)
+
+    def _finish(self, event):
+        with self._lock:
+            pending = self._pending.pop((event.connection_id, event.request_id), None)
+        if pending is None:
+            return
+        label, coll, name, command = pending
+        ms = event.duration_micros / 1000
+
+        bucket = len(LATENCY_BUCKETS_MS)
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            if ms <= bound:
+                bucket = i
+                break
+        with self._lock:
+            stats = self._stats.get((label, coll, name))
+            if stats is None:
+                stats = [0, 0.0, 0.0, [0] * (len(LATENCY_BUCKETS_MS) + 1)]
+                self._stats[(label, coll, name)] = stats
+            stats[0] += 1
+            stats[1] += ms
+            stats[2] = max(stats[2], ms)
+            stats[3][bucket] += 1
+
+        if ms >= QUERY_SLOW_MS:
+            with self._lock:
+                self._n_slow += 1
+            shape = get_filter_shape(get_command_filter(name, command))
+            print(
+                f"slow MongoDB command ({ms:.0f} ms) in {label}: {name} {coll} {shape}",
+                file=stderr,
+            )
+
+    # returns a list of {"scope", "collection", "operation", "count",
+    # "avg_ms", "max_ms", "histogram"} sorted by count; histogram maps
+    # each bucket's upper bound (ms) to its count
+
+    def get_stats(self):
+        with self._lock:
+            items = [(key, list(stats)) for key, stats in self._stats.items()]
+        bounds = [str(b) for b in LATENCY_BUCKETS_MS] + ["inf"]
+        res = [
+            {
+                "scope": label,
+                "collection": coll,
+                "operation": name,
+                "count": count,
+                "avg_ms": round(total / count, 2),
+                "max_ms": round(max_ms, 2),
+                "histogram": dict(zip(bounds, histogram)),
+            }
+            for (label, coll, name), (count, total, max_ms, histogram) in items
+        ]
+        return sorted(res, key=lambda e: -e["count"])
+
+    def get_n_slow(self):
+        return self._n_slow
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+            self._n_slow = 0
+
+
+query_listener = QueryListener()
+
+
+# starts a scope for the current request or job
+def begin_query_scope(name):
+    scope = QueryScope(name)
+    _current.set(scope)
+    return scope
+
+
+# ends the current scope and returns it; reports (or raises, with
+# QUERY_BUDGETS_STRICT) any exceeded budget
+def end_query_scope():
+    scope = _current.get()
+    _current.set(None)
+    if scope is None:
+        return None
+    exceeded = scope.get_exceeded_budgets()
+    if len(exceeded) > 0:
+        msg = ", ".join(
+            f"{label} issued {n} MongoDB commands (budget {budget})"
+            for label, n, budget in exceeded
+        )
+        if QUERY_BUDGETS_STRICT:
+            raise QueryBudgetExceeded(msg)
+        print(f"query budget exceeded: {msg}", file=stderr)
+    return scope
+
+
+# returns the current scope, or None outside of one
+def get_query_scope():
+    return _current.get()
+
+
+# attributes the current scope's following commands to stage (None to
+# stop attributing them to a stage)
+def set_query_stage(stage):
+    scope = _current.get()
+    if scope is not None:
+        scope.stage = stage
+
+
+# runs the body (or the decorated function) in its own scope and prints
+# the number of commands it issued
+@contextmanager
+def query_scope(name):
+    outer = _current.get()
+    scope = begin_query_scope(name)
+    try:
+        yield scope
+    finally:
+        try:
+            end_query_scope()
+        finally:
+            _current.set(outer)
+        stages = ", ".join(f"{s}: {n}" for s, n in scope.stage_commands.items())
+        print(
+            f"{name} issued {scope.n_commands} MongoDB commands"
+            + (f" ({stages})" if stages != "" else "")
+        )
@@ -1,14 +1,126 @@
 # ----------------------------------------------------------------------
 # schema.py
-# Contains tuples of keys that various database documents must contain.
+# Contains tuples of keys that various database documents must contain,
+# the indexes that the database must have, and helpers that read course
+# documents in either section layout.
 # ----------------------------------------------------------------------
 
-# courses collection
+import re
+from hashlib import sha1
+from json import dumps
+
+# courses collection; a course's sections are stored in display order in
+# its "classes" array. Courses written before that layout store each
+# section under a "class_<classid>" key instead (see
+# _exec_migrate_course_classes.py), so read sections through the helpers
+# below
 COURSES_SCHEMA = ("courseid", "displayname", "title")
 CLASS_SCHEMA = ("classid", "section", "type_name", "start_time", "end_time", "days")
+LEGACY_CLASS_PREFIX = "class_"
 
 # mappings collection
 MAPPINGS_SCHEMA = ("displayname", "displayname_whitespace", "title", "courseid", "time")
 
 # enrollments collection
 ENROLLMENTS_SCHEMA = ("classid", "enrollment", "capacity")
+
+# enrollment fields that come from MobileApp (the others, e.g. swap_out,
+# are maintained by TigerSnatch)
+ENROLLMENT_CONTENT_FIELDS = ("classid", "courseid", "section", "enrollment", "capacity")
+
+# indexes ensured on the first connection after they change (see
+# ensure_indexes_once() in connection.py); each entry is (collection,
+# keys, options)
+INDEXES = (
+    ("users", [("netid", 1)], {"unique": True}),
+    ("enrollments", [("classid", 1)], {"unique": True}),
+    ("enrollments", [("courseid", 1)], {}),
+    ("subscriptions", [("netid", 1), ("classid", 1)], {"unique": True}),
+    ("subscriptions", [("classid", 1), ("time", 1)], {}),
+    ("subscriptions", [("courseid", 1)], {}),
+    ("mappings", [("courseid", 1)], {"unique": True}),
+    ("mappings", [("displayname", 1)], {}),
+    ("courses", [("courseid", 1)], {"unique": True}),
+    ("courses", [("classes.classid", 1)], {}),
+    ("logs", [("netid", 1)], {"unique": True}),
+    ("system", [("type", 1), ("time", 1)], {}),
+    ("system", [("time", 1)], {}),
+    ("system", [("expire_at", 1)], {"expireAfterSeconds": 0}),
+    ("system_summaries", [("period", 1), ("type", 1)], {"unique": True}),
+)
+
+
+# returns the list of section dictionaries of a course document
+def get_course_classes(course):
+    if "classes" in course:
+        return course["classes"]
+    return [v for k, v in course.items() if k.startswith(LEGACY_CLASS_PREFIX)]
+
+
+# returns the section dictionary of classid in a course document (None if
+# the course has no such section)
+def get_course_class(course, classid):
+    for class_ in get_course_classes(course):
+        if class_["classid"] == classid:
+            return class_
+    return None
+
+
+# returns the fields of a course document other than its sections
+def get_course_details(course):
+    return {
+        k: v
+        for k, v in course.items()
+        if k != "classes" and not k.startswith(LEGACY_CLASS_PREFIX)
+    }
+
+
+# returns a course document in the "classes" array layout (a converted
+# copy if it has the legacy layout)
+def to_classes_layout(course):
+    if "classes" in course:
+        return course
+    res = get_course_details(course)
+    res["classes"] = get_course_classes(course)
+    return res
+
+
+# returns the department code that a course is listed under (the first
+# one of its displayname, e.g. "COS" for "COS333/ECE333")
+def get_course_dept(displayname):
+    return re.match(r"[A-Z]*", displayname).group()
+
+
+# raises a RuntimeError if doc, a document of coll ("courses",
+# "mappings", or "enrollments"), is missing a key of its schema
+def validate_document(coll, doc):
+    if coll == "courses":
+        if not all(k in doc for k in COURSES_SCHEMA):
+            raise RuntimeError("invalid courses document schema")
+        for class_ in get_course_classes(doc):
+            if not all(k in class_ for k in CLASS_SCHEMA):
+                raise RuntimeError("invalid individual class document schema")
+    elif coll == "mappings":
+        if not all(k in doc for k in MAPPINGS_SCHEMA):
+            raise RuntimeError("invalid mappings document schema")
+    elif coll == "enrollments":
+        if not all(k in doc for k in ENROLLMENTS_SCHEMA):
+            raise RuntimeError("invalid enrollments document schema")
+
+
+# returns a hash of the MobileApp-sourced content of a course: its course
+# document (in either section layout, without _id and content_hash) and
+# the ENROLLMENT_CONTENT_FIELDS of its enrollment documents. It is stored
+# as the course's content_hash when the course is written from MobileApp
+# data (and unset when the course is changed otherwise), so a course
+# whose fetched hash equals the stored one doesn't need to be rewritten
+def get_course_content_hash(course, enrollments):
+    course = {k: v for k, v in course.items() if k not in ("_id", "content_hash")}
+    content = {
+        "course": to_classes_layout(course),
+        "enrollments": sorted(
+            [[e.get(k) for k in ENROLLMENT_CONTENT_FIELDS] for e in enrollments],
+            key=lambda row: row[0],
+        ),
+    }
+    return sha1(dumps(content, sort_keys=True, default=str).encode()).hexdigest()
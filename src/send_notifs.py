@@ -20,10 +20,14 @@ from config import OIT_NOTIFS_OFFSET_MINS
 from notify import send_email, send_text
 from multiprocess import Pool
 from os import cpu_count
+from querystats import query_scope, set_query_stage
 
 TZ = pytz.timezone("US/Eastern")
 
 
+# MongoDB commands are counted per stage (see querystats.py), e.g.
+# cron:notify/prefetch, so that QUERY_BUDGETS can cap each of them
+@query_scope("cron:notify")
 def cronjob():
     tic = time()
     db = Database()
@@ -38,11 +42,21 @@ def cronjob():
         return
 
     # get all class openings (for waited-on classes) from MobileApp
+    set_query_stage("monitor")
     new_slots, _ = monitor.get_classes_with_changed_enrollments()
 
     names = ""
     emails_to_send, texts_to_send = [], []
+    sections = []
     n_sections = 0
+    # fetch everything Notify needs for all sections with openings at once
+    classids = [
+        classid for classid, n_new_slots in new_slots.items() if n_new_slots > 0
+    ]
+    set_query_stage("prefetch")
+    classinfo = db.classid_to_classinfo_many(classids)
+    snapshot = db.get_notifs_snapshot(classids)
+    set_query_stage("notify")
     for classid, n_new_slots in new_slots.items():
         if n_new_slots == 0:
             # cover edge case where the number of open spots is 0 (not covered in Notify)
@@ -50,15 +64,26 @@ def cronjob():
             continue
 
         try:
-            notify = Notify(classid, n_new_slots, db)
+            notify = Notify(classid, n_new_slots, db, classinfo.get(classid), snapshot)
             netids = notify.get_netids()
             if len(netids) == 0:
                 continue
             print(notify)
             stdout.flush()
 
-            emails_to_send.extend(notify.send_emails_html())
-            texts_to_send.extend(notify.send_sms())
+            emails = notify.send_emails_html()
+            emails_to_send.extend(emails)
+            section = {
+                "classid": classid,
+                "section": notify.get_name(),
+                "n_open_spots": n_new_slots,
+                "n_emails": len(emails),
+                "n_texts": 0,
+            }
+            sections.append(section)
+            texts = notify.send_sms()
+            texts_to_send.extend(texts)
+            section["n_texts"] = len(texts)
 
             names += " " + notify.get_name() + ","
             n_sections += 1
@@ -66,6 +91,7 @@ def cronjob():
         except Exception as e:
             print(e, file=stderr)
 
+    set_query_stage("send")
     with Pool(cpu_count()) as pool:
         emails_res = pool.starmap(send_email, emails_to_send)
         texts_res = pool.starmap(send_text, texts_to_send)
@@ -79,10 +105,12 @@ def cronjob():
         print("failed to send texts")
 
     total = n_emails_sent + n_texts_sent
+    notifs = get_notifs_sent(sections, emails_res, texts_res)
     print()
 
     duration = round(time() - tic)
 
+    set_query_stage("log")
     if total > 0:
         db._add_admin_log(
             f"sent {total} emails and texts in {duration} seconds ({n_sections} sections):{names[:-1]}",
@@ -94,7 +122,8 @@ def cronjob():
         db._add_system_log(
             "cron",
             {
-                "message": f"✅ sent {total} emails and texts in {duration} seconds ({n_sections} sections):{names[:-1]}"
+                "message": f"✅ sent {total} emails and texts in {duration} seconds ({n_sections} sections):{names[:-1]}",
+                "notifs": notifs,
             },
         )
         db.increment_email_counter(total)
@@ -102,13 +131,38 @@ def cronjob():
         db._add_system_log(
             "cron",
             {
-                "message": f"✅ sent 0 emails and texts in {duration} seconds ({n_sections} sections)"
+                "message": f"✅ sent 0 emails and texts in {duration} seconds ({n_sections} sections)",
+                "notifs": notifs,
             },
         )
         print(f"sent 0 emails and texts in {duration} seconds ({n_sections} sections)")
         stdout.flush()
 
 
+# returns one {"classid", "section", "n_open_spots", "n_sent"} entry per
+# notified section, where n_sent is the number of its emails and texts
+# that were sent successfully; emails_res and texts_res hold the results
+# of sending each section's emails and texts, in the order of sections
+def get_notifs_sent(sections, emails_res, texts_res):
+    notifs = []
+    i_email, i_text = 0, 0
+    for section in sections:
+        n_sent = sum(emails_res[i_email : i_email + section["n_emails"]]) + sum(
+            texts_res[i_text : i_text + section["n_texts"]]
+        )
+        i_email += section["n_emails"]
+        i_text += section["n_texts"]
+        notifs.append(
+            {
+                "classid": section["classid"],
+                "section": section["section"],
+                "n_open_spots": section["n_open_spots"],
+                "n_sent": n_sent,
+            }
+        )
+    return notifs
+
+
 def set_status_indicator_to_on():
     db = Database()
     db.set_cron_notification_status(True)
@@ -172,16 +226,14 @@ def generate_time_intervals():
     return datetimes
 
 
+@query_scope("cron:update_stats")
 def update_stats():
     db = Database()
     try:
+        # the user and subscription counters are maintained as users
+        # (un)subscribe (see Database.STATS_COUNTERS), so only the top
+        # subscriptions need to be recomputed here
         stats_top_subs = db.get_top_subscriptions(target_num=10, unique_courses=True)
-        stats_total_users = db.get_total_user_count()
-        stats_total_subs = db.get_total_subscriptions()
-        stats_subbed_users = db.get_users_who_subscribe()
-        stats_subbed_sections = db.get_num_subscribed_sections()
-        stats_subbed_courses = db.get_num_subscribed_courses()
-        stats_total_notifs = db.get_email_counter()
         stats_update_time = (
             f"{(datetime.now(TZ)).strftime('%b %-d, %Y @ %-I:%M %p ET')}"
         )
@@ -191,20 +243,26 @@ def update_stats():
             {
                 "$set": {
                     "stats_top_subs": stats_top_subs,
-                    "stats_total_users": stats_total_users,
-                    "stats_total_subs": stats_total_subs,
-                    "stats_subbed_users": stats_subbed_users,
-                    "stats_subbed_sections": stats_subbed_sections,
-                    "stats_subbed_courses": stats_subbed_courses,
-                    "stats_total_notifs": stats_total_notifs,
                     "stats_update_time": stats_update_time,
                 }
             },
         )
+        db.invalidate_admin_cache()
     except:
         print("failed to update stats on activity page", file=stderr)
 
 
+# recomputes the stats counters from scratch and repairs any drift
+@query_scope("cron:reconcile_stats")
+def reconcile_stats():
+    try:
+        drift = Database().reconcile_stats_counters()
+        if len(drift) > 0:
+            print("repaired drifted stats counters (stored, actual):", drift)
+    except:
+        print("failed to reconcile stats counters", file=stderr)
+
+
 if __name__ == "__main__":
     # can function via single file execution, but this is not the intent
     cronjob()
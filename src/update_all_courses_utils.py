@@ -6,6 +6,16 @@
 
 from mobileapp import MobileApp
 from database import Database
+from schema import get_course_content_hash
+from logsink import log_sink
+from config import (
+    TERM_UPDATE_SHARD_SIZE,
+    TERM_UPDATE_FETCH_PROCESSES,
+    TERM_UPDATE_FETCH_ATTEMPTS,
+    TERM_UPDATE_FETCH_TIMEOUT_SECS,
+)
+from functools import partial
+from multiprocess import Pool, TimeoutError
 from sys import stderr
 import time
 
@@ -27,193 +37,315 @@ def get_all_dept_codes(term):
     return codes
 
 
-# fetches and inserts new course information into the database
-def process_dept_codes(dept_codes: str, current_term_code: str, hard_reset: bool):
+# returns the documents of one MobileApp course (in subject) to be
+# entered in the mappings, courses, and enrollments collections: the
+# mapping, the course, and a list of enrollments (one per section)
+def get_course_documents(subject, course, curr_time):
+    courseid = course["course_id"]
+
+    # "new" will contain a single course document to be entered
+    # in the courses (and, in part, the mapppings) collection
+    new = {
+        "courseid": courseid,
+        "displayname": subject["code"] + course["catalog_number"],
+        "displayname_whitespace": subject["code"] + " " + course["catalog_number"],
+        "title": course["title"],
+        "time": curr_time,
+        "has_reserved_seats": course["detail"]["seat_reservations"] == "Y",
+    }
+
+    for x in course["crosslistings"]:
+        new["displayname"] += "/" + x["subject"] + x["catalog_number"]
+        new["displayname_whitespace"] += "/" + x["subject"] + " " + x["catalog_number"]
+
+    new_mapping = new.copy()
+    del new["time"]
+
+    all_new_classes = []
+    new_enrollments = []
+    lecture_idx = 0
+
+    for class_ in course["classes"]:
+        meetings = class_["schedule"]["meetings"][0]
+        section = class_["section"]
+
+        # skip dummy sections (end with 99)
+        if section.endswith("99"):
+            continue
+
+        # skip 0-capacity sections
+        if int(class_["capacity"]) == 0:
+            continue
+
+        classid = class_["class_number"]
+
+        # in the (very) occurrence that a class does not have any meetings...
+        start_time_ = (
+            "Unknown" if "start_time" not in meetings else meetings["start_time"]
+        )
+        end_time_ = "Unknown" if "end_time" not in meetings else meetings["end_time"]
+        days_ = ["Unknown"] if len(meetings["days"]) == 0 else meetings["days"]
+
+        # new_class will contain a single lecture, precept,
+        # etc. for a given course
+        new_class = {
+            "classid": classid,
+            "section": section,
+            "type_name": class_["type_name"],
+            "start_time": start_time_,
+            "end_time": end_time_,
+            "days": " ".join(days_),
+            "enrollment": int(class_["enrollment"]),
+            "capacity": int(class_["capacity"]),
+            "status_is_open": class_["pu_calc_status"] == "Open",
+        }
+
+        # new_class_enrollment will contain enrollment and
+        # capacity for a given class within a course
+        new_enrollments.append(
+            {
+                "classid": classid,
+                "courseid": courseid,
+                "section": section,
+                "enrollment": int(class_["enrollment"]),
+                "capacity": int(class_["capacity"]),
+                "swap_out": [],
+            }
+        )
+
+        # pre-recorded lectures are marked as 01:00 AM start
+        if new_class["start_time"] == "01:00 AM":
+            new_class["start_time"] = "Pre-Recorded"
+            new_class["end_time"] = ""
+
+        # lectures should appear before other section types
+        if class_["type_name"] == "Lecture":
+            all_new_classes.insert(lecture_idx, new_class)
+            lecture_idx += 1
+        else:
+            all_new_classes.append(new_class)
+
+    new["classes"] = all_new_classes
+    return new_mapping, new, new_enrollments
+
+
+# fetches the courses of the department codes in shard from MobileApp,
+# trying up to TERM_UPDATE_FETCH_ATTEMPTS times; returns (shard,
+# documents, stats), where documents is a list of (mapping, course,
+# enrollments) documents (see get_course_documents()), or None if every
+# attempt failed, and stats is {"depts", "n_attempts", "secs",
+# "n_courses", "error"}. Runs in a pool process
+def fetch_shard(shard, current_term_code):
+    tic = time.time()
+    stats = {"depts": shard, "n_attempts": 0, "secs": 0, "n_courses": 0, "error": None}
+    documents = None
+
+    for attempt in range(TERM_UPDATE_FETCH_ATTEMPTS):
+        if attempt > 0:
+            time.sleep(2**attempt)
+        stats["n_attempts"] += 1
+        try:
+            # each course is transformed as soon as it is parsed, so the
+            # response is never held in memory as a whole
+            curr_time = time.time()
+            documents = [
+                get_course_documents(subject, course, curr_time)
+                for subject, course in _api.iter_courses(
+                    term=current_term_code, subject=",".join(shard)
+                )
+            ]
+            if len(documents) == 0:
+                raise RuntimeError("no query results")
+            stats["error"] = None
+            break
+        except Exception as e:
+            stats["error"] = str(e)
+
+    stats["secs"] = round(time.time() - tic, 2)
+    stats["n_courses"] = 0 if documents is None else len(documents)
+    # pool processes exit without flushing their pending system logs
+    log_sink.flush()
+    return shard, documents, stats
+
+
+# yields the (mapping, course, enrollments) documents of the courses
+# listed under dept_codes, once per courseid (crosslisted courses are
+# listed under each of their departments), as the shards of
+# TERM_UPDATE_SHARD_SIZE departments are fetched in parallel (see
+# fetch_shard()). Shards are yielded in the order of dept_codes whatever
+# order they are fetched in, so a crosslisted course always keeps its
+# first listing (and displayname). Fills report with "shards", the stats
+# of each shard, and "failed_depts", the departments of shards that
+# failed or timed out (appending to the lists if report already has
+# them)
+def fetch_course_documents(dept_codes, current_term_code, report):
+    shards = [
+        list(dept_codes[i : i + TERM_UPDATE_SHARD_SIZE])
+        for i in range(0, len(dept_codes), TERM_UPDATE_SHARD_SIZE)
+    ]
+    pending = {",".join(shard): i for i, shard in enumerate(shards)}
+    report.setdefault("shards", [])
+    report.setdefault("failed_depts", [])
+    courseids = set()
+    # documents of shards fetched before an earlier shard, by shard index
+    fetched = {}
+    next_idx = 0
+
+    def unique(documents):
+        for document in documents:
+            courseid = document[1]["courseid"]
+            if courseid not in courseids:
+                courseids.add(courseid)
+                yield document
+
+    with Pool(min(TERM_UPDATE_FETCH_PROCESSES, len(shards))) as pool:
+        results = pool.imap_unordered(
+            partial(fetch_shard, current_term_code=current_term_code), shards
+        )
+        while len(pending) > 0:
+            try:
+                shard, documents, stats = results.next(
+                    timeout=TERM_UPDATE_FETCH_TIMEOUT_SECS
+                )
+            except TimeoutError:
+                break
+            idx = pending.pop(",".join(shard))
+            report["shards"].append(stats)
+
+            if documents is None:
+                print(
+                    f"failed to fetch {','.join(shard)} after {stats['n_attempts']} attempts: {stats['error']}",
+                    file=stderr,
+                )
+                report["failed_depts"].extend(shard)
+                documents = []
+            else:
+                print(
+                    f"> fetched {stats['n_courses']} courses of {','.join(shard)} in {stats['secs']} seconds"
+                )
+
+            fetched[idx] = documents
+            while next_idx in fetched:
+                yield from unique(fetched.pop(next_idx))
+                next_idx += 1
+
+    # shards fetched after one that timed out
+    for idx in sorted(fetched):
+        yield from unique(fetched[idx])
+
+    for key, idx in pending.items():
+        print(f"timed out fetching {key}", file=stderr)
+        report["shards"].append(
+            {
+                "depts": shards[idx],
+                "n_attempts": None,
+                "secs": None,
+                "n_courses": 0,
+                "error": "timed out",
+            }
+        )
+        report["failed_depts"].extend(shards[idx])
+
+
+# prints the slowest shards and the retries and failures of a fetch
+def print_fetch_report(report):
+    fetched = [stats for stats in report["shards"] if stats["secs"] is not None]
+    slowest = sorted(fetched, key=lambda stats: -stats["secs"])[:5]
+    n_retries = sum(stats["n_attempts"] - 1 for stats in fetched)
+    print(
+        f"> fetched {len(report['shards'])} shards with {n_retries} retries; slowest:",
+        ", ".join(
+            f"{','.join(stats['depts'])} ({stats['secs']}s)" for stats in slowest
+        ),
+    )
+    if len(report["failed_depts"]) > 0:
+        print(f"> failed to fetch departments {','.join(report['failed_depts'])}")
+
+
+# fetches new course information into the staging collections, then
+# swaps them in for the live ones (see Database.commit_term_update());
+# the live course data is untouched until then. For a soft update within
+# the current term, the courses of departments that fail to be fetched
+# are staged from it; a hard update or one to a new term fails instead,
+# as the live courses belong to another term. Returns the numbers of
+# courses and sections, the displaynames of new courses, and the failed
+# departments; raises (after printing) if the update fails
+def process_dept_codes(dept_codes: tuple, current_term_code: str, hard_reset: bool):
     try:
         db = Database()
-        old_enrollments = list(
-            db._db.enrollments.find(
-                {},
-                {
-                    "_id": 0,
-                    "classid": 1,
-                    "last_notif": 1,
-                    "prev_enrollment": 1,
-                    "swap_out": 1,
-                },
-            )
+        keep_failed = (
+            not hard_reset and db.get_current_term_code()[0] == current_term_code
         )
         old_courses = list(db._db.courses.find({}, {"_id": 0, "displayname": 1}))
         old_courses = set(map(lambda x: x["displayname"], old_courses))
         new_courses = set()
 
-        # precompute dictionary of times of last notif
-        old_last_notifs = {}
-        old_prev_enrollments = {}
-        old_swap_outs = {}
-        for enrollment in old_enrollments:
-            if "last_notif" in enrollment:
-                old_last_notifs[enrollment["classid"]] = enrollment["last_notif"]
-            if "prev_enrollment" in enrollment:
-                old_prev_enrollments[enrollment["classid"]] = enrollment[
-                    "prev_enrollment"
-                ]
-            if "swap_out" in enrollment and len(enrollment["swap_out"]) > 0:
-                old_swap_outs[enrollment["classid"]] = enrollment["swap_out"]
-
-        courses = _api.get_courses(term=current_term_code, subject=dept_codes)
-
-        if "subjects" not in courses["term"][0]:
-            raise RuntimeError("no query results")
-
-        if hard_reset:
-            db.reset_db()
-        else:
-            db.soft_reset_db()
-
-        n_courses = 0
-        n_sections = 0
-
-        # iterate through all subjects, courses, and classes
-        for subject in courses["term"][0]["subjects"]:
-            print("> processing dept code", subject["code"])
-            for course in subject["courses"]:
-                courseid = course["course_id"]
-                if db.courses_contains_courseid(courseid):
-                    print("already processed courseid", courseid, "- skipping")
+        db.begin_term_update()
+
+        def stage(writer, documents):
+            for new_mapping, new, new_enrollments in documents:
+                new["content_hash"] = get_course_content_hash(new, new_enrollments)
+                if not writer.add("courses", new):
                     continue
+                new_courses.add(new["displayname"])
+                writer.add("mappings", new_mapping)
+                for new_class_enrollment in new_enrollments:
+                    writer.add("enrollments", new_class_enrollment)
+
+        report = {}
+        with db.get_term_update_writer() as writer:
+            stage(writer, fetch_course_documents(dept_codes, current_term_code, report))
+            print_fetch_report(report)
+            if len(report["failed_depts"]) > 0 and not keep_failed:
+                raise RuntimeError(
+                    f"failed to fetch departments {','.join(report['failed_depts'])}"
+                )
+            stage(writer, db.get_live_course_documents(report["failed_depts"]))
+
+        stats = writer.get_stats()
+        n_courses = stats["courses"]["n_inserted"]
+        n_sections = stats["enrollments"]["n_inserted"]
+        print(
+            f"> staged {n_courses} courses and {n_sections} sections",
+            f"in {stats['total']['n_batches']} batches",
+            f"({stats['total']['docs_per_sec']} documents/sec)",
+        )
+        db.commit_term_update(hard_reset)
+        print(f"> performed a {'hard' if hard_reset else 'soft'} update")
+        return (
+            n_courses,
+            n_sections,
+            list(new_courses - old_courses),
+            report["failed_depts"],
+        )
+
+    except Exception as e:
+        print(f"failed to get new course data with exception message {e}", file=stderr)
+        raise
 
-                # "new" will contain a single course document to be entered
-                # in the courses (and, in part, the mapppings) collection
-                new = {
-                    "courseid": courseid,
-                    "displayname": subject["code"] + course["catalog_number"],
-                    "displayname_whitespace": subject["code"]
-                    + " "
-                    + course["catalog_number"],
-                    "title": course["title"],
-                    "time": time.time(),
-                    "has_reserved_seats": course["detail"]["seat_reservations"] == "Y",
-                }
-
-                for x in course["crosslistings"]:
-                    new["displayname"] += "/" + x["subject"] + x["catalog_number"]
-                    new["displayname_whitespace"] += (
-                        "/" + x["subject"] + " " + x["catalog_number"]
-                    )
 
-                new_courses.add(new["displayname"])
+# fetches new course information and writes only the courses and
+# sections that differ from the stored ones (see
+# Database.sync_courses()), keeping the courses of departments that fail
+# to be fetched; returns the numbers of courses and sections, the
+# displaynames of new courses, and the sync report (with the failed
+# departments under "failed_depts"); raises (after printing) if the
+# sync fails
+def sync_dept_codes(dept_codes: tuple, current_term_code: str):
+    try:
+        db = Database()
+        report = {}
+        # the failed departments are filled in as the documents are fetched
+        res = db.sync_courses(
+            fetch_course_documents(dept_codes, current_term_code, report),
+            kept_depts=report.setdefault("failed_depts", []),
+        )
+        print_fetch_report(report)
+        res["failed_depts"] = report["failed_depts"]
 
-                print("inserting", new["displayname"], "into mappings")
-                db.add_to_mappings(new)
-
-                del new["time"]
-
-                all_new_classes = []
-                lecture_idx = 0
-
-                for class_ in course["classes"]:
-                    meetings = class_["schedule"]["meetings"][0]
-                    section = class_["section"]
-
-                    # skip dummy sections (end with 99)
-                    if section.endswith("99"):
-                        continue
-
-                    # skip 0-capacity sections
-                    if int(class_["capacity"]) == 0:
-                        continue
-
-                    classid = class_["class_number"]
-
-                    # in the (very) occurrence that a class does not have any meetings...
-                    start_time_ = (
-                        "Unknown"
-                        if "start_time" not in meetings
-                        else meetings["start_time"]
-                    )
-                    end_time_ = (
-                        "Unknown"
-                        if "end_time" not in meetings
-                        else meetings["end_time"]
-                    )
-                    days_ = (
-                        ["Unknown"] if len(meetings["days"]) == 0 else meetings["days"]
-                    )
-
-                    # new_class will contain a single lecture, precept,
-                    # etc. for a given course
-                    new_class = {
-                        "classid": classid,
-                        "section": section,
-                        "type_name": class_["type_name"],
-                        "start_time": start_time_,
-                        "end_time": end_time_,
-                        "days": " ".join(days_),
-                        "enrollment": int(class_["enrollment"]),
-                        "capacity": int(class_["capacity"]),
-                        "status_is_open": class_["pu_calc_status"] == "Open",
-                    }
-
-                    # new_class_enrollment will contain enrollment and
-                    # capacity for a given class within a course
-                    new_class_enrollment = {
-                        "classid": classid,
-                        "courseid": courseid,
-                        "section": section,
-                        "enrollment": int(class_["enrollment"]),
-                        "capacity": int(class_["capacity"]),
-                        "swap_out": [],
-                    }
-
-                    if not hard_reset and classid in old_last_notifs:
-                        print("preserving time of last notif for class", classid)
-                        new_class_enrollment["last_notif"] = old_last_notifs[classid]
-
-                    if not hard_reset and classid in old_prev_enrollments:
-                        print("preserving previous enrollment for class", classid)
-                        new_class_enrollment["prev_enrollment"] = old_prev_enrollments[
-                            classid
-                        ]
-
-                    if not hard_reset and classid in old_swap_outs:
-                        print("preserving trades list for class", classid)
-                        new_class_enrollment["swap_out"] = old_swap_outs[classid]
-
-                    print(
-                        "inserting",
-                        new["displayname"],
-                        new_class["section"],
-                        "into enrollments",
-                    )
-                    db.add_to_enrollments(new_class_enrollment)
-
-                    # pre-recorded lectures are marked as 01:00 AM start
-                    if new_class["start_time"] == "01:00 AM":
-                        new_class["start_time"] = "Pre-Recorded"
-                        new_class["end_time"] = ""
-
-                    # lectures should appear before other section types
-                    if class_["type_name"] == "Lecture":
-                        all_new_classes.insert(lecture_idx, new_class)
-                        lecture_idx += 1
-                    else:
-                        all_new_classes.append(new_class)
-
-                    n_sections += 1
-
-                for i, new_class in enumerate(all_new_classes):
-                    new[f'class_{new_class["classid"]}'] = new_class
-
-                print("inserting", new["displayname"], "into courses")
-                db.add_to_courses(new)
-
-                n_courses += 1
-
-        print(f"> processed {n_courses} courses and {n_sections} sections")
-        print(f"> performed a {'hard' if hard_reset else 'soft'} reset")
-        return n_courses, n_sections, list(new_courses - old_courses)
+        print(f"> synced {res['n_courses']} courses and {res['n_sections']} sections")
+        return res["n_courses"], res["n_sections"], res["new_courses"], res
 
     except Exception as e:
-        print(f"failed to get new course data with exception message {e}", file=stderr)
-        return 0, 0
+        print(f"failed to sync course data with exception message {e}", file=stderr)
+        raise